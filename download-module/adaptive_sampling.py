@@ -0,0 +1,104 @@
+import statistics
+
+from datetime import datetime, timedelta
+from config import sampling_window, sampling_min_readings, sampling_stable_band, sampling_spike_threshold, sampling_growth, \
+    sampling_max_factor, sampling_max_interval, sampling_refresh_interval
+
+
+def parse_readings(members):
+    # latency_window:{stream_id} members, "date:latency" (process-raw-results), as (date, latency) sorted by date
+    readings = []
+
+    for member in members:
+        date, latency = member.decode("utf-8").split(":")
+        readings.append((float(date), int(latency)))
+
+    return sorted(readings)
+
+
+def classify(readings):
+    """
+    State of a stream from its latest readings: "spike" if the last one is more than sampling_spike_threshold ms away from
+    the median of the previous ones, "stable" if the last sampling_window stay within sampling_stable_band ms, "variable"
+    otherwise. None with fewer than sampling_min_readings.
+    """
+    values = [latency for _, latency in readings[-sampling_window:]]
+
+    if len(values) < sampling_min_readings:
+        return None
+
+    if abs(values[-1] - statistics.median(values[:-1])) > sampling_spike_threshold:
+        return "spike"
+
+    if max(values) - min(values) <= sampling_stable_band:
+        return "stable"
+
+    return "variable"
+
+
+def next_factor(factor, state):
+    # Stable streams are downloaded every factor CDN refreshes: grows while they stay stable, back to 1 on a spike
+    if state == "stable":
+        return min(factor * sampling_growth, sampling_max_factor)
+
+    if state == "variable":
+        return max(factor // sampling_growth, 1)
+
+    return 1
+
+
+def stretch(factor, thumbnail_date, expires):
+    if factor == 1:
+        return expires
+
+    # factor - 1 CDN refreshes are skipped, at most sampling_max_interval seconds after the current frame
+    stretched = expires + (expires - thumbnail_date) * (factor - 1)
+
+    return max(min(stretched, thumbnail_date + timedelta(seconds=sampling_max_interval)), expires)
+
+
+class AdaptiveSampling:
+    """
+    Per-stream interval factor of a downloader, fed back from the latency readings of its streams (latency_window:{stream_id},
+    written by process-raw-results). Refreshed every sampling_refresh_interval seconds with one pipeline; only new readings
+    move the factor of a stream. replay_sampling.py replays the same decisions on stored latency series.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+        self.factors = {}
+        self.last_readings = {}
+        self.last_refresh = datetime.min
+
+    def refresh(self, stream_ids):
+        if (datetime.now() - self.last_refresh).total_seconds() < sampling_refresh_interval:
+            return
+
+        stream_ids = list(stream_ids)
+        pipeline = self.storage.pipeline(transaction=False)
+
+        for stream_id in stream_ids:
+            pipeline.zrange("latency_window:{}".format(stream_id), 0, -1)
+
+        factors = {}
+        last_readings = {}
+
+        for stream_id, members in zip(stream_ids, pipeline.execute()):
+            readings = parse_readings(members)
+
+            if not readings:
+                continue
+
+            if readings[-1][0] != self.last_readings.get(stream_id):
+                factors[stream_id] = next_factor(self.factors.get(stream_id, 1), classify(readings))
+            else:
+                factors[stream_id] = self.factors.get(stream_id, 1)
+
+            last_readings[stream_id] = readings[-1][0]
+
+        # Streams no longer in the queue are forgotten
+        self.factors = factors
+        self.last_readings = last_readings
+        self.last_refresh = datetime.now()
+
+    def next_time(self, stream_id, thumbnail_date, expires):
+        return stretch(self.factors.get(stream_id, 1), thumbnail_date, expires)
@@ -0,0 +1,168 @@
+import asyncio
+import heapq
+import itertools
+import sys
+import timeit
+import aiohttp
+
+from datetime import datetime, timedelta
+
+from base_downloader import BaseDownloader
+from logger import get_logger
+from config import default_to_sleep, async_max_concurrency, async_pool_size, async_limit_per_host, async_fetch_count, shard_steal_count
+
+
+class AsyncDownloader(BaseDownloader):
+    """
+    Same queues and messages as Downloader, but all streams of the queue are kept in a min-heap keyed on their next
+    download time and downloaded concurrently (up to async_max_concurrency at once) over one keep-alive connection pool.
+    Heap entries of streams that were removed or rescheduled are skipped when popped.
+    """
+    def __init__(self, idx=0):
+        super().__init__(idx, get_logger("thumbnails_async_process{}".format(idx), 'async_downloader_{}'.format(idx)))
+
+        self.heap = []
+        self.sequence = itertools.count()
+        self.in_flight = set()
+        self.tasks = set()
+
+        self.update_streams()
+
+    def schedule(self, stream):
+        heapq.heappush(self.heap, (stream.next_time, next(self.sequence), stream.stream_id))
+
+    def add_stream(self, stream_data):
+        stream = super().add_stream(stream_data)
+        self.schedule(stream)
+
+        return stream
+
+    async def download_thumbnail(self, session, stream):
+        url = self.thumbnail_url(stream)
+
+        try:
+            lateness = (datetime.now() - stream.next_time).total_seconds()
+            start_time = timeit.default_timer()
+
+            # One conditional GET: 304 if the frame has not changed, a redirect to the offline image once the stream ends
+            async with session.get(url, headers=stream.conditional_headers(), allow_redirects=False) as response:
+                content = await response.read() if response.status == 200 else None
+
+            too_fast, has_finished, thumbnail_date = self.handle_response(stream, response.status, response.headers, content, lateness,
+                                                                          timeit.default_timer() - start_time)
+
+            if thumbnail_date:
+                # Redis, cropping and storage controllers block: keep them off the event loop
+                self.count_stored(await asyncio.get_running_loop().run_in_executor(None, self.store_thumbnail, stream, thumbnail_date, content))
+
+            return too_fast, has_finished
+        except Exception as e:
+            return self.download_failed(stream, e)
+
+    async def probe(self, session, stream, semaphore):
+        try:
+            async with semaphore:
+                _, has_finished = await self.download_thumbnail(session, stream)
+        finally:
+            self.in_flight.discard(stream.stream_id)
+
+        if self.streams.get(stream.stream_id) is not stream:
+            # Moved to another queue meanwhile
+            return
+
+        if has_finished:
+            # Removed from the queue by the next report_finished
+            self.finish_stream(stream)
+            return
+
+        # Failed downloads and already expired thumbnails are retried after default_to_sleep, as in Downloader
+        if stream.next_time <= datetime.now():
+            stream.next_time = datetime.now() + timedelta(seconds=default_to_sleep)
+
+        self.schedule(stream)
+        self.wakeup.set()
+
+    async def scheduler(self, session):
+        semaphore = asyncio.Semaphore(async_max_concurrency)
+
+        while True:
+            now = datetime.now()
+
+            while self.heap and self.heap[0][0] <= now:
+                next_time, _, stream_id = heapq.heappop(self.heap)
+                stream = self.streams.get(stream_id)
+
+                if stream is None or stream.next_time != next_time or stream_id in self.in_flight:
+                    continue
+
+                self.in_flight.add(stream_id)
+
+                task = asyncio.create_task(self.probe(session, stream, semaphore))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+            to_sleep = (self.heap[0][0] - now).total_seconds() if self.heap else default_to_sleep
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=max(to_sleep, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def check_shard(self):
+        # Idle: nothing overdue and room for more downloads in flight
+        spare = async_max_concurrency - len(self.in_flight)
+        if spare > async_max_concurrency / 2 and (not self.heap or self.heap[0][0] > datetime.now()):
+            if self.steal(min(spare, shard_steal_count)):
+                self.wakeup.set()
+
+        self.heartbeat()
+
+    async def control(self):
+        while True:
+            if self.stop_requested():
+                break
+
+            # Finished streams leave the queue before it is compared with the streams kept
+            self.report_finished()
+
+            if self.queue.scard("streams_{}".format(self.idx)) != len(self.streams.keys()):
+                self.update_streams()
+                self.wakeup.set()
+
+            for stream in self.resumed_streams():
+                self.schedule(stream)
+                self.wakeup.set()
+
+            self.storage.flush()
+            self.refresh()
+
+            if self.fetch_new_streams(async_fetch_count):
+                self.wakeup.set()
+
+            if self.shard:
+                self.check_shard()
+
+            await asyncio.sleep(default_to_sleep)
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+
+        connector = aiohttp.TCPConnector(limit=async_pool_size, limit_per_host=async_limit_per_host)
+        timeout = aiohttp.ClientTimeout(total=5)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            scheduler = asyncio.create_task(self.scheduler(session))
+
+            await self.control()
+
+            scheduler.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        self.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2:
+        downloader = AsyncDownloader(sys.argv[1])
+        asyncio.run(downloader.run())
@@ -0,0 +1,255 @@
+import email.utils as eut
+import json
+import redis
+
+from datetime import datetime, timedelta
+from storage.local_storage_controller import LocalStorageController
+from storage.pack_storage_controller import PackStorageController
+
+from stream_to_probe import StreamToProbe
+from sharding import ShardWorker
+from roi_cropper import RoiCropper
+from resolution_policy import ResolutionPolicy
+from metrics import DownloadMetrics
+from adaptive_sampling import AdaptiveSampling
+from yield_backoff import YieldBackoff
+from game_changes import GameChanges
+from config import width, height, redis_host, redis_password, redis_port, sharding_enabled, shard_heartbeat_interval, pack_storage, \
+    crop_at_download, resolution_policy, adaptive_sampling, yield_backoff, game_changes, game_paused_interval
+
+
+def parse_http_date(date_str):
+    return datetime.fromtimestamp(eut.mktime_tz(eut.parsedate_tz(date_str)))
+
+
+class BaseDownloader:
+    """
+    Queues, schedule and storage of the thumbnails of one downloader process, shared by Downloader (requests, one
+    stream at a time) and AsyncDownloader (aiohttp, concurrent). Subclasses only fetch the thumbnails and decide when.
+    """
+    def __init__(self, idx, logger):
+        self.idx = idx
+        self.logger = logger
+        self.queue = redis.Redis(host=redis_host, port=redis_port, db=0, password=redis_password)
+        self.storage = PackStorageController(self.queue, idx) if pack_storage else LocalStorageController()
+        self.cropper = RoiCropper() if crop_at_download else None
+        self.policy = ResolutionPolicy() if resolution_policy else None
+        self.metrics = DownloadMetrics(self.queue, idx)
+        self.sampling = AdaptiveSampling(self.queue) if adaptive_sampling else None
+        self.backoff = YieldBackoff(self.queue) if yield_backoff else None
+        self.games = GameChanges(self.queue) if game_changes else None
+
+        self.streams = {}
+        self.finished = []
+
+        self.shard = ShardWorker(self.queue, idx) if sharding_enabled else None
+        self.last_heartbeat = datetime.min
+
+    def add_stream(self, stream_data):
+        stream = StreamToProbe(stream_data)
+        self.streams[stream.stream_id] = stream
+
+        return stream
+
+    def load_streams(self, stream_ids):
+        # Streams assigned to this downloader (queue re-read, stolen), read from current_probes in one call
+        stream_ids = list(stream_ids)
+        if not stream_ids:
+            return []
+
+        added = []
+        gone = []
+
+        for stream_id, stream_data in zip(stream_ids, self.queue.hmget("current_probes", stream_ids)):
+            if stream_data:
+                added.append(self.add_stream(json.loads(stream_data)))
+            else:
+                gone.append(stream_id)
+
+        if gone:
+            self.queue.srem("streams_{}".format(self.idx), *gone)
+
+        if self.games:
+            self.games.seed(added)
+
+        return added
+
+    def update_streams(self):
+        # The coordinator moves streams between queues: drop the ones taken away, keep the schedule of the others
+        stream_ids = set([x.decode("utf-8") for x in self.queue.smembers("streams_{}".format(self.idx))])
+        self.logger.info("Re-read queue, current number of streams: {}".format(len(stream_ids)))
+
+        for stream_id in list(self.streams.keys()):
+            if stream_id not in stream_ids:
+                self.streams.pop(stream_id)
+
+        return self.load_streams(stream_ids - set(self.streams.keys()))
+
+    def fetch_new_streams(self, count):
+        new_streams = self.queue.spop("to_download", count=count)
+
+        if not new_streams:
+            return []
+
+        added = [self.add_stream(json.loads(new_stream.decode("utf-8"))) for new_stream in new_streams]
+        self.queue.sadd("streams_{}".format(self.idx), *[stream.stream_id for stream in added])
+
+        if self.games:
+            self.games.seed(added)
+
+        self.logger.info("Got new streams to follow, current total: {}".format(len(self.streams.keys())))
+
+        return added
+
+    def steal(self, max_streams):
+        stolen = self.shard.steal(max_streams)
+        added = self.load_streams(stolen)
+
+        if stolen:
+            self.logger.info("Stole {} overdue streams, current total: {}".format(len(stolen), len(self.streams.keys())))
+
+        return added
+
+    def heartbeat(self):
+        if datetime.now() - self.last_heartbeat > timedelta(seconds=shard_heartbeat_interval):
+            self.shard.heartbeat({stream_id: stream.next_time for stream_id, stream in self.streams.items()})
+            self.last_heartbeat = datetime.now()
+
+    def stop_requested(self):
+        if self.queue.scard("streams_{}_stop".format(self.idx)) == 0:
+            return False
+
+        self.queue.spop("streams_{}_stop".format(self.idx), count=self.queue.scard("streams_{}_stop".format(self.idx)))
+        self.logger.info("Got a stop signal, finishing.")
+
+        if self.shard:
+            self.shard.leave()
+
+        return True
+
+    def resumed_streams(self):
+        # Streams back to a game probed: downloaded right away
+        if not self.games:
+            return []
+
+        resumed = [stream for stream in self.games.poll(self.streams) if not stream.paused]
+
+        for stream in resumed:
+            stream.next_time = datetime.now()
+
+        return resumed
+
+    def finish_stream(self, stream):
+        self.streams.pop(stream.stream_id, None)
+        self.finished.append((stream.user_id, stream.stream_id))
+
+    def report_finished(self):
+        if not self.finished:
+            return
+
+        pipeline = self.queue.pipeline(transaction=False)
+        pipeline.srem("streams_{}".format(self.idx), *[stream_id for _, stream_id in self.finished])
+        pipeline.sadd("from_workers", json.dumps({"origin": self.idx, "finished": self.finished}))
+        pipeline.execute()
+
+        self.finished = []
+
+    def refresh(self):
+        # Feedback from processed thumbnails and the metrics of the cycle
+        if self.sampling:
+            self.sampling.refresh(self.streams.keys())
+        if self.backoff:
+            self.backoff.refresh(self.streams)
+
+        self.metrics.queue_depth(len(self.streams))
+        self.metrics.flush()
+
+    def thumbnail_url(self, stream):
+        size_width, size_height = self.policy.size(stream.game_id) if self.policy else (width, height)
+
+        return stream.url.format_map({'width': size_width, 'height': size_height})
+
+    def handle_response(self, stream, status, headers, content, lateness, request_seconds):
+        """
+        Schedules the next download of stream from the answer to its conditional GET (content: body of 200 answers).
+        Returns whether the downloader is running late, whether the stream has finished and the date of the thumbnail
+        if it is a new frame to store (None otherwise).
+        """
+        self.metrics.observe("thumbnail_request_seconds", request_seconds)
+        self.metrics.observe("thumbnail_lateness_seconds", lateness)
+
+        if status not in (200, 304):
+            # Streamer has finished streaming
+            self.logger.info("Streamer has finished {}. Status code: {}".format(stream.stream_id, status))
+            self.metrics.count("thumbnail_downloads", 'outcome="finished"')
+            return True, True, None
+
+        thumbnail_date = parse_http_date(headers['Date'])
+        expires = parse_http_date(headers['Expires'])
+
+        too_fast = False
+        if datetime.now() - stream.next_time > timedelta(minutes=10):
+            self.logger.info("Too late downloading {}, should slowdown".format(stream.stream_id))
+            too_fast = True
+
+        stream.next_time = self.sampling.next_time(stream.stream_id, thumbnail_date, expires) if self.sampling else expires
+        if self.backoff:
+            stream.next_time = self.backoff.delay(stream, stream.next_time)
+        if stream.paused:
+            stream.next_time = max(stream.next_time, datetime.now() + timedelta(seconds=game_paused_interval))
+
+        if content is None or not stream.is_new_frame(headers, content):
+            self.metrics.count("thumbnail_downloads", 'outcome="unchanged"')
+            return too_fast, False, None
+
+        self.metrics.observe("thumbnail_bytes", len(content))
+
+        return too_fast, False, thumbnail_date
+
+    def current_game(self, stream):
+        # Local map kept up to date by game changes (None while paused), or current_probes read for every thumbnail
+        if self.games:
+            return None if stream.paused else stream.game_id
+
+        stream_data = self.queue.hget("current_probes", stream.stream_id)
+        if stream_data:
+            # Size of the next downloads follows game changes
+            stream.game_id = json.loads(stream_data)["game_id"]
+            return stream.game_id
+
+        return None
+
+    def store_thumbnail(self, stream, thumbnail_date, content):
+        """
+        Stores a new frame under the current game of the stream and queues it for processing. Blocks (Redis, decoding,
+        disk, S3): AsyncDownloader runs it in its executor. Returns the outcome to count.
+        """
+        game_id = self.current_game(stream)
+
+        if not game_id:
+            return "paused" if stream.paused else None
+
+        # With crop_at_download only the areas of interest are stored, one image each
+        crops = self.cropper.crop(game_id, content) if self.cropper else {"": content}
+        file_paths = [self.storage.save_image(stream, game_id, thumbnail_date, data, suffix) for suffix, data in crops.items()]
+        file_paths = [file_path for file_path in file_paths if file_path]
+
+        if file_paths:
+            self.queue.sadd("raw_images", *file_paths)
+
+        return "stored"
+
+    def count_stored(self, outcome):
+        if outcome:
+            self.metrics.count("thumbnail_downloads", 'outcome="{}"'.format(outcome))
+
+    def download_failed(self, stream, error):
+        self.logger.info("Fatal error downloading {}. Error: {}".format(stream.stream_id, error))
+        self.metrics.count("thumbnail_downloads", 'outcome="error"')
+
+        return False, False
+
+    def close(self):
+        self.report_finished()
+        self.storage.close()
+        self.metrics.flush(force=True)
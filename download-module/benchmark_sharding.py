@@ -0,0 +1,182 @@
+import argparse
+import heapq
+import random
+
+from sharding import HashRing, ring_hash
+
+
+class ModuloRing:
+    # Baseline: hash modulo the number of workers, (almost) every stream moves when a worker joins or leaves
+    def __init__(self, workers):
+        self.workers = sorted(set([str(w) for w in workers]))
+
+    def owner(self, stream_id):
+        return self.workers[ring_hash(stream_id) % len(self.workers)] if self.workers else None
+
+
+class Simulation:
+    """
+    Discrete-time simulation (1 second steps) of the downloaders: every stream has to be downloaded every period seconds,
+    every worker downloads at most capacity streams per second, earliest due first. Churn events crash, restart, add or
+    remove workers; crashes are only noticed after the heartbeat timeout, restarted workers come back restart_delay later.
+    """
+    def __init__(self, args, ring_class, steal):
+        self.args = args
+        self.ring_class = ring_class
+        self.steal = steal
+
+        rng = random.Random(args.seed)
+        self.stream_ids = ["stream{}".format(idx) for idx in range(args.streams)]
+        self.due = {s: rng.uniform(0, args.period) for s in self.stream_ids}
+
+        self.running = set([str(w) for w in range(args.workers)])
+        self.ring = ring_class(self.running)
+        self.queues = {w: [] for w in self.running}
+        self.holder = {}
+
+        for s in self.stream_ids:
+            self.assign(s, self.ring.owner(s))
+
+        self.lateness = []
+        self.moved = 0
+        self.stolen = 0
+
+    def assign(self, stream_id, worker):
+        self.holder[stream_id] = worker
+        heapq.heappush(self.queues.setdefault(worker, []), (self.due[stream_id], stream_id))
+
+    def valid(self, worker, entry):
+        due, stream_id = entry
+        return self.holder[stream_id] == worker and self.due[stream_id] == due
+
+    def rebalance(self, alive):
+        # As ThumbnailDownloader.rebalance: streams of the arcs that changed owner, plus everything held by dead workers
+        ring = self.ring_class(alive)
+
+        for s in self.stream_ids:
+            if ring.owner(s) != self.ring.owner(s) or self.holder[s] not in alive:
+                if ring.owner(s) != self.holder[s]:
+                    self.moved += 1
+                self.assign(s, ring.owner(s))
+
+        for worker in set(self.queues.keys()) - alive:
+            self.queues.pop(worker)
+
+        self.ring = ring
+
+    def churn_events(self):
+        args = self.args
+        events = {}
+
+        for idx, t in enumerate(args.crash_at):
+            events.setdefault(t, []).append(("crash", str(idx % args.workers)))
+        for t in args.add_at:
+            events.setdefault(t, []).append(("add", None))
+        for t in args.remove_at:
+            events.setdefault(t, []).append(("remove", None))
+
+        return events
+
+    def run(self):
+        args = self.args
+        events = self.churn_events()
+        pending = {}
+        next_worker = args.workers
+
+        for t in range(args.duration):
+            for event, worker in events.get(t, []):
+                if event == "crash":
+                    # Stops downloading now, noticed when its heartbeat expires, replaced restart_delay seconds later
+                    self.running.discard(worker)
+                    pending.setdefault(t + args.heartbeat_timeout, []).append(("dead", worker))
+                    pending.setdefault(t + args.heartbeat_timeout + args.restart_delay, []).append(("join", worker))
+                elif event == "add":
+                    pending.setdefault(t, []).append(("join", str(next_worker)))
+                    next_worker += 1
+                elif event == "remove":
+                    # Graceful stop: leaves the heartbeats right away
+                    worker = max(self.running, key=int)
+                    self.running.discard(worker)
+                    pending.setdefault(t, []).append(("dead", worker))
+
+            for event, worker in pending.pop(t, []):
+                if event == "join":
+                    self.running.add(worker)
+                    self.queues.setdefault(worker, [])
+                self.rebalance(set(self.ring.workers) - set([worker]) if event == "dead" else set(self.ring.workers) | set([worker]))
+
+            spare = {}
+            for worker in self.running:
+                queue = self.queues.get(worker)
+                done = 0
+
+                while queue and done < args.capacity and queue[0][0] <= t:
+                    entry = heapq.heappop(queue)
+
+                    if not self.valid(worker, entry):
+                        continue
+
+                    self.lateness.append(t - entry[0])
+                    self.due[entry[1]] = t + args.period
+                    heapq.heappush(queue, (self.due[entry[1]], entry[1]))
+                    done += 1
+
+                spare[worker] = args.capacity - done
+
+            if self.steal:
+                self.steal_overdue(t, spare)
+
+        return sorted(self.lateness)
+
+    def steal_overdue(self, t, spare):
+        # Idle workers take overdue streams from every worker with a live heartbeat (crashed ones included until it expires)
+        for thief in sorted(spare, key=lambda w: -spare[w]):
+            budget = min(spare[thief], self.args.steal_count)
+
+            for victim, queue in self.queues.items():
+                if victim == thief or victim not in self.ring.workers:
+                    continue
+
+                while budget > 0 and queue and queue[0][0] <= t - self.args.steal_after:
+                    entry = heapq.heappop(queue)
+
+                    if self.valid(victim, entry):
+                        self.assign(entry[1], thief)
+                        self.stolen += 1
+                        budget -= 1
+
+
+def percentile(values, p):
+    # values sorted
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def print_results(name, lateness, simulation):
+    print("{:<28} p50 {:>6.1f}s  p95 {:>6.1f}s  p99 {:>7.1f}s  max {:>7.1f}s  >60s {:>6.2%}  moved {:>7}  stolen {:>7}".format(
+        name, percentile(lateness, 50), percentile(lateness, 95), percentile(lateness, 99), lateness[-1], sum([l > 60 for l in lateness]) / len(lateness),
+        simulation.moved, simulation.stolen))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate downloader sharding under worker churn and measure schedule lateness")
+    parser.add_argument("--streams", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--capacity", type=int, default=10, help="Downloads per second of a worker")
+    parser.add_argument("--period", type=int, default=300, help="Seconds between two downloads of a stream")
+    parser.add_argument("--duration", type=int, default=3600)
+    parser.add_argument("--heartbeat-timeout", type=int, default=60)
+    parser.add_argument("--restart-delay", type=int, default=10)
+    parser.add_argument("--steal-after", type=int, default=30)
+    parser.add_argument("--steal-count", type=int, default=50)
+    parser.add_argument("--crash-at", type=int, nargs="*", default=[900, 2400])
+    parser.add_argument("--add-at", type=int, nargs="*", default=[1500])
+    parser.add_argument("--remove-at", type=int, nargs="*", default=[3000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("{} streams, {} workers x {} downloads/sec, period {}s, crashes at {}, joins at {}, leaves at {}".format(
+        args.streams, args.workers, args.capacity, args.period, args.crash_at, args.add_at, args.remove_at))
+
+    for name, ring_class, steal in [("modulo", ModuloRing, False), ("consistent hashing", HashRing, False), ("consistent hashing + steal", HashRing, True)]:
+        simulation = Simulation(args, ring_class, steal)
+        print_results(name, simulation.run(), simulation)
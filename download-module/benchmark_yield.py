@@ -0,0 +1,131 @@
+import argparse
+import json
+import random
+
+from yield_backoff import next_level, backoff_seconds
+
+
+def load_yields(path):
+    # JSON lines with the images / readings of streams (e.g. HGETALL of stream_yield:* keys), as yield per thumbnail
+    yields = []
+
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if int(entry["images"]) > 0:
+                    yields.append(int(entry["readings"]) / int(entry["images"]))
+
+    return yields
+
+
+class Workload:
+    """
+    One day of tracked streams: duration, share of the thumbnails that give a latency value and, for streams that start
+    without readable overlay but show it later (recovering), the moment they do. Yields are replayed from stream_yield
+    snapshots (--yields) or drawn: zero_share of the streams never give a value.
+    """
+    def __init__(self, args):
+        rng = random.Random(args.seed)
+        replayed = load_yields(args.yields) if args.yields else None
+        self.streams = []
+
+        for _ in range(args.streams):
+            if replayed:
+                p = rng.choice(replayed)
+            else:
+                p = 0 if rng.random() < args.zero_share else rng.uniform(0.3, 0.95)
+
+            duration = min(rng.expovariate(1 / (args.hours * 3600)), 24 * 3600)
+            frames = int(duration // args.period) + 1
+            recover_at = None
+
+            if p == 0 and rng.random() < args.recover_share:
+                recover_at = rng.randrange(frames)
+
+            values = [rng.random() < (p if recover_at is None or idx < recover_at else args.recovered_yield) for idx in range(frames)]
+            known = p == 0 and rng.random() < args.known_users
+
+            self.streams.append({"values": values, "recover_at": recover_at, "known": known})
+
+
+def replay(stream, args, backoff):
+    """
+    Frames downloaded from one stream. Their thumbnails are processed delay seconds later; each download first applies
+    the results processed by then, as the downloader's refresh of stream_yield does.
+    """
+    values = stream["values"]
+    level = 1 if backoff and stream["known"] else 0
+    streak, last_streak, readings = 0, 0, 0
+    pending = []
+    downloaded = []
+    t = 0
+
+    while t < len(values) * args.period:
+        frame = int(t // args.period)
+
+        if backoff:
+            while pending and pending[0][0] <= t:
+                _, has_value = pending.pop(0)
+                readings += has_value
+                streak = 0 if has_value else streak + 1
+
+            level = next_level(level, streak, last_streak, readings)
+            last_streak = streak
+
+        downloaded.append(frame)
+        pending.append((t + args.delay, values[frame]))
+
+        t += args.period + (backoff_seconds(level) if backoff else 0)
+
+    return downloaded
+
+
+def run(workload, args, backoff):
+    images, readings, delays = 0, 0, []
+
+    for stream in workload.streams:
+        downloaded = replay(stream, args, backoff)
+        images += len(downloaded)
+        readings += sum([stream["values"][frame] for frame in downloaded])
+
+        if stream["recover_at"] is not None:
+            found = [frame for frame in downloaded if frame >= stream["recover_at"] and stream["values"][frame]]
+            first_value = next((idx for idx, v in enumerate(stream["values"]) if idx >= stream["recover_at"] and v), None)
+            if found and first_value is not None:
+                delays.append((found[0] - first_value) * args.period)
+
+    return images, readings, delays
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a day of streams with and without yield backoff: OCR time saved and latency values lost")
+    parser.add_argument("--streams", type=int, default=20000, help="Streams tracked per day")
+    parser.add_argument("--yields", default=None, help="JSON lines of stream_yield hashes to draw the yield of streams from")
+    parser.add_argument("--zero-share", type=float, default=0.4, help="Share of streams without readable overlay (drawn yields)")
+    parser.add_argument("--recover-share", type=float, default=0.1, help="Share of those whose overlay shows up mid-stream")
+    parser.add_argument("--recovered-yield", type=float, default=0.8)
+    parser.add_argument("--known-users", type=float, default=0.5, help="Share of streams without value whose user had none before")
+    parser.add_argument("--hours", type=float, default=3, help="Mean stream duration")
+    parser.add_argument("--period", type=int, default=300, help="Seconds between two CDN refreshes")
+    parser.add_argument("--delay", type=int, default=3600, help="Seconds between the download of a thumbnail and its yield in Redis")
+    parser.add_argument("--gpu-seconds", type=float, default=0.08, help="GPU OCR time per thumbnail (EasyOCR + PaddleOCR)")
+    parser.add_argument("--cpu-seconds", type=float, default=0.3, help="CPU OCR time per thumbnail (Tesseract)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workload = Workload(args)
+    base_images, base_readings, _ = run(workload, args, False)
+    images, readings, delays = run(workload, args, True)
+
+    print("{} streams/day, period {}s, processing delay {}s".format(args.streams, args.period, args.delay))
+    print("thumbnails OCR'd/day {:>9} -> {:>9} (saved {:>6.1%})".format(base_images, images, 1 - images / base_images))
+    print("GPU OCR time/day     {:>8.1f}h -> {:>8.1f}h (saved {:>6.1f}h)".format(
+        base_images * args.gpu_seconds / 3600, images * args.gpu_seconds / 3600, (base_images - images) * args.gpu_seconds / 3600))
+    print("CPU OCR time/day     {:>8.1f}h -> {:>8.1f}h (saved {:>6.1f}h)".format(
+        base_images * args.cpu_seconds / 3600, images * args.cpu_seconds / 3600, (base_images - images) * args.cpu_seconds / 3600))
+    print("latency values/day   {:>9} -> {:>9} (lost  {:>6.2%})".format(base_readings, readings, 1 - readings / base_readings if base_readings else 0))
+
+    if delays:
+        delays = sorted(delays)
+        print("recovering streams: first value found {:.0f}s later (median), {:.0f}s (max)".format(delays[len(delays) // 2], delays[-1]))
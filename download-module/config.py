@@ -1,6 +1,14 @@
 mongo_host = "127.0.0.1"
 games_to_probe = ["twitchID_1", "twitchID_2"]
 users_batch_size = 4000
+# SSCAN COUNT hint used by the coordinator to walk to_probe in search of users not queried yet
+users_scan_count = 1000
+# SSCAN calls per walk at most: the next loop of the coordinator resumes from the cursor returned
+users_scan_pages = 20
+# Take users likely to be live at this hour of the week first (online_scores:{hour} from the streams-tracker's online_profiles),
+# leaving probe_exploration of each batch to the walk over to_probe
+prioritized_probing = False
+probe_exploration = 0.2
 
 redis_host = "127.0.0.1"
 redis_password = ""
@@ -15,11 +23,24 @@ offline_expire = 2 * 30
 finished_expire = 6 * 30
 default_to_sleep = 5
 
+# Download metrics: histograms kept by each downloader and added to the download_metrics hash every metrics_flush_interval
+# seconds, served to Prometheus by metrics_exporter on metrics_port
+metrics_flush_interval = 10
+metrics_port = 9108
+
 twitch_api_id = ""
 twitch_client_secret = ""
 
 rate_limit_safety_factor = 0.8
 
+# twitch_api_process: chunks of 100 users queried concurrently. With shared_rate_limit the Helix bucket is kept in Redis and
+# shared with the streams-tracker (same Redis and credentials): twitch_api_process leaves rate_limit_safety_factor of it untouched
+api_concurrency = 8
+api_max_retries = 5
+api_retry_backoff = 0.5
+api_request_timeout = 10
+shared_rate_limit = False
+
 max_queue_size = 300
 min_queue_size = 100
 
@@ -27,11 +48,94 @@ downloader_fetch_count = 10
 
 path_to_storage = ""
 
+# Crop at download: only the areas of interest of each thumbnail (data/areas_of_interest.json) and extra_areas are stored,
+# as in pre-process-images (keep both files in sync)
+crop_at_download = False
+extra_areas = {}
+
+# Thumbnails of the games in data/resolution_policy.json (pre-process-images' calibrate_resolution) are requested at the
+# size listed there instead of width x height
+resolution_policy = False
+
+# Adaptive sampling: the latest sampling_window latency readings of each stream (latency_window:{stream_id}, from
+# process-raw-results) are read every sampling_refresh_interval seconds. While they stay within sampling_stable_band ms the
+# stream is downloaded every factor CDN refreshes, factor growing by sampling_growth up to sampling_max_factor (and at most
+# sampling_max_interval seconds apart); more variance shrinks it, a reading sampling_spike_threshold ms off resets it to 1
+adaptive_sampling = False
+sampling_window = 12
+sampling_min_readings = 6
+sampling_stable_band = 15
+sampling_spike_threshold = 30
+sampling_growth = 2
+sampling_max_factor = 4
+sampling_max_interval = 20 * 60
+sampling_refresh_interval = 60
+
+# Yield backoff: streams with yield_min_images thumbnails processed in a row without a latency value (stream_yield:{stream_id},
+# from process-raw-results) are downloaded yield_base_backoff seconds later than due, doubled after every new batch without
+# value up to yield_max_backoff (occasional probes), read every yield_refresh_interval seconds. New streams of users in the
+# same case (user_yield:{user_id}) start backed off
+yield_backoff = False
+yield_min_images = 20
+yield_base_backoff = 10 * 60
+yield_max_backoff = 3 * 60 * 60
+yield_refresh_interval = 60
+
+# Game changes: the game of every stream is kept in memory and updated from the game changes published by the
+# streams-tracker's track_current (stream_games, game_changes_channel; same Redis and publish_game_changes) instead of being
+# read from current_probes for every thumbnail. Streams switching to a game not in games_to_probe are paused: downloaded
+# every game_paused_interval seconds to notice their end, not stored, until they switch back
+game_changes = False
+game_changes_channel = "game_changes"
+game_paused_interval = 10 * 60
+
+# Pack storage: thumbnails are appended to packs (sealed at pack_shard_size bytes or after pack_max_age seconds) with a side
+# index, queued in raw_packs instead of one file per thumbnail in raw_images. With pack_upload sealed packs are uploaded to
+# raw_packs_path in parts of pack_part_size, pack_upload_concurrency parts at once
+pack_storage = False
+pack_shard_size = 256 * 1024 * 1024
+pack_max_age = 10 * 60
+pack_upload = False
+pack_part_size = 16 * 1024 * 1024
+pack_upload_concurrency = 8
+
 # S3 information
 s3_url = ""
 rw_access_key = ""
 rw_secret_key = ""
 bucket_name = ""
 raw_images_path = ""
+raw_packs_path = ""
+
+secret_key = ""
+twitch_api_url = "https://api.twitch.tv/helix"
+twitch_auth_url = "https://id.twitch.tv/oauth2/token"
+
+# EventSub: online/offline/game changes of up to eventsub_max_users users are pushed by Twitch to eventsub_callback_url
+# (forwarded to eventsub_port, path /eventsub). Offline users are then only re-polled every eventsub_offline_expire minutes
+eventsub_enabled = False
+eventsub_callback_url = ""
+eventsub_secret = ""
+eventsub_port = 8443
+eventsub_max_users = 3300
+eventsub_subscribe_interval = 60
+eventsub_offline_expire = 6 * 60
+
+# Asyncio downloader: the coordinator starts async_downloader.py processes instead of downloader.py (raise max_queue_size
+# and min_queue_size accordingly: each process keeps thousands of streams on schedule)
+async_downloader = False
+async_max_concurrency = 200
+async_pool_size = 100
+async_limit_per_host = 50
+async_fetch_count = 100
 
-secret_key = ""
\ No newline at end of file
+# Sharding: the coordinator keeps shard_workers downloaders running and assigns streams to them by consistent hashing
+# (shard_replicas points per worker). Workers heartbeat every shard_heartbeat_interval seconds and are replaced after
+# shard_worker_timeout seconds without one. Idle workers take up to shard_steal_count streams overdue by shard_steal_after seconds
+sharding_enabled = False
+shard_workers = 4
+shard_replicas = 64
+shard_heartbeat_interval = 10
+shard_worker_timeout = 60
+shard_steal_after = 30
+shard_steal_count = 50
@@ -9,10 +9,82 @@ import os
 from time import sleep
 from datetime import datetime, timedelta
 from logger import get_logger
+from sharding import HashRing, live_workers
 
-from config import redis_host, redis_password, redis_port, users_batch_size, default_to_sleep, max_queue_size, min_queue_size, secret_key, base_path
+from config import redis_host, redis_password, redis_port, users_batch_size, default_to_sleep, max_queue_size, min_queue_size, secret_key, base_path, \
+    eventsub_enabled, eventsub_offline_expire, async_downloader, users_scan_count, users_scan_pages, sharding_enabled, shard_workers, shard_heartbeat_interval, \
+    shard_worker_timeout, prioritized_probing, probe_exploration, yield_backoff, yield_min_images
    
 
+# KEYS: current_probes[, to_download]. ARGV: stream_id, stream pairs. Streams not being probed yet are sent to the downloaders
+# through to_download (when given, otherwise the coordinator assigns them). Returns the ids of those streams
+REGISTER_ONLINE = """
+local new_streams = {}
+for idx = 1, #ARGV, 2 do
+    if redis.call('HEXISTS', KEYS[1], ARGV[idx]) == 0 then
+        if KEYS[2] then
+            redis.call('SADD', KEYS[2], ARGV[idx + 1])
+        end
+        new_streams[#new_streams + 1] = ARGV[idx]
+    end
+    redis.call('HSET', KEYS[1], ARGV[idx], ARGV[idx + 1])
+end
+return new_streams
+"""
+
+# KEYS: to_probe, queried. ARGV: cursor, batch size, scan count, max pages. Walks to_probe with SSCAN from the cursor until batch size
+# users not queried yet are found (and marks them as queried), the end of the set is reached or max pages SSCAN calls were made, so
+# that a mostly queried to_probe does not block Redis. Returns the next cursor followed by the users
+SELECT_USERS = """
+local cursor = ARGV[1]
+local batch_size = tonumber(ARGV[2])
+local max_pages = tonumber(ARGV[4])
+local pages = 0
+local users = {}
+repeat
+    local page = redis.call('SSCAN', KEYS[1], cursor, 'COUNT', ARGV[3])
+    cursor = page[1]
+    pages = pages + 1
+    for _, user in ipairs(page[2]) do
+        if redis.call('SADD', KEYS[2], user) == 1 then
+            users[#users + 1] = user
+        end
+    end
+until cursor == '0' or #users >= batch_size or pages >= max_pages
+table.insert(users, 1, cursor)
+return users
+"""
+
+# KEYS: online_scores:{hour}, queried. ARGV: rank, batch size, page size, max pages. Same as SELECT_USERS over the users scored for
+# the current hour of the week, best scores first. Returns the next rank (-1 once the end is reached) followed by the users
+SELECT_SCORED = """
+local rank = tonumber(ARGV[1])
+local batch_size = tonumber(ARGV[2])
+local max_pages = tonumber(ARGV[4])
+local pages = 0
+local users = {}
+local page
+repeat
+    page = redis.call('ZREVRANGE', KEYS[1], rank, rank + tonumber(ARGV[3]) - 1)
+    pages = pages + 1
+    for _, user in ipairs(page) do
+        rank = rank + 1
+        if redis.call('SADD', KEYS[2], user) == 1 then
+            users[#users + 1] = user
+            if #users >= batch_size then
+                break
+            end
+        end
+    end
+until #page == 0 or #users >= batch_size or pages >= max_pages
+if #page == 0 then
+    rank = -1
+end
+table.insert(users, 1, rank)
+return users
+"""
+
+
 class ThumbnailDownloader:
     def __init__(self):
         self.offline = []
@@ -21,9 +93,36 @@ class ThumbnailDownloader:
         self.logger = get_logger("thumbnails_downloader")
         self.last_process_check = datetime.now()
 
+        self.register_online = self.storage.register_script(REGISTER_ONLINE)
+        self.select_users = self.storage.register_script(SELECT_USERS)
+        self.users_cursor = 0
+
+        self.select_scored = self.storage.register_script(SELECT_SCORED)
+        self.scores_hour = None
+        self.scores_rank = 0
+
+        # Workers the streams are assigned to, as of the last rebalance (also before a restart of the coordinator)
+        shard_ring = self.storage.get("shard_ring")
+        self.ring = HashRing(json.loads(shard_ring) if shard_ring else [])
+        self.started = {}
+        self.processes = {}
+
+    def hash_id(self, value):
+        return hmac.new(secret_key.encode("utf-8"), value.encode("utf-8"), hashlib.sha1).hexdigest()
+
+    def drain(self, *keys):
+        # Reads and empties the message sets in one round trip, nothing added meanwhile is lost
+        pipeline = self.storage.pipeline(transaction=True)
+
+        for key in keys:
+            pipeline.smembers(key)
+        pipeline.delete(*keys)
+
+        return pipeline.execute()[:-1]
+
     def loop(self):
         while True:            
-            msgs = self.storage.spop("from_workers", count=self.storage.scard("from_workers"))
+            msgs, online, offline = self.drain("from_workers", "twitch_api_online", "twitch_api_offline")
 
             if msgs:
                 finished = []
@@ -38,29 +137,36 @@ class ThumbnailDownloader:
                 self.update_storage([s[0] for s in finished], "finished")
                 self.update_current_probes([s[1] for s in finished])
 
-            online = self.storage.spop("twitch_api_online", count=self.storage.scard("twitch_api_online"))
             if online:
                 self.logger.info("API process is ready. Users online: {}".format(len(online)))
-                new_streams_online = set()
+                streams = {}
 
                 for user_online in online:    
                     s = json.loads(user_online)
-                    stream_id = hmac.new(secret_key.encode("utf-8"), s["stream_id"].encode("utf-8"), hashlib.sha1).hexdigest()
-                    stream = json.dumps({'id': hmac.new(secret_key.encode("utf-8"), s["stream_id"].encode("utf-8"), hashlib.sha1).hexdigest(), 'user_id': hmac.new(secret_key.encode("utf-8"), 
-                                        s["user_id"].encode("utf-8"), hashlib.sha1).hexdigest(), 'game_id': s["game_id"], 'thumbnail_url': s["url"], 'twitch_id': s["user_id"]})
+                    stream_id = self.hash_id(s["stream_id"])
+                    streams[stream_id] = {'id': stream_id, 'user_id': self.hash_id(s["user_id"]), 'game_id': s["game_id"], 'thumbnail_url': s["url"], 
+                                          'twitch_id': s["user_id"]}
+
+                if yield_backoff:
+                    self.mark_zero_yield(streams.values())
 
-                    if not self.storage.hexists("current_probes", stream_id):
-                        new_streams_online.add(stream_id)
-                        self.storage.sadd("to_download", stream)
+                streams = {stream_id: json.dumps(stream) for stream_id, stream in streams.items()}
 
-                    self.storage.hset("current_probes", stream_id, stream)
+                keys = ["current_probes"] if sharding_enabled else ["current_probes", "to_download"]
+                new_streams_online = self.register_online(keys=keys, args=[x for item in streams.items() for x in item])
+
+                if sharding_enabled:
+                    self.assign_streams([x.decode("utf-8") for x in new_streams_online])
 
                 self.logger.info("New users online: {}".format(len(new_streams_online)))
 
-            offline = self.storage.spop("twitch_api_offline", count=self.storage.scard("twitch_api_offline"))
             if offline:
                 self.update_storage(offline, "offline")
 
+            if sharding_enabled and datetime.now() - self.last_process_check > timedelta(seconds=shard_heartbeat_interval):
+                self.check_shards()
+                self.last_process_check = datetime.now()
+
             if self.storage.scard("twitch_api_to_query") < users_batch_size:
                 users = self.get_more_users()
                 if users:
@@ -70,32 +176,86 @@ class ThumbnailDownloader:
             self.storage.sadd("users_tracked_log", json.dumps({"timestamp": datetime.now().timestamp(), "users": self.storage.hlen("current_probes")}))                
 
 
+    def mark_zero_yield(self, streams):
+        # Users none of whose recent thumbnails gave a latency value (user_yield:{user_id}, written by process-raw-results):
+        # the downloaders start their new streams backed off
+        streams = list(streams)
+        pipeline = self.storage.pipeline(transaction=False)
+
+        for stream in streams:
+            pipeline.hget("user_yield:{}".format(stream["user_id"]), "zero_streak")
+
+        for stream, streak in zip(streams, pipeline.execute()):
+            stream["zero_yield_user"] = int(streak or 0) >= yield_min_images
+
+
+    def get_scored_users(self, batch_size):
+        # Users most likely to be live at this hour of the week first (online_scores:{hour}, written by the streams-tracker's
+        # online_profiles). Once all of them have been queried, wait for the next hour
+        hour = int((time.time() // 3600 + 72) % 168)
+
+        if hour != self.scores_hour:
+            self.scores_hour = hour
+            self.scores_rank = 0
+
+        if self.scores_rank < 0:
+            return []
+
+        result = self.select_scored(keys=["online_scores:{}".format(hour), "queried"], args=[self.scores_rank, batch_size, users_scan_count,
+                                                                                                                users_scan_pages])
+        self.scores_rank = int(result[0])
+
+        return [x.decode("utf-8") for x in result[1:]]
+
+
     def get_more_users(self):
-        users_to_probe = []       
+        users_to_probe = []
 
-        for x in self.storage.sdiff("to_probe", "queried"):
-            users_to_probe.append(x.decode("utf-8"))
-            self.storage.sadd("queried", x.decode("utf-8"))
+        if prioritized_probing:
+            users_to_probe = self.get_scored_users(int(users_batch_size * (1 - probe_exploration)))
 
-            if len(users_to_probe) >= users_batch_size:
-                break
+        # Resumes the walk over to_probe where the previous call stopped: users whose offline mark expired are picked up on the next pass.
+        # With prioritized_probing, it also keeps probing the users without a profile
+        if len(users_to_probe) < users_batch_size:
+            result = self.select_users(keys=["to_probe", "queried"], args=[self.users_cursor, users_batch_size - len(users_to_probe), users_scan_count,
+                                                                                             users_scan_pages])
+            self.users_cursor = int(result[0])
+            users_to_probe.extend([x.decode("utf-8") for x in result[1:]])
 
         if users_to_probe:
             self.logger.info("Found {} users to probe".format(len(users_to_probe)))
         
         now = datetime.now()
 
-        offline_to_delete = self.storage.zrangebyscore("offline", 0, int((now - timedelta(minutes=30)).timestamp()))
+        offline_to_delete = self.storage.zrangebyscore("offline", 0, int((now - timedelta(minutes=30)).timestamp()), withscores=True)
+
+        if eventsub_enabled and offline_to_delete:
+            # Users with EventSub subscriptions are reported as soon as they go online: polling them is only a slow reconciliation
+            # SISMEMBER in one pipeline rather than SMISMEMBER, which needs Redis 6.2
+            pipeline = self.storage.pipeline(transaction=False)
+            for user, _ in offline_to_delete:
+                pipeline.sismember("eventsub_users", user)
+
+            subscribed = pipeline.execute()
+            reconcile_before = int((now - timedelta(minutes=eventsub_offline_expire)).timestamp())
+
+            offline_to_delete = [(user, ts) for (user, ts), is_subscribed in zip(offline_to_delete, subscribed) if not is_subscribed or ts <= reconcile_before]
+
+        offline_to_delete = [user for user, _ in offline_to_delete]
         finished_to_delete = self.storage.zrangebyscore("finished", 0, int((now - timedelta(hours=6)).timestamp()))
 
+        pipeline = self.storage.pipeline(transaction=False)
+
         if offline_to_delete:
             self.logger.info("Deleting expired offline users: {}".format(len(offline_to_delete)))
-            self.storage.zremrangebyscore("offline", 0, int((now - timedelta(minutes=30)).timestamp()))
-            self.storage.srem("queried", *offline_to_delete)
+            pipeline.zrem("offline", *offline_to_delete)
+            pipeline.srem("queried", *offline_to_delete)
         
         if finished_to_delete:
             self.logger.info("Deleting expired finished users: {}".format(len(finished_to_delete)))
-            self.storage.zremrangebyscore("finished", 0, int((now - timedelta(hours=6)).timestamp()))
+            pipeline.zremrangebyscore("finished", 0, int((now - timedelta(hours=6)).timestamp()))
+
+        pipeline.execute()
 
         return users_to_probe
 
@@ -110,8 +270,8 @@ class ThumbnailDownloader:
 
 
     def update_current_probes(self, streams):
-        for stream in streams:
-            self.storage.hdel("current_probes", stream)
+        if streams:
+            self.storage.hdel("current_probes", *streams)
         
         self.logger.info("Updated current streamers. Current number: {}".format(self.storage.hlen("current_probes")))
 
@@ -131,6 +291,14 @@ class ThumbnailDownloader:
         return batches
 
 
+    def start_downloader(self, index):
+        downloader_script = "async_downloader.py" if async_downloader else "downloader.py"
+        return subprocess.Popen(["nohup", "{}/venv/bin/python3".format(base_path), "{}/{}".format(base_path, downloader_script), str(index)], 
+                                stdout=open('/dev/null', 'w'),
+                                stderr=open('/dev/null', 'a'),
+                                preexec_fn=os.setpgrp)
+
+
     def split_queue(self, index, new_queue):
         try:
             in_queue = self.storage.scard("streams_{}".format(index))
@@ -138,10 +306,7 @@ class ThumbnailDownloader:
 
             if to_move:
                 self.storage.sadd("streams_{}".format(new_queue), *to_move)
-                subprocess.Popen(["nohup", "{}/venv/bin/python3".format(base_path), "{}/downloader.py".format(base_path), str(new_queue)], 
-                                stdout=open('/dev/null', 'w'),
-                                stderr=open('/dev/null', 'a'),
-                                preexec_fn=os.setpgrp)
+                self.start_downloader(new_queue)
 
                 return True
             return False
@@ -215,6 +380,89 @@ class ThumbnailDownloader:
             self.remove_queue(to_delete[0], len(queues) - 1)
 
 
+    def assign_streams(self, stream_ids):
+        # Streams arriving before any worker is alive are assigned by the first rebalance
+        batches = {}
+        for stream_id in stream_ids:
+            owner = self.ring.owner(stream_id)
+
+            if owner is not None:
+                batches.setdefault(owner, []).append(stream_id)
+
+        pipeline = self.storage.pipeline(transaction=False)
+        for owner, batch in batches.items():
+            pipeline.sadd("streams_{}".format(owner), *batch)
+        pipeline.execute()
+
+
+    def rebalance(self, ring, live):
+        known = set([x.decode("utf-8") for x in self.storage.zrange("worker_heartbeats", 0, -1)])
+        dead = known - live
+
+        current = set([x.decode("utf-8") for x in self.storage.hkeys("current_probes")])
+
+        # Only the streams of the arcs that changed owner move, plus everything a dead worker held (stolen streams included)
+        to_move = set([s for s in current if ring.owner(s) != self.ring.owner(s)])
+        for worker in dead:
+            to_move.update([x.decode("utf-8") for x in self.storage.smembers("streams_{}".format(worker))])
+        to_move &= current
+
+        self.logger.info("Workers alive: {}, dead: {}. Moving {} of {} streams".format(sorted(live), sorted(dead), len(to_move), len(current)))
+
+        pipeline = self.storage.pipeline(transaction=True)
+
+        if to_move:
+            # A moved stream may sit in any queue if it was stolen
+            for worker in known | set(ring.workers):
+                pipeline.srem("streams_{}".format(worker), *to_move)
+
+        for worker in dead:
+            pipeline.delete("streams_{}".format(worker), "schedule_{}".format(worker))
+            pipeline.zrem("worker_heartbeats", worker)
+
+        pipeline.set("shard_ring", json.dumps(ring.workers))
+        pipeline.execute()
+
+        self.ring = ring
+        self.assign_streams(to_move)
+
+
+    def check_shards(self):
+        live = live_workers(self.storage)
+        ring = HashRing(live)
+
+        if ring != self.ring:
+            self.rebalance(ring, live)
+
+        # Start missing workers, and replace crashed ones once their heartbeat has expired
+        for idx in range(shard_workers):
+            started = self.started.get(str(idx))
+
+            if str(idx) not in live and (started is None or datetime.now() - started > timedelta(seconds=shard_worker_timeout)):
+                self.stop_downloader(idx)
+
+                self.logger.info("Starting worker {}".format(idx))
+                self.processes[str(idx)] = self.start_downloader(idx)
+                self.started[str(idx)] = datetime.now()
+
+
+    def stop_downloader(self, idx):
+        # A worker without heartbeat may still be running (hung): two processes must not share a queue
+        process = self.processes.pop(str(idx), None)
+
+        if process is None or process.poll() is not None:
+            return
+
+        self.logger.info("Terminating unresponsive worker {}".format(idx))
+        process.terminate()
+
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
 if __name__ == '__main__':
     downloader = ThumbnailDownloader()
     downloader.loop()
\ No newline at end of file
@@ -1,48 +1,27 @@
 import requests
-import email.utils as eut
 import sys
-import redis
-import random
-import json
-from storage.local_storage_controller import LocalStorageController
-from storage.s3_storage_controller import S3StorageController
+import timeit
 
-from stream_to_probe import StreamToProbe
+from base_downloader import BaseDownloader
 from time import sleep
-from datetime import datetime, timedelta
+from datetime import datetime
 from logger import get_logger
-from config import width, height, default_to_sleep, redis_host, redis_password, redis_port, downloader_fetch_count
+from config import default_to_sleep, downloader_fetch_count, shard_steal_count
 
 
-def parse_http_date(date_str):
-    return datetime.fromtimestamp(eut.mktime_tz(eut.parsedate_tz(date_str)))
-
-
-class Downloader():
+class Downloader(BaseDownloader):
     def __init__(self, idx=0):
-        super().__init__()
-        self.idx = idx
-        self.logger = get_logger("thumbnails_process{}".format(idx), 'downloader_{}'.format(idx))
-        self.queue = redis.Redis(host=redis_host, port=redis_port, db=0, password=redis_password)
-        self.streams = {}
-        self.storage = LocalStorageController()
+        super().__init__(idx, get_logger("thumbnails_process{}".format(idx), 'downloader_{}'.format(idx)))
 
         self.update_streams()
         
 
-    def update_streams(self):
-        streams = self.queue.smembers("streams_{}".format(self.idx))
-        self.logger.info("Re-read queue, current number of streams: {}".format(len(streams)))
-        
-        for s in streams:
-            stream_data = self.queue.hget("current_probes", s)
-            if stream_data:
-                json_data = json.loads(stream_data)
-
-                self.streams[json_data["id"]] = StreamToProbe(json_data)
-            else:
-                self.queue.srem("streams_{}".format(self.idx), s)
-        
+    def check_shard(self, idle):
+        if idle:
+            self.steal(shard_steal_count)
+
+        self.heartbeat()
+
 
     def cleanup(self):
         for handler in self.logger.handlers[:]:
@@ -52,88 +31,62 @@ class Downloader():
     def run(self):
         while True:
             # If my queue has been empty for X cycles, I should stop iterating and just exit
-            if self.queue.scard("streams_{}_stop".format(self.idx)) != 0:
-                self.queue.spop("streams_{}_stop".format(self.idx), count=self.queue.scard("streams_{}_stop".format(self.idx)))
-                self.logger.info("Got a stop signal, finishing.")
+            if self.stop_requested():
+                self.close()
                 break
+
+            self.storage.flush()
     
             if self.queue.scard("streams_{}".format(self.idx)) != len(self.streams.keys()):
-                self.streams = {}
                 self.update_streams()
 
+            self.resumed_streams()
+
             should_slowdown = False
-            finished = []
+            idle = True
 
             streams_to_download = sorted(self.streams.values(), key=lambda x: x.next_time)
             for stream in streams_to_download:
                 if stream.next_time < datetime.now():                
+                    idle = False
                     too_fast, has_finished = self.download_thumbnail(stream)
                     
                     if has_finished:
-                        finished.append((stream.user_id, stream.stream_id))                   
-                    else:
-                        self.logger.info("Downloaded {}, next time: {}".format(stream.stream_id, stream.next_time.strftime('%Y-%m-%d-%H-%M-%S')))        
+                        self.finish_stream(stream)
                
                     should_slowdown = should_slowdown & too_fast                
 
-            if finished:
-                for f in finished:
-                    self.streams.pop(f[1])
-                    self.queue.srem("streams_{}".format(self.idx), f[1])
+            self.report_finished()
+            self.fetch_new_streams(downloader_fetch_count)
 
-                msg = {"origin": self.idx, "finished": finished}
+            if self.shard:
+                self.check_shard(idle)
 
-                self.queue.sadd("from_workers", json.dumps(msg))
-            
-            new_streams = self.queue.spop("to_download", count=downloader_fetch_count)
-
-            if new_streams:
-                for new_stream in new_streams:
-                    stream = json.loads(new_stream.decode("utf-8"))
-
-                    self.streams[stream["id"]] = StreamToProbe(stream)
-                    self.queue.sadd("streams_{}".format(self.idx), stream["id"]) 
-
-                self.logger.info("Got new streams to follow, current total: {}".format(len(self.streams.keys())))
+            self.refresh()
 
             sleep(default_to_sleep)
 
 
     def download_thumbnail(self, stream):
-        url = stream.url.format_map({'width': width, 'height': height})
+        url = self.thumbnail_url(stream)
         
         try:
-            status_response = requests.head(url, timeout=5)
-            
-            if status_response.status_code != 200:
-                # Streamer has finished streaming
-                self.logger.info("Streamer has finished {}. Status code: {}".format(stream.stream_id, status_response.status_code))
-                return True, True
-
-            thumbnail_date = parse_http_date(status_response.headers['Date'])
-            
-            too_fast = False
-            if datetime.now() - stream.next_time > timedelta(minutes=10):
-                self.logger.info("Too late downloading {}, should slowdown".format(stream.stream_id))
-                too_fast = True
-
-            stream.next_time = parse_http_date(status_response.headers['Expires'])
-            
-            response = requests.get(url, timeout=5)
-            
-            stream_data = self.queue.hget("current_probes", stream.stream_id)
-            if stream_data:
-                fresh_data = json.loads(stream_data)
-
-                file_path = self.storage.save_image(stream, fresh_data["game_id"], thumbnail_date, response.content)
-                self.queue.sadd("raw_images", file_path)
-                self.queue.sadd("img_download_log", json.dumps({"expected": thumbnail_date.timestamp(), "downloaded": datetime.now().timestamp()}))
-
-            return too_fast, False
+            lateness = (datetime.now() - stream.next_time).total_seconds()
+            start_time = timeit.default_timer()
+
+            # One conditional GET: 304 if the frame has not changed, a redirect to the offline image once the stream ends
+            response = requests.get(url, headers=stream.conditional_headers(), timeout=5, allow_redirects=False)
+
+            too_fast, has_finished, thumbnail_date = self.handle_response(stream, response.status_code, response.headers,
+                                                                          response.content if response.status_code == 200 else None,
+                                                                          lateness, timeit.default_timer() - start_time)
+
+            if thumbnail_date:
+                self.count_stored(self.store_thumbnail(stream, thumbnail_date, response.content))
+
+            return too_fast, has_finished
         except Exception as e:
-            self.logger.info("Fatal error downloading {}. Error: {}".format(stream.stream_id, e))
-            
-            return False, False
+            return self.download_failed(stream, e)
 
 
 if __name__ == "__main__":
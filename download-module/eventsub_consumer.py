@@ -0,0 +1,312 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import aiohttp
+import redis
+
+from aiohttp import web
+from datetime import datetime, timezone
+
+from config import redis_host, redis_password, redis_port, games_to_probe, twitch_api_id, twitch_client_secret, rate_limit_safety_factor, base_path, \
+    twitch_api_url, twitch_auth_url, eventsub_callback_url, eventsub_secret, eventsub_port, eventsub_max_users, eventsub_subscribe_interval, shared_rate_limit
+from logger import get_logger
+from rate_limiter import get_bucket
+
+
+SUBSCRIPTION_TYPES = {"stream.online": "1", "stream.offline": "1", "channel.update": "2"}
+
+# Twitch considers older messages replays: they are rejected, and message ids are remembered for as long
+MAX_MESSAGE_AGE = 600
+
+
+def thumbnail_url(login):
+    return "https://static-cdn.jtvnw.net/previews-ttv/live_user_{}-{{width}}x{{height}}.jpg".format(login)
+
+
+def sign(secret, message_id, timestamp, body):
+    return "sha256={}".format(hmac.new(secret.encode("utf-8"), message_id.encode("utf-8") + timestamp.encode("utf-8") + body, hashlib.sha256).hexdigest())
+
+
+def parse_timestamp(timestamp):
+    # RFC3339 with up to nanoseconds, always UTC
+    return datetime.strptime(timestamp[:19], "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+class EventSubConsumer:
+    """
+    Receives the stream.online, stream.offline and channel.update EventSub webhooks of the users in to_probe and turns
+    them into the twitch_api_online/twitch_api_offline entries the coordinator already consumes, as twitch_api_process
+    does after polling. Users whose game is unknown when they go online are queued for one regular query.
+    """
+    def __init__(self, secret=eventsub_secret, callback_url=eventsub_callback_url, api_url=twitch_api_url, auth_url=twitch_auth_url):
+        self.logger = get_logger("eventsub_consumer", "eventsub")
+        self.storage = redis.Redis(host=redis_host, port=redis_port, db=0, password=redis_password)
+        self.secret = secret
+        self.callback_url = callback_url
+        self.api_url = api_url
+        self.auth_url = auth_url
+        self.token = None
+        self.bucket = get_bucket(twitch_api_id, int(rate_limit_safety_factor * 800), self.storage if shared_rate_limit else None)
+
+        with open("{}/data/games.json".format(base_path), "r") as f:
+            self.games_mapping = json.load(f)
+
+    def verify(self, headers, body):
+        message_id = headers.get("Twitch-Eventsub-Message-Id", "")
+        timestamp = headers.get("Twitch-Eventsub-Message-Timestamp", "")
+        signature = headers.get("Twitch-Eventsub-Message-Signature", "")
+
+        if not message_id or not timestamp or not signature:
+            return False
+
+        try:
+            age = (datetime.now(timezone.utc) - parse_timestamp(timestamp)).total_seconds()
+        except ValueError:
+            return False
+
+        if abs(age) > MAX_MESSAGE_AGE:
+            return False
+
+        return hmac.compare_digest(sign(self.secret, message_id, timestamp, body), signature)
+
+    async def callback(self, request):
+        body = await request.read()
+
+        if not self.verify(request.headers, body):
+            self.logger.info("Rejected message with an invalid signature or timestamp")
+            return web.Response(status=403)
+
+        message_type = request.headers.get("Twitch-Eventsub-Message-Type", "")
+        message = json.loads(body.decode("utf-8"))
+
+        if message_type == "webhook_callback_verification":
+            self.logger.info("Verified subscription {} ({})".format(message["subscription"]["id"], message["subscription"]["type"]))
+            return web.Response(text=message["challenge"], content_type="text/plain")
+
+        # Twitch retries deliveries that are not acknowledged in time: duplicates are acknowledged but handled only once
+        message_key = "eventsub_message:{}".format(request.headers["Twitch-Eventsub-Message-Id"])
+
+        if not self.storage.set(message_key, 1, nx=True, ex=MAX_MESSAGE_AGE):
+            return web.Response(status=204)
+
+        try:
+            if message_type == "notification":
+                self.handle_event(message["subscription"]["type"], message["event"])
+            elif message_type == "revocation":
+                self.revoke(message["subscription"])
+        except Exception:
+            # Not handled: the retry of Twitch must not be taken for a duplicate
+            self.storage.delete(message_key)
+            raise
+
+        return web.Response(status=204)
+
+    def handle_event(self, subscription_type, event):
+        if subscription_type == "stream.online":
+            self.stream_online(event)
+        elif subscription_type == "stream.offline":
+            self.stream_offline(event)
+        elif subscription_type == "channel.update":
+            self.channel_update(event)
+
+    def report(self, user_id, stream_id, login, game_id):
+        # Same answer as twitch_api_process: online if streaming one of the games to probe, offline otherwise
+        game = self.games_mapping.get(game_id, None) if game_id in games_to_probe else None
+
+        if game:
+            self.storage.sadd("twitch_api_online", json.dumps({"stream_id": stream_id, "user_id": user_id, "game_id": game["id"], "url": thumbnail_url(login)}))
+        else:
+            self.storage.sadd("twitch_api_offline", user_id)
+
+    def stream_online(self, event):
+        user_id = event["broadcaster_user_id"]
+        self.storage.hset("eventsub_live", user_id, event["id"])
+
+        channel = self.storage.hget("eventsub_channels", user_id)
+
+        if channel:
+            self.report(user_id, event["id"], event["broadcaster_user_login"], json.loads(channel)["game_id"])
+        else:
+            self.storage.sadd("twitch_api_to_query", user_id)
+
+    def stream_offline(self, event):
+        user_id = event["broadcaster_user_id"]
+
+        self.storage.hdel("eventsub_live", user_id)
+        self.storage.sadd("twitch_api_offline", user_id)
+
+    def channel_update(self, event):
+        user_id = event["broadcaster_user_id"]
+        self.storage.hset("eventsub_channels", user_id, json.dumps({"login": event["broadcaster_user_login"], "game_id": event["category_id"], "title": event["title"]}))
+
+        stream_id = self.storage.hget("eventsub_live", user_id)
+
+        if stream_id:
+            self.report(user_id, stream_id.decode("utf-8"), event["broadcaster_user_login"], event["category_id"])
+
+    def revoke(self, subscription):
+        user_id = subscription["condition"]["broadcaster_user_id"]
+        self.logger.info("Subscription {} of user {} revoked: {}".format(subscription["type"], user_id, subscription["status"]))
+
+        # Subscribed again on the next pass if still in to_probe
+        self.storage.srem("eventsub_users", user_id)
+
+    def get_header(self):
+        return {
+            "Client-ID": twitch_api_id,
+            "Authorization": "Bearer {}".format(self.token)
+        }
+
+    async def get_api_token(self, session):
+        params = {"client_id": twitch_api_id, "client_secret": twitch_client_secret, "grant_type": "client_credentials"}
+
+        async with session.post(self.auth_url, params=params) as response:
+            if response.status != 200:
+                self.logger.error("Error getting token. Status code: {}".format(response.status))
+                return None
+
+            return (await response.json()).get("access_token", "")
+
+    async def call_api(self, session, method, path, **kwargs):
+        # One Helix request through the rate limit bucket shared with twitch_api_process. Returns the status and the body of 200 responses
+        await self.bucket.acquire()
+
+        async with session.request(method, "{}/{}".format(self.api_url, path), headers=self.get_header(), **kwargs) as response:
+            if response.status == 429:
+                self.logger.info("Rate limit exceeded, waiting for the bucket to refill")
+                self.bucket.exhausted(response.headers)
+            else:
+                self.bucket.update(response.headers)
+
+            return response.status, await response.json() if response.status == 200 else None
+
+    async def load_channels(self, session, users):
+        # Current game of each user, so that stream.online events can be answered without querying the API
+        params = [("broadcaster_id", user) for user in users]
+
+        status, body = await self.call_api(session, "GET", "channels", params=params)
+
+        if status != 200:
+            self.logger.info("Channels query failed. Status code: {}".format(status))
+            return status
+
+        channels = body["data"]
+
+        if channels:
+            self.storage.hset("eventsub_channels", mapping={c["broadcaster_id"]: json.dumps({"login": c["broadcaster_login"], "game_id": c["game_id"], "title": c["title"]})
+                                                            for c in channels})
+
+        return status
+
+    async def subscribe(self, session, user_id):
+        for subscription_type, version in SUBSCRIPTION_TYPES.items():
+            body = {
+                "type": subscription_type,
+                "version": version,
+                "condition": {"broadcaster_user_id": user_id},
+                "transport": {"method": "webhook", "callback": self.callback_url, "secret": self.secret}
+            }
+
+            status, _ = await self.call_api(session, "POST", "eventsub/subscriptions", json=body)
+
+            # 409: already subscribed (e.g. before a restart)
+            if status not in (202, 409):
+                self.logger.info("Subscription {} of user {} failed. Status code: {}".format(subscription_type, user_id, status))
+                return status
+
+        self.storage.sadd("eventsub_users", user_id)
+
+        return 202
+
+    async def unsubscribe(self, session, user_id):
+        # Users no longer in to_probe: their subscriptions count against eventsub_max_users and the cost limit of Twitch
+        status, body = await self.call_api(session, "GET", "eventsub/subscriptions", params={"user_id": user_id})
+
+        if status != 200:
+            self.logger.info("Subscriptions query of user {} failed. Status code: {}".format(user_id, status))
+            return status
+
+        for subscription in body["data"]:
+            status, _ = await self.call_api(session, "DELETE", "eventsub/subscriptions", params={"id": subscription["id"]})
+
+            # 404: already gone
+            if status not in (204, 404):
+                self.logger.info("Deleting subscription {} of user {} failed. Status code: {}".format(subscription["id"], user_id, status))
+                return status
+
+        pipeline = self.storage.pipeline(transaction=False)
+        pipeline.srem("eventsub_users", user_id)
+        pipeline.hdel("eventsub_channels", user_id)
+        pipeline.hdel("eventsub_live", user_id)
+        pipeline.execute()
+
+        return 204
+
+    async def subscribe_users(self, session):
+        while True:
+            if not self.token:
+                try:
+                    self.token = await self.get_api_token(session)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    self.logger.info("Exception: {}".format(e))
+
+            stale = [x.decode("utf-8") for x in self.storage.sdiff("eventsub_users", "to_probe")] if self.token else []
+
+            if stale:
+                self.logger.info("Unsubscribing {} users no longer probed".format(len(stale)))
+
+            try:
+                for user in stale:
+                    if await self.unsubscribe(session, user) == 401:
+                        self.logger.info("Token expired, getting a new one")
+                        self.token = None
+                        break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.logger.info("Exception: {}".format(e))
+
+            available = max(0, eventsub_max_users - self.storage.scard("eventsub_users"))
+            users = [x.decode("utf-8") for x in self.storage.sdiff("to_probe", "eventsub_users")][:available] if self.token else []
+
+            if users:
+                self.logger.info("Subscribing {} users".format(len(users)))
+
+            try:
+                for idx in range(0, len(users), 100):
+                    chunk = users[idx:idx + 100]
+                    statuses = [await self.load_channels(session, chunk)] + [await self.subscribe(session, user) for user in chunk]
+
+                    if 401 in statuses:
+                        self.logger.info("Token expired, getting a new one")
+                        self.token = None
+                        break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.logger.info("Exception: {}".format(e))
+
+            self.logger.info("Subscribed users: {}".format(self.storage.scard("eventsub_users")))
+
+            await asyncio.sleep(eventsub_subscribe_interval)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/eventsub", self.callback)
+
+        return app
+
+    async def run(self, port=eventsub_port):
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, "0.0.0.0", port).start()
+
+        self.logger.info("Listening for EventSub messages on port {}".format(port))
+
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+                await self.subscribe_users(session)
+        finally:
+            await runner.cleanup()
+
+
+if __name__ == '__main__':
+    consumer = EventSubConsumer()
+    asyncio.run(consumer.run())
@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import json
+import random
+import uuid
+import aiohttp
+
+from aiohttp import web
+from datetime import datetime, timezone
+
+from config import base_path
+from eventsub_consumer import sign, SUBSCRIPTION_TYPES
+
+
+def now_rfc3339():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class FakeEventSub:
+    """
+    Local stand-in for the Twitch side of EventSub: app tokens, the eventsub/subscriptions and channels endpoints, and
+    signed webhook deliveries (callback verification, notifications, revocations) to the subscribed callbacks. Events
+    are sent through POST /trigger or generated at random by simulate(); a fraction of the notifications can be
+    delivered twice, as Twitch does when an acknowledgement is late.
+    """
+    def __init__(self, games, seed=0, duplicate_rate=0.0, max_total_cost=10000):
+        self.games = games
+        self.rng = random.Random(seed)
+        self.duplicate_rate = duplicate_rate
+        self.max_total_cost = max_total_cost
+
+        self.subscriptions = {}
+        self.channels = {}
+        self.live = {}
+
+        self.delivered = 0
+        self.duplicates = 0
+        self.failed = 0
+
+    def channel(self, user_id):
+        if user_id not in self.channels:
+            self.channels[user_id] = {"login": "user{}".format(user_id), "game_id": self.rng.choice(self.games), "title": "Stream of {}".format(user_id)}
+
+        return self.channels[user_id]
+
+    async def token(self, request):
+        return web.json_response({"access_token": "fake-token", "expires_in": 3600, "token_type": "bearer"})
+
+    def authorized(self, request):
+        return request.headers.get("Authorization", "").startswith("Bearer ")
+
+    async def create_subscription(self, request):
+        if not self.authorized(request):
+            return web.json_response({"error": "Unauthorized", "status": 401}, status=401)
+
+        body = await request.json()
+        subscription_type = body.get("type")
+        user_id = body.get("condition", {}).get("broadcaster_user_id")
+        transport = body.get("transport", {})
+
+        if subscription_type not in SUBSCRIPTION_TYPES or not user_id or transport.get("method") != "webhook" or len(transport.get("secret", "")) < 10:
+            return web.json_response({"error": "Bad Request", "status": 400}, status=400)
+
+        if any([s["type"] == subscription_type and s["condition"]["broadcaster_user_id"] == user_id for s, _ in self.subscriptions.values()]):
+            return web.json_response({"error": "Conflict", "status": 409, "message": "subscription already exists"}, status=409)
+
+        if len(self.subscriptions) >= self.max_total_cost:
+            return web.json_response({"error": "Too Many Requests", "status": 429, "message": "maximum subscriptions cost exceeded"}, status=429)
+
+        subscription = {
+            "id": str(uuid.uuid4()),
+            "status": "webhook_callback_verification_pending",
+            "type": subscription_type,
+            "version": body.get("version", "1"),
+            "cost": 1,
+            "condition": {"broadcaster_user_id": user_id},
+            "transport": {"method": "webhook", "callback": transport["callback"]},
+            "created_at": now_rfc3339()
+        }
+        self.subscriptions[subscription["id"]] = (subscription, transport["secret"])
+        asyncio.create_task(self.verify_callback(subscription["id"]))
+
+        return web.json_response({"data": [subscription], "total": len(self.subscriptions), "total_cost": len(self.subscriptions),
+                                  "max_total_cost": self.max_total_cost}, status=202)
+
+    async def list_subscriptions(self, request):
+        data = [s for s, _ in self.subscriptions.values() if request.query.get("user_id", s["condition"]["broadcaster_user_id"]) == s["condition"]["broadcaster_user_id"]]
+
+        return web.json_response({"data": data, "total": len(data), "total_cost": len(data), "max_total_cost": self.max_total_cost, "pagination": {}})
+
+    async def delete_subscription(self, request):
+        if self.subscriptions.pop(request.query.get("id", ""), None) is None:
+            return web.json_response({"error": "Not Found", "status": 404}, status=404)
+
+        return web.Response(status=204)
+
+    async def get_channels(self, request):
+        data = []
+
+        for user_id in request.query.getall("broadcaster_id", [])[:100]:
+            channel = self.channel(user_id)
+            data.append({"broadcaster_id": user_id, "broadcaster_login": channel["login"], "broadcaster_name": channel["login"], "broadcaster_language": "en",
+                         "game_id": channel["game_id"], "game_name": "", "title": channel["title"], "delay": 0})
+
+        return web.json_response({"data": data})
+
+    async def deliver(self, subscription_id, message_type, payload, message_id=None):
+        subscription, secret = self.subscriptions[subscription_id]
+        message_id = message_id or str(uuid.uuid4())
+        timestamp = now_rfc3339()
+        body = json.dumps(payload).encode("utf-8")
+
+        headers = {
+            "Content-Type": "application/json",
+            "Twitch-Eventsub-Message-Id": message_id,
+            "Twitch-Eventsub-Message-Retry": "0",
+            "Twitch-Eventsub-Message-Type": message_type,
+            "Twitch-Eventsub-Message-Signature": sign(secret, message_id, timestamp, body),
+            "Twitch-Eventsub-Message-Timestamp": timestamp,
+            "Twitch-Eventsub-Subscription-Type": subscription["type"],
+            "Twitch-Eventsub-Subscription-Version": subscription["version"]
+        }
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(subscription["transport"]["callback"], data=body, headers=headers) as response:
+                    return response.status, await response.text()
+        except aiohttp.ClientError:
+            self.failed += 1
+            return None, ""
+
+    async def verify_callback(self, subscription_id):
+        challenge = uuid.uuid4().hex
+        subscription, _ = self.subscriptions[subscription_id]
+
+        status, text = await self.deliver(subscription_id, "webhook_callback_verification", {"challenge": challenge, "subscription": subscription})
+        subscription["status"] = "enabled" if status == 200 and text == challenge else "webhook_callback_verification_failed"
+
+    async def notify(self, subscription_type, user_id, event):
+        for subscription_id, (subscription, _) in list(self.subscriptions.items()):
+            if subscription["type"] != subscription_type or subscription["condition"]["broadcaster_user_id"] != user_id or subscription["status"] != "enabled":
+                continue
+
+            message_id = str(uuid.uuid4())
+            payload = {"subscription": subscription, "event": event}
+
+            await self.deliver(subscription_id, "notification", payload, message_id)
+            self.delivered += 1
+
+            if self.rng.random() < self.duplicate_rate:
+                await self.deliver(subscription_id, "notification", payload, message_id)
+                self.duplicates += 1
+
+    async def revoke(self, user_id, reason="user_removed"):
+        for subscription_id, (subscription, _) in list(self.subscriptions.items()):
+            if subscription["condition"]["broadcaster_user_id"] == user_id:
+                subscription["status"] = reason
+
+                await self.deliver(subscription_id, "revocation", {"subscription": subscription})
+                self.subscriptions.pop(subscription_id)
+
+    def broadcaster(self, user_id):
+        channel = self.channel(user_id)
+
+        return {"broadcaster_user_id": user_id, "broadcaster_user_login": channel["login"], "broadcaster_user_name": channel["login"]}
+
+    async def go_online(self, user_id):
+        self.live[user_id] = str(self.rng.randrange(10 ** 10, 10 ** 11))
+
+        await self.notify("stream.online", user_id, dict(self.broadcaster(user_id), id=self.live[user_id], type="live", started_at=now_rfc3339()))
+
+    async def go_offline(self, user_id):
+        self.live.pop(user_id, None)
+
+        await self.notify("stream.offline", user_id, self.broadcaster(user_id))
+
+    async def change_game(self, user_id, game_id):
+        channel = self.channel(user_id)
+        channel["game_id"] = game_id
+
+        await self.notify("channel.update", user_id, dict(self.broadcaster(user_id), title=channel["title"], language="en", category_id=game_id,
+                                                          category_name="", content_classification_labels=[]))
+
+    async def trigger(self, request):
+        body = await request.json()
+        user_id = body["user_id"]
+
+        if body["type"] == "stream.online":
+            await self.go_online(user_id)
+        elif body["type"] == "stream.offline":
+            await self.go_offline(user_id)
+        elif body["type"] == "channel.update":
+            await self.change_game(user_id, body.get("game_id", self.rng.choice(self.games)))
+        elif body["type"] == "revocation":
+            await self.revoke(user_id, body.get("reason", "user_removed"))
+        else:
+            return web.json_response({"error": "Bad Request", "status": 400}, status=400)
+
+        return web.json_response({"delivered": self.delivered, "duplicates": self.duplicates, "failed": self.failed})
+
+    async def simulate(self, interval=1.0, events_per_interval=10):
+        # Random events among the subscribed users
+        while True:
+            users = list(set([s["condition"]["broadcaster_user_id"] for s, _ in self.subscriptions.values()]))
+
+            for user_id in self.rng.sample(users, min(events_per_interval, len(users))):
+                if user_id not in self.live:
+                    await self.go_online(user_id)
+                elif self.rng.random() < 0.3:
+                    await self.change_game(user_id, self.rng.choice(self.games))
+                else:
+                    await self.go_offline(user_id)
+
+            await asyncio.sleep(interval)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/oauth2/token", self.token)
+        app.router.add_post("/helix/eventsub/subscriptions", self.create_subscription)
+        app.router.add_get("/helix/eventsub/subscriptions", self.list_subscriptions)
+        app.router.add_delete("/helix/eventsub/subscriptions", self.delete_subscription)
+        app.router.add_get("/helix/channels", self.get_channels)
+        app.router.add_post("/trigger", self.trigger)
+
+        return app
+
+
+async def run_fake_eventsub(args):
+    with open("{}/data/games.json".format(base_path), "r") as f:
+        games = args.games or list(json.load(f).keys())
+
+    fake = FakeEventSub(games, duplicate_rate=args.duplicate_rate)
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+
+    try:
+        if args.simulate:
+            await fake.simulate(args.simulate, args.events)
+        else:
+            await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for Twitch EventSub (point twitch_api_url/twitch_auth_url of eventsub_consumer "
+                                                 "to http://127.0.0.1:PORT/helix and http://127.0.0.1:PORT/oauth2/token)")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--games", nargs="*", default=[], help="Twitch game ids of the channels (default: data/games.json)")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    parser.add_argument("--simulate", type=float, default=0, help="Seconds between random events (0: only POST /trigger)")
+    parser.add_argument("--events", type=int, default=10, help="Random events per interval")
+    args = parser.parse_args()
+
+    asyncio.run(run_fake_eventsub(args))
@@ -0,0 +1,76 @@
+import json
+import redis
+
+from config import base_path, games_to_probe, game_changes_channel
+
+
+class GameChanges:
+    """
+    Local map of the game of the streams of a downloader, kept up to date by the game changes of the streams-tracker's
+    track_current (stream_games hash when streams are added, game_changes_channel afterwards) instead of reading
+    current_probes for every thumbnail. Streams that switch to a game not probed are paused until they switch back.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+
+        with open("{}/data/games.json".format(base_path), "r") as f:
+            games_mapping = json.load(f)
+
+        # Twitch game id -> game id of the games to probe, as in twitch_api_process
+        self.games = {game: games_mapping[game]["id"] for game in games_to_probe if games_mapping.get(game)}
+
+        self.subscribe()
+
+    def subscribe(self):
+        self.pubsub = self.storage.pubsub()
+        self.pubsub.subscribe(game_changes_channel)
+
+    def apply(self, stream, twitch_game_id):
+        # True if the stream was paused or resumed
+        game_id = self.games.get(twitch_game_id)
+        was_paused = stream.paused
+
+        if game_id:
+            stream.game_id = game_id
+        stream.paused = game_id is None
+
+        return stream.paused != was_paused
+
+    def seed(self, streams):
+        # Changes published before the streams were added to this downloader
+        streams = list(streams)
+        if not streams:
+            return
+
+        for stream, twitch_game_id in zip(streams, self.storage.hmget("stream_games", [stream.stream_id for stream in streams])):
+            if twitch_game_id:
+                self.apply(stream, twitch_game_id.decode("utf-8"))
+
+    def poll(self, streams):
+        """
+        Applies the changes published since the last call to streams (stream id -> StreamToProbe). Returns the streams
+        paused or resumed.
+        """
+        toggled = []
+
+        try:
+            # None once nothing is pending (subscription confirmations are messages too)
+            message = self.pubsub.get_message()
+
+            while message:
+                if message["type"] == "message":
+                    change = json.loads(message["data"])
+                    stream = streams.get(change["id"])
+
+                    if stream and self.apply(stream, change["game_id"]):
+                        toggled.append(stream)
+
+                message = self.pubsub.get_message()
+        except redis.ConnectionError:
+            # Changes published while disconnected are lost: start over from stream_games
+            self.subscribe()
+            paused = [stream.paused for stream in streams.values()]
+            self.seed(streams.values())
+            toggled.extend([stream for stream, was_paused in zip(streams.values(), paused) if stream.paused != was_paused])
+
+        return toggled
@@ -0,0 +1,131 @@
+import bisect
+
+from datetime import datetime
+from config import metrics_flush_interval
+
+
+# Upper bounds of the buckets of each histogram (Prometheus "le"), plus +Inf
+BUCKETS = {
+    "thumbnail_request_seconds": [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5],
+    "thumbnail_lateness_seconds": [1, 5, 15, 30, 60, 120, 300, 600],
+    "thumbnail_bytes": [16384, 32768, 65536, 131072, 262144, 524288, 1048576, 2097152],
+    "downloader_queue_depth": [10, 25, 50, 100, 200, 300, 500, 1000, 5000],
+}
+
+HELP = {
+    "thumbnail_request_seconds": "Duration of thumbnail GETs, body included",
+    "thumbnail_lateness_seconds": "Delay of thumbnail downloads behind their scheduled time (CDN Expires of the previous frame)",
+    "thumbnail_bytes": "Size of the new thumbnails downloaded",
+    "downloader_queue_depth": "Streams in the queue of a downloader (streams_{idx}), sampled every loop",
+    "thumbnail_downloads": "Thumbnail downloads by outcome",
+}
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+def field(name, labels, part):
+    # download_metrics fields: name|labels|bucket upper bound, "sum" or "total"
+    return "{}|{}|{}".format(name, labels, part)
+
+
+class DownloadMetrics:
+    """
+    In-process histograms and counters of the download path. Every metrics_flush_interval seconds the counts observed
+    since the last flush are added to the download_metrics hash (HINCRBY), shared by all downloaders: its size is bounded
+    by the number of buckets and queues, whatever the number of downloads. metrics_exporter serves it to Prometheus.
+    """
+    def __init__(self, storage, idx):
+        self.storage = storage
+        self.idx = idx
+        self.histograms = {}
+        self.counters = {}
+        self.last_flush = datetime.now()
+
+    def observe(self, name, value, labels=""):
+        if (name, labels) not in self.histograms:
+            self.histograms[(name, labels)] = Histogram(BUCKETS[name])
+
+        self.histograms[(name, labels)].observe(value)
+
+    def count(self, name, labels=""):
+        self.counters[(name, labels)] = self.counters.get((name, labels), 0) + 1
+
+    def queue_depth(self, depth):
+        self.observe("downloader_queue_depth", depth, 'worker="{}"'.format(self.idx))
+
+    def flush(self, force=False):
+        if not force and (datetime.now() - self.last_flush).total_seconds() < metrics_flush_interval:
+            return
+
+        pipeline = self.storage.pipeline(transaction=False)
+
+        for (name, labels), histogram in self.histograms.items():
+            for bound, count in zip(histogram.bounds + ["+Inf"], histogram.counts):
+                if count:
+                    pipeline.hincrby("download_metrics", field(name, labels, bound), count)
+            pipeline.hincrbyfloat("download_metrics", field(name, labels, "sum"), histogram.sum)
+
+        for (name, labels), count in self.counters.items():
+            pipeline.hincrby("download_metrics", field(name, labels, "total"), count)
+
+        pipeline.execute()
+
+        self.histograms = {}
+        self.counters = {}
+        self.last_flush = datetime.now()
+
+
+def render(fields):
+    """
+    Prometheus text format of the download_metrics hash: cumulative buckets, _sum and _count of every histogram, _total of
+    every counter.
+    """
+    histograms = {}
+    counters = {}
+
+    for key, value in fields.items():
+        name, labels, part = key.decode("utf-8").split("|")
+
+        if part == "total":
+            counters[(name, labels)] = int(value)
+        elif part == "sum":
+            histograms.setdefault((name, labels), {})["sum"] = float(value)
+        else:
+            histograms.setdefault((name, labels), {})[part] = int(value)
+
+    lines = []
+    for name in sorted(set([n for n, _ in histograms.keys()])):
+        lines.extend(["# HELP {} {}".format(name, HELP.get(name, name)), "# TYPE {} histogram".format(name)])
+
+        for (n, labels), values in sorted(histograms.items()):
+            if n != name:
+                continue
+
+            cumulative = 0
+            prefix = "{},".format(labels) if labels else ""
+
+            for bound in BUCKETS[name] + ["+Inf"]:
+                cumulative += values.get(str(bound), 0)
+                lines.append('{}_bucket{{{}le="{}"}} {}'.format(name, prefix, bound, cumulative))
+
+            suffix = "{{{}}}".format(labels) if labels else ""
+            lines.append("{}_sum{} {}".format(name, suffix, values.get("sum", 0)))
+            lines.append("{}_count{} {}".format(name, suffix, cumulative))
+
+    for name in sorted(set([n for n, _ in counters.keys()])):
+        lines.extend(["# HELP {}_total {}".format(name, HELP.get(name, name)), "# TYPE {}_total counter".format(name)])
+
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append("{}_total{} {}".format(name, "{{{}}}".format(labels) if labels else "", value))
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,36 @@
+import asyncio
+import redis
+
+from aiohttp import web
+from config import redis_host, redis_password, redis_port, metrics_port
+from logger import get_logger
+from metrics import render
+
+
+class MetricsExporter:
+    """
+    Serves the download_metrics hash written by the downloaders in the Prometheus text format, on /metrics.
+    """
+    def __init__(self):
+        self.logger = get_logger("metrics_exporter", 'metrics')
+        self.storage = redis.Redis(host=redis_host, port=redis_port, db=0, password=redis_password)
+
+    async def metrics(self, request):
+        fields = await asyncio.get_running_loop().run_in_executor(None, self.storage.hgetall, "download_metrics")
+
+        return web.Response(body=render(fields).encode("utf-8"), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.metrics)
+
+        return app
+
+    def run(self, port=metrics_port):
+        self.logger.info("Serving metrics on port {}".format(port))
+        web.run_app(self.app(), port=port, print=None)
+
+
+if __name__ == '__main__':
+    exporter = MetricsExporter()
+    exporter.run()
@@ -0,0 +1,159 @@
+import asyncio
+import time
+
+
+# KEYS: bucket. ARGV: cost, capacity, rate, reserve. Refills the shared bucket up to now (Redis clock, the same for every
+# process) and takes cost points if that leaves at least reserve. Returns 0, or the milliseconds to wait before retrying
+ACQUIRE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'capacity', 'rate')
+local capacity = tonumber(state[3]) or tonumber(ARGV[2])
+local rate = tonumber(state[4]) or tonumber(ARGV[3])
+local tokens = math.min(capacity, (tonumber(state[1]) or capacity) + math.max(0, now - (tonumber(state[2]) or now)) * rate)
+local cost = tonumber(ARGV[1])
+local wait = 0
+if tokens - cost >= tonumber(ARGV[4]) then
+    tokens = tokens - cost
+else
+    wait = math.ceil((cost + tonumber(ARGV[4]) - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now), 'capacity', tostring(capacity), 'rate', tostring(rate))
+redis.call('EXPIRE', KEYS[1], 3600)
+return wait
+"""
+
+# KEYS: bucket. ARGV: capacity, rate, Ratelimit-Limit, Ratelimit-Remaining, Ratelimit-Reset (or ''), exhausted (0/1). Same
+# re-synchronisation as TokenBucket.update, applied to the shared bucket
+UPDATE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'capacity', 'rate')
+local rate = tonumber(state[4]) or tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local remaining = tonumber(ARGV[4])
+local tokens = math.min(capacity, (tonumber(state[1]) or capacity) + math.max(0, now - (tonumber(state[2]) or now)) * rate)
+tokens = math.min(tokens, remaining)
+if ARGV[5] ~= '' then
+    local to_reset = tonumber(ARGV[5]) - now
+    if to_reset > 0 and remaining < capacity then
+        rate = (capacity - remaining) / math.max(to_reset, 1)
+    end
+end
+if ARGV[6] == '1' then
+    tokens = 0
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now), 'capacity', tostring(capacity), 'rate', tostring(rate))
+redis.call('EXPIRE', KEYS[1], 3600)
+return 0
+"""
+
+
+class TokenBucket:
+    """
+    Local mirror of the Helix rate limit bucket.
+
+    Helix refills the bucket continuously (Ratelimit-Limit points per minute) and reports the state of the bucket in
+    every response through the Ratelimit-Remaining/Ratelimit-Reset headers. Requests acquire points locally, and each
+    response re-synchronises the local estimate with the server, so that the API can be driven up to its real budget
+    without blind sleeps.
+    """
+    def __init__(self, capacity=800, refill_period=60, reserve=0):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.rate = capacity / refill_period
+        self.reserve = reserve
+        self.last_refill = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self, cost=1):
+        async with self.lock:
+            while True:
+                self.refill()
+
+                if self.tokens - cost >= self.reserve:
+                    self.tokens -= cost
+                    return
+
+                await asyncio.sleep((cost + self.reserve - self.tokens) / self.rate)
+
+    def update(self, headers):
+        limit = headers.get('ratelimit-limit')
+        remaining = headers.get('ratelimit-remaining')
+        reset = headers.get('ratelimit-reset')
+
+        if limit is None or remaining is None:
+            return
+
+        self.capacity = int(limit)
+        self.refill()
+
+        # Responses to requests sent in parallel can arrive out of order: only trust the server when it is more
+        # pessimistic than the local estimate.
+        self.tokens = min(self.tokens, int(remaining))
+
+        if reset is not None:
+            to_reset = float(reset) - time.time()
+
+            # Ratelimit-Reset has a one second resolution: a reset due within the second would give an absurd rate
+            if to_reset > 0 and int(remaining) < self.capacity:
+                self.rate = (self.capacity - int(remaining)) / max(to_reset, 1)
+
+    def exhausted(self, headers):
+        # Worst case scenario: the bucket is empty, wait until the server refills it
+        self.update(headers)
+        self.tokens = 0
+        self.last_refill = time.monotonic()
+
+
+class RedisTokenBucket:
+    """
+    TokenBucket kept in a Redis hash, so that every process using the same Helix credentials (stream_gatherer,
+    track_current, the download module's twitch_api_process) draws from one budget. Each process keeps its own reserve:
+    a process with a larger reserve backs off first and leaves the rest of the bucket to the others.
+    """
+    def __init__(self, storage, key, capacity=800, refill_period=60, reserve=0):
+        self.key = key
+        self.capacity = capacity
+        self.rate = capacity / refill_period
+        self.reserve = reserve
+
+        self.acquire_script = storage.register_script(ACQUIRE)
+        self.update_script = storage.register_script(UPDATE)
+
+    async def acquire(self, cost=1):
+        while True:
+            wait = self.acquire_script(keys=[self.key], args=[cost, self.capacity, self.rate, self.reserve])
+
+            if wait == 0:
+                return
+
+            await asyncio.sleep(wait / 1000)
+
+    def update(self, headers, exhausted=False):
+        limit = headers.get('ratelimit-limit')
+        remaining = headers.get('ratelimit-remaining')
+
+        if limit is None or remaining is None:
+            if exhausted:
+                limit, remaining = self.capacity, 0
+            else:
+                return
+
+        self.update_script(keys=[self.key], args=[self.capacity, self.rate, int(limit), int(remaining), headers.get('ratelimit-reset') or '', int(exhausted)])
+
+    def exhausted(self, headers):
+        self.update(headers, exhausted=True)
+
+
+def get_bucket(client_id, reserve=0, storage=None):
+    # storage: Redis connection holding the bucket shared by every process using client_id, None for a bucket of this process only
+    if storage is None:
+        return TokenBucket(reserve=reserve)
+
+    return RedisTokenBucket(storage, "helix_rate_limit:{}".format(client_id), reserve=reserve)
@@ -0,0 +1,127 @@
+import argparse
+import json
+import statistics
+
+from datetime import datetime, timedelta
+from adaptive_sampling import classify, next_factor, stretch
+from config import sampling_window
+
+
+def load_series(paths):
+    # JSON lines of data.latency documents (data-backup's mongo-latency-*.json, mongoexport): (date, latency) by stream
+    series = {}
+
+    for path in paths:
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+
+                entry = json.loads(line)
+                date = entry["date"]["$date"] / 1000 if isinstance(entry["date"], dict) else entry["date"]
+
+                series.setdefault((entry["game_id"], entry["stream_id"]), []).append((float(date), int(entry["latency"])))
+
+    return {key: sorted(readings) for key, readings in series.items()}
+
+
+def find_events(readings):
+    # Spikes seen by downloading every frame: runs of consecutive readings classified as "spike", as (first, last) indexes
+    events = []
+
+    for idx in range(len(readings)):
+        if classify(readings[max(0, idx - sampling_window + 1):idx + 1]) != "spike":
+            continue
+
+        if events and events[-1][1] == idx - 1:
+            events[-1] = (events[-1][0], idx)
+        else:
+            events.append((idx, idx))
+
+    return events
+
+
+def replay(readings, period, delay):
+    """
+    Indexes of the readings a downloader with adaptive sampling would have downloaded. Every reading stands for a frame
+    downloaded at one CDN refresh (period seconds); the latency of a frame only reaches the downloader delay seconds later
+    (pre-processing, OCR and process-raw-results), and only the latency of downloaded frames does.
+    """
+    downloaded = []
+    factor = 1
+    visible = 0
+    next_time = readings[0][0]
+
+    for idx, (date, _) in enumerate(readings):
+        # Half a period of slack: readings are dated by the CDN, not exactly period seconds apart
+        if date < next_time - period / 2:
+            continue
+
+        last_visible = visible
+        while visible < len(downloaded) and readings[downloaded[visible]][0] + delay <= date:
+            visible += 1
+
+        if visible != last_visible:
+            factor = next_factor(factor, classify([readings[i] for i in downloaded[max(0, visible - sampling_window):visible]]))
+
+        downloaded.append(idx)
+
+        thumbnail_date = datetime.fromtimestamp(date)
+        next_time = stretch(factor, thumbnail_date, thumbnail_date + timedelta(seconds=period)).timestamp()
+
+    return downloaded
+
+
+def replay_stream(readings, period, delay):
+    # Period of the stream: the most common spacing of its readings unless given
+    if period is None:
+        gaps = [b[0] - a[0] for a, b in zip(readings, readings[1:]) if b[0] > a[0]]
+        period = statistics.median(gaps) if gaps else 300
+
+    downloaded = set(replay(readings, period, delay))
+    events = find_events(readings)
+    missed = 0
+    delays = []
+
+    for first, last in events:
+        caught = [idx for idx in range(first, last + 1) if idx in downloaded]
+
+        if caught:
+            delays.append(readings[caught[0]][0] - readings[first][0])
+        else:
+            missed += 1
+
+    return {"readings": len(readings), "downloaded": len(downloaded), "events": len(events), "missed": missed, "delays": delays}
+
+
+def print_results(name, results):
+    readings = sum([r["readings"] for r in results])
+    downloaded = sum([r["downloaded"] for r in results])
+    events = sum([r["events"] for r in results])
+    missed = sum([r["missed"] for r in results])
+    delays = [d for r in results for d in r["delays"]]
+
+    print("{:<12} streams {:>6}  thumbnails {:>8} -> {:>8} (saved {:>6.1%})  spikes {:>6}  missed {:>5} ({:>6.1%})  detection delay {:>6.0f}s".format(
+        name, len(results), readings, downloaded, 1 - downloaded / readings if readings else 0, events, missed,
+        missed / events if events else 0, statistics.mean(delays) if delays else 0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay adaptive sampling on stored latency series: thumbnails saved vs spikes missed")
+    parser.add_argument("files", nargs="+", help="JSON lines of data.latency documents (e.g. data-backup's mongo-latency-*.json)")
+    parser.add_argument("--period", type=float, default=None, help="Seconds between two CDN refreshes (default: median spacing of each stream)")
+    parser.add_argument("--delay", type=float, default=30 * 60, help="Seconds between the download of a frame and its latency in latency_window")
+    parser.add_argument("--min-readings", type=int, default=2 * sampling_window, help="Shorter streams are left out")
+    args = parser.parse_args()
+
+    series = load_series(args.files)
+    by_game = {}
+
+    for (game_id, _), readings in sorted(series.items()):
+        if len(readings) >= args.min_readings:
+            by_game.setdefault(game_id, []).append(replay_stream(readings, args.period, args.delay))
+
+    for game_id, results in sorted(by_game.items()):
+        print_results("game {}".format(game_id), results)
+
+    print_results("total", [r for results in by_game.values() for r in results])
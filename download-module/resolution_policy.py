@@ -0,0 +1,20 @@
+import json
+import os
+
+from config import base_path, width, height
+
+
+class ResolutionPolicy:
+    """
+    Thumbnail size to request for each game: the smallest one at which OCR of the game's areas of interest holds, from
+    data/resolution_policy.json (written by pre-process-images' calibrate_resolution). Other games: width x height.
+    """
+    def __init__(self, path="{}/data/resolution_policy.json".format(base_path)):
+        self.sizes = {}
+
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                self.sizes = {game_id: (policy["width"], policy["height"]) for game_id, policy in json.load(f).items()}
+
+    def size(self, game_id):
+        return self.sizes.get(game_id, (width, height))
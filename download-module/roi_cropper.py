@@ -0,0 +1,50 @@
+import json
+import cv2
+import numpy as np
+
+from config import base_path, extra_areas
+
+
+def scale_area(area, scale):
+    return {k: int(round(v * scale)) for k, v in area.items()}
+
+
+def areas_for_height(game_areas, height):
+    # Thumbnails fetched at another size than the ones listed (resolution_policy): 1080p areas scaled, as in pre-process-images
+    if str(height) in game_areas:
+        return game_areas[str(height)]
+
+    return [scale_area(area, height / 1080) for area in game_areas.get("1080", [])]
+
+
+class RoiCropper:
+    """
+    Crops thumbnails at download time to the areas of interest of their game (data/areas_of_interest.json, by frame
+    height) and its extra_areas, the way pre-process-images does. Crops are PNG encoded and keyed by the suffix of their
+    name (_area{idx}, _extra), which tells pre-process-images that the image is already cropped.
+    """
+    def __init__(self):
+        with open("{}/data/areas_of_interest.json".format(base_path), "r") as f:
+            self.areas = json.load(f)
+
+    def crop(self, game_id, image_data):
+        img = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+        if img is None:
+            return {}
+
+        candidate_areas = areas_for_height(self.areas.get(game_id, {}), img.shape[0])
+        crops = {}
+
+        for area_idx, area in enumerate(candidate_areas):
+            crops["_area{}".format(area_idx)] = self.encode(img[area["y1"]:area["y2"], area["x1"]:area["x2"]])
+
+        extra_area = scale_area(extra_areas.get(game_id, {}), img.shape[0] / 1080)
+        if extra_area and candidate_areas:
+            crops["_extra"] = self.encode(img[extra_area["y1"]:extra_area["y2"], extra_area["x1"]:extra_area["x2"]])
+
+        return crops
+
+    @staticmethod
+    def encode(img):
+        return cv2.imencode(".png", img)[1].tobytes()
@@ -0,0 +1,97 @@
+import bisect
+import hashlib
+
+from datetime import datetime
+from config import shard_replicas, shard_worker_timeout, shard_steal_after
+
+
+# KEYS: worker_heartbeats. ARGV: thief, alive since, overdue before, max streams. Takes overdue streams from the schedules
+# published by the other live workers and moves them to the thief's queue. Returns the ids of the streams taken
+STEAL_STREAMS = """
+local workers = redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[2], '+inf')
+local max_streams = tonumber(ARGV[4])
+local stolen = {}
+for _, victim in ipairs(workers) do
+    if victim ~= ARGV[1] and #stolen < max_streams then
+        local overdue = redis.call('ZRANGEBYSCORE', 'schedule_' .. victim, '-inf', ARGV[3], 'LIMIT', 0, max_streams - #stolen)
+        for _, stream_id in ipairs(overdue) do
+            redis.call('ZREM', 'schedule_' .. victim, stream_id)
+            if redis.call('SREM', 'streams_' .. victim, stream_id) == 1 then
+                redis.call('SADD', 'streams_' .. ARGV[1], stream_id)
+                stolen[#stolen + 1] = stream_id
+            end
+        end
+    end
+end
+return stolen
+"""
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hashing of stream ids onto workers: every worker owns shard_replicas points of the ring and a stream belongs
+    to the worker of the first point after its hash, so adding or removing a worker only moves the streams of the arcs it
+    gains or loses.
+    """
+    def __init__(self, workers, replicas=shard_replicas):
+        self.workers = sorted(set([str(w) for w in workers]))
+
+        points = sorted([(ring_hash("{}#{}".format(w, r)), w) for w in self.workers for r in range(replicas)])
+        self.hashes = [h for h, _ in points]
+        self.owners = [w for _, w in points]
+
+    def owner(self, stream_id):
+        if not self.owners:
+            return None
+
+        return self.owners[bisect.bisect(self.hashes, ring_hash(stream_id)) % len(self.owners)]
+
+    def __eq__(self, other):
+        return isinstance(other, HashRing) and self.workers == other.workers
+
+    def __len__(self):
+        return len(self.workers)
+
+
+def live_workers(storage, now=None):
+    now = now or datetime.now()
+
+    return set([x.decode("utf-8") for x in storage.zrangebyscore("worker_heartbeats", now.timestamp() - shard_worker_timeout, "+inf")])
+
+
+class ShardWorker:
+    """
+    Downloader side of the sharding: heartbeats with the schedule of the worker's streams (worker_heartbeats,
+    schedule_{idx}), and work stealing from the other workers' schedules when idle.
+    """
+    def __init__(self, storage, idx):
+        self.storage = storage
+        self.idx = str(idx)
+        self.steal_streams = storage.register_script(STEAL_STREAMS)
+
+    def heartbeat(self, streams):
+        # streams: stream id -> next download time
+        pipeline = self.storage.pipeline(transaction=True)
+        pipeline.zadd("worker_heartbeats", {self.idx: datetime.now().timestamp()})
+        pipeline.delete("schedule_{}".format(self.idx))
+
+        if streams:
+            pipeline.zadd("schedule_{}".format(self.idx), {stream_id: next_time.timestamp() for stream_id, next_time in streams.items()})
+
+        pipeline.execute()
+
+    def steal(self, max_streams):
+        now = datetime.now().timestamp()
+        stolen = self.steal_streams(keys=["worker_heartbeats"], args=[self.idx, now - shard_worker_timeout, now - shard_steal_after, max_streams])
+
+        return [x.decode("utf-8") for x in stolen]
+
+    def leave(self):
+        pipeline = self.storage.pipeline(transaction=True)
+        pipeline.zrem("worker_heartbeats", self.idx)
+        pipeline.delete("schedule_{}".format(self.idx))
+        pipeline.execute()
@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import boto3
+
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from storage.storage_controller import StorageController
+from config import path_to_storage, s3_url, rw_access_key, rw_secret_key, bucket_name, raw_packs_path, pack_shard_size, pack_max_age, \
+    pack_upload, pack_part_size, pack_upload_concurrency
+
+
+class PackStorageController(StorageController):
+    """
+    Appends the thumbnails of a downloader to its current pack ({idx}-{creation date}.pack under path_to_storage/packs) and
+    one JSON line per thumbnail (name, offset, length) to the pack's side index (.idx, .idx.part while the pack is open).
+    Packs are sealed after pack_shard_size bytes or pack_max_age seconds, uploaded to raw_packs_path in parallel parts
+    (pack_upload) on a background thread and queued in raw_packs: thumbnails are not queued one by one in raw_images.
+    """
+    def __init__(self, queue, idx=0):
+        super().__init__()
+        self.queue = queue
+        self.idx = idx
+        self.path = "{}/packs".format(path_to_storage)
+        self.lock = threading.Lock()
+        self.uploader = ThreadPoolExecutor(max_workers=1)
+        self.uploading = set()
+        # Sealed packs whose upload or queueing failed, submitted again on the next flush
+        self.failed = set()
+
+        self.pack_id = None
+        self.pack = None
+        self.index = None
+        self.opened = None
+
+        self.client = None
+        if pack_upload:
+            self.client = boto3.client(
+                's3',
+                aws_access_key_id=rw_access_key,
+                aws_secret_access_key=rw_secret_key,
+                endpoint_url=s3_url
+            )
+            self.transfer_config = TransferConfig(multipart_threshold=pack_part_size, multipart_chunksize=pack_part_size,
+                                                  max_concurrency=pack_upload_concurrency)
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        # Packs left behind by a previous run of this downloader: open ones are sealed, sealed ones uploaded again
+        self.resume()
+
+    def file_path(self, pack_id, extension):
+        return "{}/{}.{}".format(self.path, pack_id, extension)
+
+    def save_image(self, stream, game_id, thumbnail_date, image_data, suffix=""):
+        name = "{}_{}_{}_{}{}.png".format(game_id, thumbnail_date.strftime('%Y-%m-%d-%H-%M-%S'), stream.stream_id, stream.user_id, suffix)
+
+        # The async downloader saves from several executor threads
+        with self.lock:
+            if self.pack is None:
+                self.open_pack()
+
+            offset = self.pack.tell()
+            self.pack.write(image_data)
+            self.pack.flush()
+
+            # Written after the data: an index line never points past the end of the pack
+            self.index.write(json.dumps({"name": name, "offset": offset, "length": len(image_data)}) + "\n")
+            self.index.flush()
+
+            if offset + len(image_data) >= pack_shard_size:
+                self.seal_pack()
+
+        return None
+
+    def flush(self):
+        with self.lock:
+            if self.pack is not None and (datetime.now() - self.opened).total_seconds() >= pack_max_age:
+                self.seal_pack()
+
+        if self.failed:
+            failed, self.failed = self.failed, set()
+
+            for pack_id in sorted(failed):
+                self.submit(pack_id)
+
+    def close(self):
+        with self.lock:
+            if self.pack is not None:
+                self.seal_pack()
+
+        self.uploader.shutdown(wait=True)
+
+    def open_pack(self):
+        self.opened = datetime.now()
+        self.pack_id = "{}-{}".format(self.idx, self.opened.strftime('%Y-%m-%d-%H-%M-%S-%f'))
+        self.pack = open(self.file_path(self.pack_id, "pack"), "ab")
+        self.index = open(self.file_path(self.pack_id, "idx.part"), "a")
+
+    def seal_pack(self):
+        self.pack.close()
+        self.index.close()
+        os.rename(self.file_path(self.pack_id, "idx.part"), self.file_path(self.pack_id, "idx"))
+
+        self.submit(self.pack_id)
+        self.pack_id, self.pack, self.index = None, None, None
+
+    def resume(self):
+        prefix = "{}-".format(self.idx)
+
+        for name in sorted(os.listdir(self.path)):
+            if name.startswith(prefix) and name.endswith(".idx.part"):
+                pack_id = name[:-len(".idx.part")]
+                self.repair(pack_id)
+                os.rename(self.file_path(pack_id, "idx.part"), self.file_path(pack_id, "idx"))
+                self.submit(pack_id)
+            elif self.client and name.startswith(prefix) and name.endswith(".idx"):
+                self.submit(name[:-len(".idx")])
+
+    def repair(self, pack_id):
+        # Drops a partly written last index line and the bytes of the pack it does not index
+        entries = []
+
+        with open(self.file_path(pack_id, "idx.part"), "r") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+
+        with open(self.file_path(pack_id, "idx.part"), "w") as f:
+            f.writelines([json.dumps(entry) + "\n" for entry in entries])
+
+        with open(self.file_path(pack_id, "pack"), "ab") as f:
+            f.truncate(entries[-1]["offset"] + entries[-1]["length"] if entries else 0)
+
+    def submit(self, pack_id):
+        if pack_id not in self.uploading:
+            self.uploading.add(pack_id)
+            self.uploader.submit(self.upload, pack_id)
+
+    def upload(self, pack_id):
+        try:
+            if self.client:
+                # Multipart upload of pack_part_size parts, pack_upload_concurrency at once; the index last, once the pack is there
+                for extension in ["pack", "idx"]:
+                    self.client.upload_file(self.file_path(pack_id, extension), bucket_name, "{}/{}.{}".format(raw_packs_path, pack_id, extension),
+                                            Config=self.transfer_config)
+
+                os.remove(self.file_path(pack_id, "pack"))
+                os.remove(self.file_path(pack_id, "idx"))
+
+            self.queue.sadd("raw_packs", pack_id)
+        except Exception:
+            # Kept on disk, uploaded (or queued) again on the next flush
+            self.failed.add(pack_id)
+        finally:
+            self.uploading.discard(pack_id)
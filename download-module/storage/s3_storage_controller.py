@@ -14,8 +14,8 @@ class S3StorageController(StorageController):
             endpoint_url=s3_url
         )
                 
-    def save_image(self, stream, game_id, thumbnail_date, image_data):        
-        file_path = "{}/{}_{}_{}_{}.png".format(raw_images_path, game_id, thumbnail_date.strftime('%Y-%m-%d-%H-%M-%S'), stream.stream_id, stream.user_id)       
+    def save_image(self, stream, game_id, thumbnail_date, image_data, suffix=""):        
+        file_path = "{}/{}_{}_{}_{}{}.png".format(raw_images_path, game_id, thumbnail_date.strftime('%Y-%m-%d-%H-%M-%S'), stream.stream_id, stream.user_id, suffix)       
         self.client.put_object(Body=image_data, Bucket=bucket_name, Key=file_path)
 
         return file_path
\ No newline at end of file
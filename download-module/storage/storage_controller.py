@@ -2,5 +2,13 @@ class StorageController:
     def __init__(self):
         pass
 
-    def save_image(self, stream, game_id, thumbnail_date, image_data):
+    def save_image(self, stream, game_id, thumbnail_date, image_data, suffix=""):
+        # Returns the name to queue in raw_images, None if the controller queues images itself
+        pass
+
+    def flush(self):
+        # Called periodically by the downloaders
+        pass
+
+    def close(self):
         pass
\ No newline at end of file
@@ -1,3 +1,5 @@
+import hashlib
+
 from datetime import datetime
 
 
@@ -5,5 +7,36 @@ class StreamToProbe:
     def __init__(self, stream):
         self.stream_id = stream['id']
         self.user_id = stream['user_id']
+        self.game_id = stream.get('game_id')
+        # No thumbnail of the user's previous streams gave a latency value (coordinator, yield_backoff only)
+        self.zero_yield_user = stream.get('zero_yield_user', False)
+        # Switched to a game not probed (game_changes only): downloaded every game_paused_interval to notice its end, not stored
+        self.paused = False
         self.url = stream['thumbnail_url']
         self.next_time = datetime.now()
+
+        # Validators and content hash of the last frame downloaded
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+
+    def conditional_headers(self):
+        headers = {}
+
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        return headers
+
+    def is_new_frame(self, headers, content):
+        # The CDN does not always honour conditional requests: identical bodies are detected by hash
+        self.etag = headers.get('ETag', self.etag)
+        self.last_modified = headers.get('Last-Modified', self.last_modified)
+
+        content_hash = hashlib.blake2b(content, digest_size=16).hexdigest()
+        is_new = content_hash != self.content_hash
+        self.content_hash = content_hash
+
+        return is_new
@@ -0,0 +1,26 @@
+import importlib.util
+import json
+import os
+
+import config
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PRE_PROCESS = os.path.join(HERE, "..", "image-processing-module", "pre-process-images")
+
+
+def test_areas_of_interest_match_pre_process_images():
+    # Crops made at download time must be the areas pre-process-images would cut from the full frame
+    with open(os.path.join(HERE, "data", "areas_of_interest.json"), "r") as f:
+        areas = json.load(f)
+
+    with open(os.path.join(PRE_PROCESS, "data", "areas_of_interest.json"), "r") as f:
+        assert json.load(f) == areas
+
+
+def test_extra_areas_match_pre_process_images():
+    spec = importlib.util.spec_from_file_location("pre_process_config", os.path.join(PRE_PROCESS, "config.py"))
+    pre_process_config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(pre_process_config)
+
+    assert pre_process_config.extra_areas == config.extra_areas
@@ -1,65 +1,57 @@
+import asyncio
 import json
-import requests
+import random
+import aiohttp
 import redis
 
-from time import sleep
-
-from config import redis_host, redis_password, redis_port, games_to_probe, twitch_api_id, twitch_client_secret, rate_limit_safety_factor, base_path
+from config import redis_host, redis_password, redis_port, games_to_probe, twitch_api_id, twitch_client_secret, rate_limit_safety_factor, base_path, \
+    twitch_api_url, twitch_auth_url, api_concurrency, api_max_retries, api_retry_backoff, api_request_timeout, shared_rate_limit
 from logger import get_logger
-
-
-def post_request(url):
-    try:
-        return requests.post(url)
-    except Exception:
-        return False
-
+from rate_limiter import get_bucket
 
 
 class TwitchAPIProcess:
-    def __init__(self):
+    """
+    Queries the status of the users in twitch_api_to_query by chunks of 100, up to api_concurrency chunks at once, all of
+    them drawing from one Helix rate limit bucket (kept in Redis and shared with the streams-tracker with shared_rate_limit).
+    """
+    def __init__(self, api_url=twitch_api_url, auth_url=twitch_auth_url):
         super().__init__()
         self.logger = get_logger("twitch_logger", 'twitch')
         self.storage = redis.Redis(host=redis_host, port=redis_port, db=0, password=redis_password)
-        self.token = self.get_api_token()
+        self.api_url = api_url
+        self.auth_url = auth_url
+        self.token = None
         self.online = []
         self.offline = []
 
         with open("{}/data/games.json".format(base_path), "r") as f:
             self.games_mapping = json.load(f)
 
+        # Twitch game id -> game id of the games to probe
+        self.games = {game: self.games_mapping[game]["id"] for game in games_to_probe if self.games_mapping.get(game)}
 
-    def check_rate_limits(self, streams_response):
-        available_tokens = int(streams_response.headers.get('ratelimit-remaining'))
-        total_tokens = int(streams_response.headers.get('ratelimit-limit'))
-
-        self.logger.info('Tokens: Available {}, Total {}'.format(available_tokens, total_tokens))
-
-        if rate_limit_safety_factor * total_tokens > available_tokens:
-            # You are under the safety level, it's better to backoff
-            self.logger.info("Under safety level, I'll sleep for 5 seconds")
-            sleep(5)
 
+    async def get_api_token(self, session):
+        params = {"client_id": twitch_api_id, "client_secret": twitch_client_secret, "grant_type": "client_credentials"}
 
-    def get_api_token(self):
-        params = {
-            "client_id": twitch_api_id,
-            "client_secret": twitch_client_secret,
-            "grant_type": "client_credentials"
-        }
+        try:
+            async with session.post(self.auth_url, params=params) as response:
+                if response.status != 200:
+                    self.logger.error("Error getting token. Status code: {}".format(response.status))
+                    return None
 
-        auth_url = "https://id.twitch.tv/oauth2/token?client_id={}&client_secret={}&grant_type={}".format(
-            params['client_id'], params['client_secret'], params['grant_type'])
+                return (await response.json()).get("access_token", "")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.error("Error getting token: {}".format(e))
 
-        auth_response = post_request(auth_url)
-        if auth_response and auth_response.status_code == 200:
-            auth = auth_response.content.decode('utf-8')
 
-            return json.loads(auth).get("access_token", "")
-        elif auth_response and auth_response.status_code != 200:
-            self.logger.error("Error getting token. Status code: {}".format(auth_response.status_code))
-        else:
-            self.logger.error("Empty response")
+    async def refresh_token(self, session, rejected_token):
+        # Queries failing together with the same expired token refresh it only once
+        async with self.token_lock:
+            if self.token == rejected_token:
+                self.logger.info("Token rejected, getting a new one")
+                self.token = await self.get_api_token(session)
 
 
     def get_header(self):
@@ -68,85 +60,102 @@ class TwitchAPIProcess:
             "Authorization": "Bearer {}".format(self.token)
         }
 
-    def loop(self):
-        while True:
-            to_query = self.storage.spop("twitch_api_to_query", count=self.storage.scard("twitch_api_to_query"))
 
-            if not to_query:
-                sleep(5)
-                continue
-            
-            to_query = [x.decode("utf-8") for x in to_query]
+    async def loop(self):
+        # Created here so that they belong to the running event loop
+        self.token_lock = asyncio.Lock()
+        self.bucket = get_bucket(twitch_api_id, int(rate_limit_safety_factor * 800), self.storage if shared_rate_limit else None)
 
-            chunk_size = 100
-            data_chunks = [to_query[i:i + chunk_size] for i in range(0, len(to_query), chunk_size)]
+        connector = aiohttp.TCPConnector(limit=api_concurrency)
+        timeout = aiohttp.ClientTimeout(total=api_request_timeout)
 
-            for chunk in data_chunks:
-                new_users_data = self.query_users(chunk)
-                        
-                if new_users_data:
-                    response = json.loads(new_users_data)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            self.token = await self.get_api_token(session)
 
-                    self.separate_online_offline(chunk, response)
-                else: #Log something here!
-                    self.logger.info("Query failed! Chunk: {}".format(chunk))
-            
-            if self.online:
-                self.storage.sadd("twitch_api_online", *self.online)
-                self.online = []
-            
-            if self.offline:
-                self.storage.sadd("twitch_api_offline", *self.offline)
-                self.offline = []
-        
+            while True:
+                to_query = self.storage.spop("twitch_api_to_query", count=self.storage.scard("twitch_api_to_query"))
 
-    def query_users(self, chunk):
-        users_string = ""
+                if not to_query:
+                    await asyncio.sleep(5)
+                    continue
 
-        for user in chunk:
-            users_string = "{}user_id={}&".format(users_string, user)
+                to_query = [x.decode("utf-8") for x in to_query]
 
-        users_string = users_string[:-1]
+                chunk_size = 100
+                data_chunks = [to_query[i:i + chunk_size] for i in range(0, len(to_query), chunk_size)]
 
-        users_url = "https://api.twitch.tv/helix/streams?{}".format(users_string)
-        response = self.run_query(users_url)
+                semaphore = asyncio.Semaphore(api_concurrency)
+                await asyncio.gather(*[self.query_chunk(session, semaphore, chunk) for chunk in data_chunks])
 
-        if response and response.status_code == 200:
-            self.check_rate_limits(response)
+                if self.online:
+                    self.storage.sadd("twitch_api_online", *self.online)
+                    self.online = []
 
-            return response.content.decode('utf-8')
-    
+                if self.offline:
+                    self.storage.sadd("twitch_api_offline", *self.offline)
+                    self.offline = []
 
-    def run_query(self, url):
-        try:
-            return requests.get(url, headers=self.get_header(), params={}, timeout=5)
-        except Exception as e:
-            self.logger.info("Exception: {}".format(e))
-            return False    
 
+    async def query_chunk(self, session, semaphore, chunk):
+        async with semaphore:
+            response = await self.query_users(session, chunk)
+
+        if response:
+            self.separate_online_offline(chunk, response)
+        else:
+            self.logger.info("Query failed! Chunk: {}".format(chunk))
+
+
+    async def query_users(self, session, chunk):
+        # first=100: the default page size is 20, online users of the chunk beyond the first 20 would be reported offline
+        params = [("user_id", user) for user in chunk] + [("first", str(len(chunk)))]
+
+        for attempt in range(api_max_retries):
+            await self.bucket.acquire()
+            token = self.token
+
+            try:
+                async with session.get("{}/streams".format(self.api_url), params=params, headers=self.get_header()) as response:
+                    if response.status == 429:
+                        self.logger.info("Rate limit exceeded, waiting for the bucket to refill")
+                        self.bucket.exhausted(response.headers)
+                        continue
+
+                    self.bucket.update(response.headers)
+
+                    if response.status == 401:
+                        await self.refresh_token(session, token)
+                        continue
+
+                    if response.status == 200:
+                        return await response.json()
+
+                    self.logger.info("Query failed. Status code: {}. Attempt {}/{}".format(response.status, attempt + 1, api_max_retries))
+
+                    if response.status < 500:
+                        return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.logger.info("Exception: {}. Attempt {}/{}".format(e, attempt + 1, api_max_retries))
+
+            # Full jitter, so that chunks failing together do not retry together
+            await asyncio.sleep(random.uniform(0, api_retry_backoff * 2 ** attempt))
 
-    def separate_online_offline(self, chunk, response):    
-        online = set()
-        users = set(chunk)
+        return None
 
-        for stream in response['data']:
-            # Add filter by game here
-            if stream['game_id'] in games_to_probe:
-                game_id = self.games_mapping.get(stream['game_id'], None)
 
-                if game_id:
-                    online.add(stream['user_id'])
+    def separate_online_offline(self, chunk, response):
+        online = [stream for stream in response['data'] if stream['game_id'] in self.games]
 
-                    self.online.append(json.dumps({
-                        "stream_id": stream['id'],
-                        "user_id": stream['user_id'],
-                        "game_id": game_id["id"],
-                        "url": stream['thumbnail_url']
-                    }))
+        self.online.extend([json.dumps({
+            "stream_id": stream['id'],
+            "user_id": stream['user_id'],
+            "game_id": self.games[stream['game_id']],
+            "url": stream['thumbnail_url']
+        }) for stream in online])
 
-        self.offline.extend(list(users - online))
+        self.offline.extend(set(chunk).difference([stream['user_id'] for stream in online]))
 
 
 if __name__ == '__main__':
     api_process = TwitchAPIProcess()
-    api_process.loop()
+    asyncio.run(api_process.loop())
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from config import yield_min_images, yield_base_backoff, yield_max_backoff, yield_refresh_interval
+
+
+def next_level(level, streak, last_streak, readings):
+    # Back to every refresh once a thumbnail gave a value, one level up per update of a stream still without any
+    if streak < yield_min_images:
+        return 0 if readings else level
+
+    if streak > last_streak:
+        return min(level + 1, 32)
+
+    return level
+
+
+def backoff_seconds(level):
+    # Delay added to the next download: doubles with every level, at most yield_max_backoff (the occasional probe)
+    if level == 0:
+        return 0
+
+    return min(yield_base_backoff * 2 ** (level - 1), yield_max_backoff)
+
+
+class YieldBackoff:
+    """
+    Backoff of a downloader from streams whose thumbnails give no latency value (hidden overlay, custom layout), from the
+    yield of its streams (stream_yield:{stream_id}, written by process-raw-results). Refreshed every yield_refresh_interval
+    seconds with one pipeline. Streams of users without yield so far (zero_yield_user, set by the coordinator) start backed off.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+        self.levels = {}
+        self.streaks = {}
+        self.last_refresh = datetime.min
+
+    def refresh(self, streams):
+        if (datetime.now() - self.last_refresh).total_seconds() < yield_refresh_interval:
+            return
+
+        stream_ids = list(streams.keys())
+        pipeline = self.storage.pipeline(transaction=False)
+
+        for stream_id in stream_ids:
+            pipeline.hmget("stream_yield:{}".format(stream_id), "zero_streak", "readings")
+
+        levels = {}
+        streaks = {}
+
+        for stream_id, (streak, readings) in zip(stream_ids, pipeline.execute()):
+            level = self.levels.get(stream_id, 1 if streams[stream_id].zero_yield_user else 0)
+
+            if streak is None:
+                # Nothing processed yet
+                levels[stream_id] = level
+                continue
+
+            streaks[stream_id] = int(streak)
+            levels[stream_id] = next_level(level, streaks[stream_id], self.streaks.get(stream_id, 0), int(readings or 0))
+
+        # Streams no longer in the queue are forgotten
+        self.levels = levels
+        self.streaks = streaks
+        self.last_refresh = datetime.now()
+
+    def delay(self, stream, next_time):
+        level = self.levels.get(stream.stream_id, 1 if stream.zero_yield_user else 0)
+
+        return next_time + timedelta(seconds=backoff_seconds(level))
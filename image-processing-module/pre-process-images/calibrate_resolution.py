@@ -0,0 +1,166 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import timeit
+import cv2
+import pytesseract
+
+from functools import partial
+from pytesseract import Output
+from common import parse_image_name, get_bw_image
+from config import number_cores, tesseract_config
+
+
+REFERENCE_HEIGHT = 1080
+HEIGHTS = [1080, 900, 720, 648, 540, 480, 432, 360]
+
+
+def frame_size(height):
+    # Twitch thumbnails are 16:9
+    return int(round(height * 16 / 9 / 2)) * 2, height
+
+
+def downscale(img, height, jpeg_quality):
+    # The area as it would be cut from a thumbnail fetched at height instead of 1080 (resized and JPEG encoded by Twitch)
+    if height == REFERENCE_HEIGHT:
+        return img, len(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])[1])
+
+    scale = height / REFERENCE_HEIGHT
+    resized = cv2.resize(img, (max(1, int(round(img.shape[1] * scale))), max(1, int(round(img.shape[0] * scale)))), interpolation=cv2.INTER_AREA)
+    encoded = cv2.imencode(".jpg", resized, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])[1]
+
+    return cv2.imdecode(encoded, cv2.IMREAD_COLOR), len(encoded)
+
+
+def read_text(img, game_id):
+    # BW image of pre-processing, read as process-images' match_pytesseract does
+    bw = get_bw_image(img)
+    if bw is None:
+        return ""
+
+    try:
+        results = pytesseract.image_to_data(bw, output_type=Output.DICT, config="--psm {}".format(tesseract_config.get(game_id, 7)))
+    except pytesseract.pytesseract.TesseractError:
+        return ""
+
+    return " ".join([text.strip() for text in results["text"] if text.strip()])
+
+
+def calibrate_crop(heights, jpeg_quality, path):
+    """
+    OCR text and encoded size of one stored 1080p area (tiny image) at every height; the text read at 1080 is the reference.
+    """
+    image_info = parse_image_name(path)
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+
+    if img is None or image_info is None:
+        return None
+
+    results = {}
+    for height in heights:
+        scaled, size = downscale(img, height, jpeg_quality)
+        results[height] = {"text": read_text(scaled, image_info["game_id"]), "bytes": size}
+
+    return image_info["game_id"], results
+
+
+def frame_bytes(heights, jpeg_quality, path):
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+
+    if img is None:
+        return None
+
+    return {height: len(cv2.imencode(".jpg", cv2.resize(img, frame_size(height), interpolation=cv2.INTER_AREA), [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])[1])
+            for height in heights}
+
+
+def summarize(crops, heights):
+    # crops: OCR results of the crops of one game. Accuracy over the crops with some text at 1080
+    readable = [c for c in crops if c[REFERENCE_HEIGHT]["text"]]
+    summary = []
+
+    for height in heights:
+        matches = sum([c[height]["text"] == c[REFERENCE_HEIGHT]["text"] for c in readable])
+        summary.append({"height": height, "width": frame_size(height)[0], "samples": len(readable),
+                        "accuracy": matches / len(readable) if readable else 0,
+                        "crop_bytes": sum([c[height]["bytes"] for c in crops]) / len(crops)})
+
+    return summary
+
+
+def choose_size(summary, min_accuracy, min_samples):
+    # Smallest height that, like every larger one, keeps min_accuracy
+    chosen = REFERENCE_HEIGHT
+
+    for entry in sorted(summary, key=lambda x: -x["height"]):
+        if entry["samples"] < min_samples or entry["accuracy"] < min_accuracy:
+            break
+        chosen = entry["height"]
+
+    return frame_size(chosen)
+
+
+def list_crops(path, samples, seed):
+    # Tiny images of the areas (not _extra), sampled per game
+    by_game = {}
+
+    for root, _, files in os.walk(path):
+        for name in files:
+            image_info = parse_image_name(name)
+            if image_info and image_info["crop"] and image_info["crop"].startswith("area"):
+                by_game.setdefault(image_info["game_id"], []).append(os.path.join(root, name))
+
+    rng = random.Random(seed)
+    return {game: sorted(rng.sample(files, min(samples, len(files)))) for game, files in by_game.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-game thumbnail resolution policy: OCR accuracy vs bytes of stored 1080p areas at lower resolutions")
+    parser.add_argument("crops", help="Directory of tiny images (areas cut from 1080p thumbnails, e.g. an extracted _tiny zip)")
+    parser.add_argument("--frames", default=None, help="Directory of full 1080p thumbnails, to measure the bytes of whole thumbnails at each size")
+    parser.add_argument("--heights", type=int, nargs="*", default=HEIGHTS)
+    parser.add_argument("--samples", type=int, default=300, help="Areas per game")
+    parser.add_argument("--min-samples", type=int, default=100, help="Areas with text at 1080 needed to lower the resolution of a game")
+    parser.add_argument("--min-accuracy", type=float, default=0.98, help="Share of the areas read as at 1080")
+    parser.add_argument("--jpeg-quality", type=int, default=90)
+    parser.add_argument("--output", default="resolution_policy.json")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    heights = sorted(set(args.heights + [REFERENCE_HEIGHT]), reverse=True)
+    start_time = timeit.default_timer()
+    pool = multiprocessing.Pool(number_cores)
+
+    by_game = list_crops(args.crops, args.samples, args.seed)
+    crops = {}
+    for r in pool.imap(partial(calibrate_crop, heights, args.jpeg_quality), [f for files in by_game.values() for f in files]):
+        if r:
+            crops.setdefault(r[0], []).append(r[1])
+
+    frames = {}
+    if args.frames:
+        names = sorted([os.path.join(args.frames, f) for f in os.listdir(args.frames)])
+        sizes = [r for r in pool.imap(partial(frame_bytes, heights, args.jpeg_quality), names) if r]
+        frames = {height: sum([s[height] for s in sizes]) / len(sizes) for height in heights} if sizes else {}
+
+    policy = {}
+    for game_id, game_crops in sorted(crops.items()):
+        summary = summarize(game_crops, heights)
+        for entry in summary:
+            entry["frame_bytes"] = frames.get(entry["height"])
+
+        width, height = choose_size(summary, args.min_accuracy, args.min_samples)
+        policy[game_id] = {"width": width, "height": height, "sizes": summary}
+
+        print("Game {}: {}x{}".format(game_id, width, height))
+        for entry in summary:
+            print("    {:>4}p  accuracy {:>6.1%} ({} areas)  area {:>7.0f} bytes  thumbnail {}".format(
+                entry["height"], entry["accuracy"], entry["samples"], entry["crop_bytes"],
+                "{:.0f} bytes".format(entry["frame_bytes"]) if entry["frame_bytes"] else "-"))
+
+    with open(args.output, "w") as f:
+        json.dump(policy, f, indent=2)
+
+    print("Policy of {} games written to {} ({:.2f} sec)".format(len(policy), args.output, timeit.default_timer() - start_time))
@@ -9,10 +9,25 @@ def get_extra_areas(game_id):
     return extra_areas.get(game_id, {})
 
 
+def scale_area(area, scale):
+    return {k: int(round(v * scale)) for k, v in area.items()}
+
+
+def areas_for_height(game_areas, height):
+    # Thumbnails fetched at another size than the ones listed (download module's resolution_policy): 1080p areas scaled
+    if str(height) in game_areas:
+        return game_areas[str(height)]
+
+    return [scale_area(area, height / 1080) for area in game_areas.get("1080", [])]
+
+
 def parse_image_name(image):
-    m = re.search(r"(?P<game_id>\d+)_(?P<date>\d\d\d\d-\d\d-\d\d-\d\d-\d\d-\d\d)_(?P<stream_id>\w+)_(?P<user_id>\w+)", image)
+    # Areas cropped by the downloaders (crop_at_download) end in _area{idx} or _extra
+    crop = re.search(r"_(?P<crop>area\d+|extra)\.png$", image)
+    m = re.search(r"(?P<game_id>\d+)_(?P<date>\d\d\d\d-\d\d-\d\d-\d\d-\d\d-\d\d)_(?P<stream_id>\w+)_(?P<user_id>\w+)", image[:crop.start()] if crop else image)
     if m:
-        return {"game_id": m.group("game_id"), "date": m.group("date"), "stream_id": m.group("stream_id"), "user_id": m.group("user_id")}
+        return {"game_id": m.group("game_id"), "date": m.group("date"), "stream_id": m.group("stream_id"), "user_id": m.group("user_id"),
+                "crop": crop.group("crop") if crop else None}
 
 
 def get_bw_image(img):
@@ -31,12 +46,23 @@ def run_preprocessing(aoi, read_function, write_function, image):
     if img is None:
         return None
 
+    if image_info["crop"]:
+        # Already cropped: same names as the areas cut below
+        crop_name = image.split("/")[-1].split(".")[0]
+        write_function(img, '{}.png'.format(crop_name), "tiny")
+
+        if image_info["crop"] != "extra":
+            erosion = get_bw_image(img)
+            if erosion is not None:
+                write_function(erosion, "{}_bw.png".format(crop_name), "bw")
+
+        return image
+
     size = img.shape 
     areas = aoi.get(image_info["game_id"], {})
+    candidate_areas = areas_for_height(areas, size[0])
 
-    if str(size[0]) in areas:
-        candidate_areas = areas[str(size[0])]
-        
+    if candidate_areas:
         for area_idx in range(0, len(candidate_areas)):
             area = candidate_areas[area_idx]
 
@@ -45,7 +71,7 @@ def run_preprocessing(aoi, read_function, write_function, image):
             ping_area_name = '{}_area{}.png'.format(image.split("/")[-1].split(".")[0], area_idx)
             write_function(ping_area, ping_area_name, "tiny")
 
-            extra_area = get_extra_areas(image_info["game_id"])
+            extra_area = scale_area(get_extra_areas(image_info["game_id"]), size[0] / 1080)
             if extra_area:
                 extra_area_img = img[extra_area["y1"]:extra_area["y2"], extra_area["x1"]:extra_area["x2"]]
                 extra_area_name = '{}_extra.png'.format(image.split("/")[-1].split(".")[0])
@@ -18,4 +18,15 @@ long_term_storage = ""
 storage_path = ""
 increase_batch_threshold = 5
 
-extra_areas = {}
\ No newline at end of file
+# Packs of thumbnails (download module's pack_storage): read from pack_local_path if set, otherwise from raw_packs_path in the
+# bucket, fetched in parts of pack_part_size, pack_download_concurrency parts at once
+pack_storage = False
+raw_packs_path = ""
+pack_local_path = ""
+pack_part_size = 16 * 1024 * 1024
+pack_download_concurrency = 8
+
+extra_areas = {}
+
+# Tesseract PSM of each game (as in process-images), used by calibrate_resolution
+tesseract_config = {}
\ No newline at end of file
@@ -8,8 +8,9 @@ from functools import partial
 
 from common import run_preprocessing
 
-from config import number_cores, base_path
+from config import number_cores, base_path, pack_storage
 from storage.s3_controller import S3StorageController
+from storage.pack_controller import PackStorageController
 from logger import get_logger
 
 
@@ -18,7 +19,7 @@ if __name__ == '__main__':
     if len(sys.argv) > 1:
         idx = sys.argv[1]
 
-    storage = S3StorageController(idx)
+    storage = PackStorageController(idx) if pack_storage else S3StorageController(idx)
     logger = get_logger("pre_process_images")
 
     def read_function(x, metadata):
@@ -0,0 +1,104 @@
+import os
+import cv2
+import numpy as np
+
+from boto3.s3.transfer import TransferConfig
+from storage.s3_controller import S3StorageController
+from storage.pack_reader import PackReader
+from config import base_path, batch_size, bucket_name, raw_packs_path, pack_local_path, pack_part_size, pack_download_concurrency
+
+
+class PackStorageController(S3StorageController):
+    """
+    Takes packs from raw_packs instead of single thumbnails from raw_images. Thumbnails are named {pack id}/{name}; every
+    pack of the batch is fetched once (multipart download) before processing and deleted once all its thumbnails are processed.
+    """
+    def __init__(self, idx):
+        super().__init__(idx)
+
+        self.reader = PackReader(self.client, bucket_name, raw_packs_path, pack_local_path)
+        self.transfer_config = TransferConfig(multipart_threshold=pack_part_size, multipart_chunksize=pack_part_size,
+                                              max_concurrency=pack_download_concurrency)
+        self.download_path = "{}/packs-{}".format(base_path, idx)
+
+        if not os.path.isdir(self.download_path):
+            os.makedirs(self.download_path)
+
+
+    def get_images(self):
+        images = []
+
+        while len(images) < batch_size:
+            pack_id = self.redis_cache.spop("raw_packs")
+
+            if pack_id is None:
+                break
+
+            pack_id = pack_id.decode("utf-8")
+
+            try:
+                self.reader.download(pack_id, self.download_path, self.transfer_config)
+                images.extend(["{}/{}".format(pack_id, name) for name in self.reader.names(pack_id)])
+            except Exception:
+                self.reader.discard(pack_id)
+                self.redis_cache.sadd("raw_packs", pack_id)
+                break
+
+        return images
+
+
+    def read_image(self, image, metadata):
+        try:
+            pack_id, name = image.split("/", 1)
+            body = self.reader.read(pack_id, name)
+
+            return cv2.imdecode(np.asarray(bytearray(body)), cv2.IMREAD_COLOR)
+        except Exception:
+            return None
+
+
+    def clean_up_images(self, images, logger):
+        # Packs with thumbnails that failed are kept, as single thumbnails are
+        processed = {}
+        for image in images:
+            processed.setdefault(image.split("/", 1)[0], []).append(image)
+
+        logger.info("Deleting packs.")
+
+        deleted_images = []
+
+        for pack_id in list(self.reader.indexes.keys()):
+            complete = len(processed.get(pack_id, [])) == len(self.reader.index(pack_id))
+
+            try:
+                if complete:
+                    self.reader.delete(pack_id)
+                else:
+                    self.reader.discard(pack_id)
+
+                deleted_images.extend(processed.get(pack_id, []))
+            except Exception:
+                self.reader.discard(pack_id)
+
+        logger.info("Deleted {}/{} images in packs.".format(len(deleted_images), len(images)))
+
+        return deleted_images
+
+
+    def on_failure_zip(self, images, logger):
+        packs = set([image.split("/", 1)[0] for image in images])
+        logger.info("Returning {} packs to redis.".format(len(packs)))
+
+        for pack_id in packs:
+            self.reader.discard(pack_id)
+
+        if packs:
+            self.redis_cache.sadd("raw_packs", *packs)
+
+
+    def on_failure_delete(self, not_deleted, logger):
+        packs = set([image.split("/", 1)[0] for image in not_deleted])
+
+        if packs:
+            logger.info("Returning {} packs to redis.".format(len(packs)))
+            self.redis_cache.sadd("raw_packs", *packs)
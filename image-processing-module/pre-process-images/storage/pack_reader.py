@@ -0,0 +1,80 @@
+import json
+import os
+
+
+class PackReader:
+    """
+    Random access to the thumbnails of the packs written by the download module (pack_storage): the side index of a pack
+    ({pack}.idx, one JSON line per thumbnail) gives the offset and length of each thumbnail in {pack}.pack. Packs are read
+    from local_path when set, otherwise from prefix in the bucket with ranged GETs, or locally once fetched with download.
+    """
+    def __init__(self, client=None, bucket="", prefix="", local_path=""):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.local_path = local_path
+        self.indexes = {}
+        self.local_packs = {}
+
+    def key(self, pack_id, extension):
+        return "{}/{}.{}".format(self.prefix, pack_id, extension)
+
+    def local_file(self, pack_id):
+        if self.local_path:
+            return "{}/{}.pack".format(self.local_path, pack_id)
+
+        return self.local_packs.get(pack_id)
+
+    def index(self, pack_id):
+        if pack_id not in self.indexes:
+            if self.local_path:
+                with open("{}/{}.idx".format(self.local_path, pack_id), "r") as f:
+                    lines = f.read().splitlines()
+            else:
+                lines = self.client.get_object(Bucket=self.bucket, Key=self.key(pack_id, "idx"))["Body"].read().decode("utf-8").splitlines()
+
+            entries = [json.loads(line) for line in lines if line]
+            self.indexes[pack_id] = {entry["name"]: (entry["offset"], entry["length"]) for entry in entries}
+
+        return self.indexes[pack_id]
+
+    def names(self, pack_id):
+        return list(self.index(pack_id).keys())
+
+    def read(self, pack_id, name):
+        offset, length = self.index(pack_id)[name]
+        local_file = self.local_file(pack_id)
+
+        if local_file:
+            with open(local_file, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+
+        return self.client.get_object(Bucket=self.bucket, Key=self.key(pack_id, "pack"), Range="bytes={}-{}".format(offset, offset + length - 1))["Body"].read()
+
+    def download(self, pack_id, path, transfer_config=None):
+        # Whole pack in one transfer (parallel ranged parts with transfer_config), read from disk afterwards
+        if self.local_path:
+            return
+
+        local_file = "{}/{}.pack".format(path, pack_id)
+        self.client.download_file(self.bucket, self.key(pack_id, "pack"), local_file, Config=transfer_config)
+        self.local_packs[pack_id] = local_file
+
+    def discard(self, pack_id):
+        # Local copy and index of the pack only
+        self.indexes.pop(pack_id, None)
+        local_file = self.local_packs.pop(pack_id, None)
+
+        if local_file and os.path.isfile(local_file):
+            os.remove(local_file)
+
+    def delete(self, pack_id):
+        self.discard(pack_id)
+
+        if self.local_path:
+            for extension in ["pack", "idx"]:
+                if os.path.isfile("{}/{}.{}".format(self.local_path, pack_id, extension)):
+                    os.remove("{}/{}.{}".format(self.local_path, pack_id, extension))
+        else:
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": [{"Key": self.key(pack_id, extension)} for extension in ["pack", "idx"]]})
@@ -24,4 +24,14 @@ tiny_to_process_path = ""
 tiny_img_storage = ""
 
 long_term_storage = ""
-stream_ends_storage = ""
\ No newline at end of file
+stream_ends_storage = ""
+
+# Last latency_window readings of every stream kept in Redis (latency_window:{stream_id}) for the adaptive sampling of the
+# downloaders, dropped latency_window_expire seconds after the last one
+latency_window = 12
+latency_window_expire = 6 * 60 * 60
+
+# Yield of every stream / user (thumbnails processed and with a latency value) kept in Redis (stream_yield:{stream_id} /
+# user_yield:{user_id}) for the yield backoff of the coordinator and downloaders, dropped after these many seconds without update
+stream_yield_expire = 6 * 60 * 60
+user_yield_expire = 30 * 24 * 60 * 60
\ No newline at end of file
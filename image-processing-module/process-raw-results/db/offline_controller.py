@@ -80,4 +80,8 @@ class OfflineController:
 
 
     def store_to_confirm(self, batch_name):
+        pass
+
+
+    def store_yields(self, yields):
         pass
\ No newline at end of file
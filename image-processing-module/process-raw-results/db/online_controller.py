@@ -4,7 +4,8 @@ import shutil
 import boto3
 
 from pymongo import MongoClient
-from config import redis_host, redis_port, redis_password, bucket_name, mongo_host, mongo_port, mongo_user, mongo_password, long_term_storage, stream_ends_storage, rw_access_key, rw_secret_key, s3_url
+from config import redis_host, redis_port, redis_password, bucket_name, mongo_host, mongo_port, mongo_user, mongo_password, long_term_storage, stream_ends_storage, rw_access_key, rw_secret_key, s3_url, \
+    latency_window, latency_window_expire, stream_yield_expire, user_yield_expire
 
 
 class OnlineController:
@@ -50,6 +51,7 @@ class OnlineController:
         if self.mongo_client.data.latency.count_documents({"game_id": value["game_id"], "user_id": value["user_id"], "stream_id": value["stream_id"], "date": value["date"]}, limit=1) == 0:
             self.cache.sadd("new_latency", json.dumps(value))
             self.cache.sadd("logs_latency", json.dumps(value))
+            self.update_latency_window(value)
 
             self.mongo_client.data.latency.insert_one(value)
             return True
@@ -57,6 +59,17 @@ class OnlineController:
         return False
 
 
+    def update_latency_window(self, value):
+        # Last latency_window readings of the stream, by date: read by the downloaders' adaptive sampling
+        key = "latency_window:{}".format(value["stream_id"])
+
+        pipeline = self.cache.pipeline()
+        pipeline.zadd(key, {"{}:{}".format(value["date"], value["latency"]): value["date"]})
+        pipeline.zremrangebyrank(key, 0, -(latency_window + 1))
+        pipeline.expire(key, latency_window_expire)
+        pipeline.execute()
+
+
     def get_to_process(self):
         return [json.loads(x.decode("utf-8")) for x in self.cache.spop("to_postprocess", count=1)]
 
@@ -105,4 +118,24 @@ class OnlineController:
     
 
     def store_to_confirm(self, batch_name):
-        self.cache.sadd("to_confirm", batch_name)
\ No newline at end of file
+        self.cache.sadd("to_confirm", batch_name)
+
+
+    def store_yields(self, yields):
+        # Thumbnails processed, thumbnails with a latency value and thumbnails without one since the last value, per stream
+        # and per user: read by the downloaders and the coordinator to back off from streams without readable overlays
+        pipeline = self.cache.pipeline()
+
+        for (user_id, stream_id), (images, readings) in yields.items():
+            for key, expire in [("stream_yield:{}".format(stream_id), stream_yield_expire), ("user_yield:{}".format(user_id), user_yield_expire)]:
+                pipeline.hincrby(key, "images", images)
+                pipeline.hincrby(key, "readings", readings)
+
+                if readings:
+                    pipeline.hset(key, "zero_streak", 0)
+                else:
+                    pipeline.hincrby(key, "zero_streak", images)
+
+                pipeline.expire(key, expire)
+
+        pipeline.execute()
\ No newline at end of file
@@ -82,6 +82,7 @@ class RawLatencyProcessor:
             alternative_values = {}
 
             to_confirm = []
+            yields = {}
             stream_ends = {}
 
             self.logger.info("Finished parsing, starting comparison process")
@@ -100,6 +101,9 @@ class RawLatencyProcessor:
                         except Exception:
                             pass
 
+                        # Thumbnails of the stream in this batch / those that gave a latency value
+                        yields.setdefault((user_id, stream_id), [0, 0])[0] += len(dates)
+
                         if stream_id not in stream_ends:
                             stream_ends[stream_id] = datetime(year=2021, month=1, day=1).timestamp()
                         
@@ -134,6 +138,7 @@ class RawLatencyProcessor:
                                 if "latency" not in to_save and has_mark:
                                     to_save["latency"] = str(value)
                                     to_save["values"] = values
+                                    yields[(user_id, stream_id)][1] += 1
                                                                                                         
                                     if self.controller.store_information(to_save):
                                         info_to_store[game_id].append(to_save)
@@ -198,6 +203,7 @@ class RawLatencyProcessor:
             self.controller.clean_up(metadata_line)
 
             self.controller.store_stream_ends(stream_ends, batch_name)
+            self.controller.store_yields(yields)
 
     
 if __name__ == "__main__":
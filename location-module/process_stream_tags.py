@@ -1,5 +1,3 @@
-import os
-import json
 import pycountry
 import redis
 
@@ -8,6 +6,7 @@ from datetime import datetime
 from collections import Counter
 from config import redis_host, redis_port, redis_password, mongo_host, mongo_port, mongo_password, mongo_user
 from logger import get_logger
+from snapshot_format import SnapshotReader
 
 
 base_path = ""
@@ -17,6 +16,7 @@ class ProcessStreamTags:
     def __init__(self) -> None:
         self.mongo_client = MongoClient("mongodb://{}:{}/".format(mongo_host, mongo_port), username=mongo_user, password=mongo_password)  
         self.logger = get_logger("process_tags")
+        self.reader = SnapshotReader(base_path)
 
 
     def format_country(self, country_data):
@@ -27,39 +27,35 @@ class ProcessStreamTags:
         self.logger.info("Processing file.")
         streams_with_tags = {}
 
-        with open(os.path.join(base_path, file_name), "r") as f:
-            for l in f:
-                data = json.loads(l.strip())
-        
-                for stream in data["data"]:
-                    tags = stream.get("tags", [])
-                    
-                    if not tags:
-                        continue
-                    
-                    user_country_tags = []
-
-                    for tag in tags:
-                        try:
-                            country_data = pycountry.countries.lookup(tag)
-                            user_country_tags.append(self.format_country(country_data))
-                        except LookupError:
-                            continue
-
-                    if user_country_tags:
-                        stream.pop("thumbnail_url")
-                        stream.pop("tag_ids")
-                        stream.pop("started_at")
-                        stream.pop("viewer_count")
-                        stream.pop("type")
-                        stream.pop("game_id")
-                        stream.pop("game_name")
-                        stream.pop("is_mature")
-
-                        if stream["user_id"] not in streams_with_tags:
-                            streams_with_tags[stream["user_id"]] = []
-
-                        streams_with_tags[stream["user_id"]].append({"tags": stream["tags"], "countries": user_country_tags})
+        for stream in self.reader.rows(file_name):
+            tags = stream.get("tags", [])
+            
+            if not tags:
+                continue
+            
+            user_country_tags = []
+
+            for tag in tags:
+                try:
+                    country_data = pycountry.countries.lookup(tag)
+                    user_country_tags.append(self.format_country(country_data))
+                except LookupError:
+                    continue
+
+            if user_country_tags:
+                stream.pop("thumbnail_url")
+                stream.pop("tag_ids")
+                stream.pop("started_at")
+                stream.pop("viewer_count")
+                stream.pop("type")
+                stream.pop("game_id")
+                stream.pop("game_name")
+                stream.pop("is_mature")
+
+                if stream["user_id"] not in streams_with_tags:
+                    streams_with_tags[stream["user_id"]] = []
+
+                streams_with_tags[stream["user_id"]].append({"tags": stream["tags"], "countries": user_country_tags})
 
         return streams_with_tags
 
@@ -120,7 +116,8 @@ if __name__ =="__main__":
     tag_processor = ProcessStreamTags()
 
     cache = redis.Redis(host=redis_host, port=redis_port, db=0, password=redis_password)
-    files_to_process = [x.decode("utf8") for x in cache.spop("stream_files", count=cache.scard("stream_files"))]
+    # Chronological order (file names are dates): delta snapshots are read right after their base
+    files_to_process = sorted([x.decode("utf8") for x in cache.spop("stream_files", count=cache.scard("stream_files"))])
         
     for ftp in tqdm(files_to_process):
         tag_processor.run(ftp)
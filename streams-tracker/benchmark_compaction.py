@@ -0,0 +1,85 @@
+import argparse
+import random
+import tempfile
+import timeit
+
+from compress_stream_data import compact_streams, get_mongo_client, write_fine_grained
+from game_summary import compress_entries
+
+
+def seed(db, number_streams, samples_per_stream, rng):
+    db.data.drop()
+    db.summaries.drop()
+
+    streams = []
+    entries = []
+
+    for idx in range(number_streams):
+        stream = {"user_id": "user{}".format(idx), "stream_id": "stream{}".format(idx)}
+        game = str(rng.randint(0, 10))
+        streams.append(stream)
+
+        for sample in range(samples_per_stream):
+            if rng.random() < 0.01:
+                game = str(rng.randint(0, 10))
+
+            entries.append({"stream_id": stream["stream_id"], "ts": 1620000000 + 60 * sample, "viewers": rng.randint(0, 100), "game": game, "title": ""})
+
+            if len(entries) >= 100000:
+                db.data.insert_many(entries)
+                entries = []
+
+    if entries:
+        db.data.insert_many(entries)
+
+    return streams
+
+
+def compact_streams_per_stream(db, streams, storage_dir):
+    # Previous approach: one sorted find, one insert and one delete per stream
+    for stream in streams:
+        entries = [x for x in db.data.find({"stream_id": stream["stream_id"]}, projection={"_id": False}).sort("ts")]
+
+        if not entries:
+            continue
+
+        summarized_stream = compress_entries(entries)
+        write_fine_grained(storage_dir, stream["stream_id"], entries)
+
+        db.summaries.insert_one({"user_id": stream["user_id"], "stream_id": stream["stream_id"], "changes": len(summarized_stream)-1, "games": summarized_stream})
+        db.data.delete_many({"stream_id": stream["stream_id"]})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark compress_stream_data against a local mongod")
+    parser.add_argument("--streams", type=int, default=5000)
+    parser.add_argument("--samples", type=int, default=120)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--partition-size", type=int, default=500)
+    parser.add_argument("--db", default="streams_benchmark")
+    parser.add_argument("--per-stream", action="store_true", help="Also run the previous per-stream compaction")
+    args = parser.parse_args()
+
+    mongo_client = get_mongo_client()
+    db = mongo_client[args.db]
+
+    with tempfile.TemporaryDirectory() as storage_dir:
+        streams = seed(db, args.streams, args.samples, random.Random(0))
+
+        start_time = timeit.default_timer()
+        compact_streams(streams, db_name=args.db, storage_dir=storage_dir, processes=args.processes, partition_size=args.partition_size,
+                        index_path=None)
+        elapsed = timeit.default_timer() - start_time
+
+        print("Batch compaction: {} streams in {:.2f} sec ({:.1f} streams/sec)".format(len(streams), elapsed, len(streams) / elapsed))
+
+        if args.per_stream:
+            streams = seed(db, args.streams, args.samples, random.Random(0))
+
+            start_time = timeit.default_timer()
+            compact_streams_per_stream(db, streams, storage_dir)
+            elapsed = timeit.default_timer() - start_time
+
+            print("Per-stream compaction: {} streams in {:.2f} sec ({:.1f} streams/sec)".format(len(streams), elapsed, len(streams) / elapsed))
+
+    mongo_client.drop_database(args.db)
@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import timeit
+
+from fake_helix import FakeHelix, start_fake_helix
+from stream_gatherer import gather_streams, gather_streams_partitioned
+
+
+class CountingStorage:
+    def __init__(self):
+        self.pages = 0
+        self.streams = 0
+        self.finished = False
+
+    def save_streams(self, data):
+        self.pages += 1
+        self.streams += len(data["data"])
+
+    def save_users(self, data):
+        pass
+
+    def finish(self):
+        self.finished = True
+
+
+async def run_benchmark(args):
+    helix = FakeHelix(args.streams, args.rate_limit, latency=args.latency)
+    runner = await start_fake_helix(helix, args.port)
+
+    storage = CountingStorage()
+    start_time = timeit.default_timer()
+
+    try:
+        api_url = "http://127.0.0.1:{}/helix".format(args.port)
+
+        if args.partitioned:
+            credentials = [("fake-client-{}".format(idx), "fake-token") for idx in range(args.credentials)]
+            await gather_streams_partitioned(credentials, storage, api_url=api_url)
+        else:
+            await gather_streams("fake-token", storage, api_url=api_url)
+    finally:
+        await runner.cleanup()
+
+    elapsed = timeit.default_timer() - start_time
+
+    print("Snapshot of {} streams ({} pages) in {:.2f} sec".format(storage.streams, storage.pages, elapsed))
+    print("Requests: {} ({:.1f} req/s), throttled: {}, finished: {}".format(helix.requests, helix.requests / elapsed, helix.throttled, storage.finished))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark stream_gatherer against a local fake Helix API")
+    parser.add_argument("--streams", type=int, default=100000)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rate-limit", type=int, default=800)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--partitioned", action="store_true")
+    parser.add_argument("--credentials", type=int, default=1)
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark(args))
@@ -0,0 +1,118 @@
+import argparse
+import random
+import tempfile
+import timeit
+import numpy as np
+
+from compress_stream_data import get_mongo_client
+from interval_index import IntervalIndex, append_summaries
+
+
+def make_summaries(number_users, streams_per_user, rng):
+    summaries = []
+
+    for user in range(number_users):
+        ts = 1620000000 + rng.randint(0, 86400)
+
+        for stream in range(streams_per_user):
+            games = []
+
+            for _ in range(rng.choice([1, 1, 1, 2, 3])):
+                length = rng.randint(600, 4 * 3600)
+                games.append({"game": str(rng.randint(0, 20)), "start": ts, "end": ts + length})
+                ts += length + 60
+
+            summaries.append({"user_id": "user{}".format(user), "stream_id": "stream{}-{}".format(user, stream), "changes": len(games) - 1, "games": games})
+            ts += rng.randint(3600, 3 * 86400)
+
+    return summaries
+
+
+def make_queries(summaries, number_queries, batch_size, rng):
+    # Batches of timestamps of one user, spread over the user's whole history (hits and misses)
+    spans = {}
+    for s in summaries:
+        start, end = spans.get(s["user_id"], (s["games"][0]["start"], s["games"][-1]["end"]))
+        spans[s["user_id"]] = (min(start, s["games"][0]["start"]), max(end, s["games"][-1]["end"]))
+
+    users = list(spans.keys())
+    queries = []
+
+    for _ in range(max(1, number_queries // batch_size)):
+        user = rng.choice(users)
+        start, end = spans[user]
+        queries.append((user, np.array([rng.uniform(start, end) for _ in range(batch_size)])))
+
+    return queries
+
+
+def mongo_lookup(db, user, ts):
+    summary = db.summaries.find_one({"user_id": user, "games": {"$elemMatch": {"start": {"$lte": ts}, "end": {"$gte": ts}}}}, projection={"_id": False})
+
+    if summary is None:
+        return None, None
+
+    game = [g["game"] for g in summary["games"] if g["start"] <= ts <= g["end"]][0]
+
+    return summary["stream_id"], game
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark point-in-time stream/game lookups: interval index vs Mongo range queries")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--streams-per-user", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=5000000)
+    parser.add_argument("--batch-size", type=int, default=1000, help="Timestamps per lookup call")
+    parser.add_argument("--mongo", action="store_true", help="Also time Mongo range queries (needs a local mongod)")
+    parser.add_argument("--mongo-queries", type=int, default=5000)
+    parser.add_argument("--db", default="interval_index_benchmark")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    summaries = make_summaries(args.users, args.streams_per_user, rng)
+    queries = make_queries(summaries, args.queries, args.batch_size, rng)
+
+    with tempfile.TemporaryDirectory() as path:
+        # Incremental path: summaries appended to the journal in batches, as compress_stream_data does, then compacted
+        start_time = timeit.default_timer()
+        for idx in range(0, len(summaries), 10000):
+            append_summaries(path, summaries[idx:idx + 10000])
+
+        IntervalIndex.compact(path)
+        elapsed = timeit.default_timer() - start_time
+        print("Journal + compaction: {} summaries in {:.2f} sec".format(len(summaries), elapsed))
+
+        start_time = timeit.default_timer()
+        index = IntervalIndex.load(path)
+        print("Load: {} segments of {} users in {:.2f} sec".format(len(index), len(index.user_names), timeit.default_timer() - start_time))
+
+    start_time = timeit.default_timer()
+    hits = 0
+    results = []
+
+    for user, timestamps in queries:
+        streams, games = index.lookup(user, timestamps)
+        hits += int(np.count_nonzero(streams != None))
+        results.append((streams, games))
+
+    elapsed = timeit.default_timer() - start_time
+    total = sum([len(t) for _, t in queries])
+    print("Interval index: {} point queries in {:.2f} sec ({:.0f} queries/sec), hits: {}".format(total, elapsed, total / elapsed, hits))
+
+    if args.mongo:
+        mongo_client = get_mongo_client()
+        db = mongo_client[args.db]
+        db.summaries.drop()
+        db.summaries.insert_many([dict(s) for s in summaries])
+        db.summaries.create_index("user_id")
+
+        sample = [(user, timestamps[idx], streams[idx], games[idx]) for (user, timestamps), (streams, games) in zip(queries, results)
+                  for idx in range(min(len(timestamps), 10))][:args.mongo_queries]
+
+        start_time = timeit.default_timer()
+        mismatches = sum([mongo_lookup(db, user, float(ts)) != (stream, game) for user, ts, stream, game in sample])
+        elapsed = timeit.default_timer() - start_time
+
+        print("Mongo: {} point queries in {:.2f} sec ({:.0f} queries/sec), mismatches with the index: {}".format(len(sample), elapsed, len(sample) / elapsed,
+                                                                                                              mismatches))
+        mongo_client.drop_database(args.db)
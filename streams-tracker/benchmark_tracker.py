@@ -0,0 +1,206 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import random
+import tempfile
+import timeit
+import aiohttp
+import redis
+
+from compress_stream_data import compact_streams, get_mongo_client
+from config import redis_host, redis_port, redis_password, secret_key, ingest_time_summaries, viewers_bucket_base, stream_end_timeout, \
+    rate_limit_reserve, connection_pool_size, request_timeout
+from fake_helix import FakeHelix, start_fake_helix
+from logger import get_logger
+from rate_limiter import TokenBucket
+from storage.local_controller import LocalController
+from storage.mongo_controller import MongoController
+from stream_gatherer import gather_streams
+from stream_state import StreamStateTracker
+from track_current import get_current_streams
+from twitch_api_calls import get_header
+
+
+MONGO_OPERATIONS = ["insert", "query", "update", "delete", "getmore"]
+
+
+def encode(value):
+    return hmac.new(secret_key.encode("utf-8"), value.encode("utf-8"), hashlib.sha1).hexdigest()
+
+
+class OperationCounters:
+    """
+    Server-side operation counters (Redis INFO commandstats, Mongo serverStatus opcounters): they also count the
+    operations of other processes (e.g. the compaction workers), so the benchmark needs Redis/Mongo instances of its own.
+    """
+    def __init__(self, cache, mongo_client):
+        self.cache = cache
+        self.mongo_client = mongo_client
+
+    def snapshot(self):
+        redis_ops = sum([v["calls"] for k, v in self.cache.info("commandstats").items() if k != "cmdstat_info"])
+        opcounters = self.mongo_client.admin.command("serverStatus")["opcounters"]
+
+        return redis_ops, {op: opcounters[op] for op in MONGO_OPERATIONS}
+
+
+async def measure(stage, helix, counters, work):
+    requests, throttled = helix.requests, helix.throttled
+    redis_before, mongo_before = counters.snapshot()
+    start_time = timeit.default_timer()
+
+    items = await work()
+
+    elapsed = timeit.default_timer() - start_time
+    redis_after, mongo_after = counters.snapshot()
+
+    return {
+        "stage": stage,
+        "items": items,
+        "seconds": elapsed,
+        "api_calls": helix.requests - requests,
+        "throttled": helix.throttled - throttled,
+        "redis_ops": redis_after - redis_before,
+        "mongo_ops": {op: mongo_after[op] - mongo_before[op] for op in MONGO_OPERATIONS}
+    }
+
+
+def update_probes(cache, helix, probes, target, rng):
+    # Same as the download module: streams that went offline stop being tracked and new live streams replace them
+    for stream_id, stream in list(probes.items()):
+        live = helix.streams_by_user.get(stream["twitch_id"])
+
+        if live is None or encode(live["id"]) != stream_id:
+            del probes[stream_id]
+            cache.hdel("current_probes", stream_id)
+
+    tracked = set([s["twitch_id"] for s in probes.values()])
+    candidates = [s for s in helix.streams if s["user_id"] not in tracked]
+
+    for live in rng.sample(candidates, min(target - len(probes), len(candidates))):
+        stream = {"id": encode(live["id"]), "user_id": encode(live["user_id"]), "game_id": live["game_id"], "thumbnail_url": live["thumbnail_url"],
+                  "twitch_id": live["user_id"]}
+
+        probes[stream["id"]] = stream
+        cache.hset("current_probes", stream["id"], json.dumps(stream))
+
+
+async def run_scale(args, scale, cache, counters, logger):
+    helix = FakeHelix(args.channels * scale, args.rate_limit, latency=args.latency, seed=scale, online_fraction=args.online_fraction,
+                      error_rate=args.error_rate)
+    runner = await start_fake_helix(helix, args.port)
+    api_url = "http://127.0.0.1:{}/helix".format(args.port)
+
+    cache.flushdb()
+    counters.mongo_client.drop_database(args.db)
+
+    rng = random.Random(scale)
+    results = []
+
+    try:
+        with tempfile.TemporaryDirectory() as storage_dir:
+            # stream_gatherer: one full snapshot of the live streams
+            async def gather():
+                storage = LocalController(storage_dir, {"host": redis_host, "port": redis_port, "password": redis_password, "db": args.redis_db})
+                await gather_streams("fake-token", storage, api_url=api_url)
+
+                return len(helix.streams)
+
+            results.append(await measure("stream_gatherer", helix, counters, gather))
+
+            # track_current: back to back cycles (no tracking_interval) while the population changes
+            storage = MongoController(args.db)
+            tracker = StreamStateTracker(cache, storage_dir, viewers_bucket_base, stream_end_timeout) if args.ingest_time_summaries else None
+            probes = {}
+
+            async def track():
+                polled = 0
+                bucket = TokenBucket(reserve=rate_limit_reserve)
+                connector = aiohttp.TCPConnector(limit=connection_pool_size)
+                timeout = aiohttp.ClientTimeout(total=request_timeout)
+
+                async with aiohttp.ClientSession(headers=get_header("fake-token", "fake-client"), connector=connector, timeout=timeout) as session:
+                    for _ in range(args.cycles):
+                        update_probes(cache, helix, probes, args.tracked * scale, rng)
+                        await get_current_streams(session, bucket, cache, storage, logger, api_url, tracker, index_path=None)
+                        polled += len(probes)
+
+                        if tracker:
+                            tracker.checkpoint()
+
+                        helix.advance(args.end_probability, args.change_probability)
+
+                    # Every stream ends: the last cycle finishes them all
+                    probes.clear()
+                    cache.delete("current_probes")
+                    await get_current_streams(session, bucket, cache, storage, logger, api_url, tracker, index_path=None)
+
+                return polled
+
+            results.append(await measure("track_current", helix, counters, track))
+
+            # compress_stream_data: only has work to do without ingest-time summaries
+            async def compress():
+                finished = [json.loads(x.decode("utf8")) for x in cache.spop("finished_streams", count=cache.scard("finished_streams"))]
+
+                if finished:
+                    compact_streams(finished, db_name=args.db, storage_dir=storage_dir, processes=args.processes, index_path=None)
+
+                return len(finished)
+
+            results.append(await measure("compress_stream_data", helix, counters, compress))
+    finally:
+        await runner.cleanup()
+
+    return results
+
+
+def print_results(scale, channels, results):
+    print("\n{}x ({} channels)".format(scale, channels))
+    print("{:<22}{:>10}{:>10}{:>12}{:>11}{:>11}{:>11}{:>11}  {}".format("stage", "items", "sec", "items/sec", "api calls", "throttled",
+                                                                          "redis ops", "mongo ops", "mongo ops by type"))
+
+    for r in results:
+        print("{:<22}{:>10}{:>10.2f}{:>12.1f}{:>11}{:>11}{:>11}{:>11}  {}".format(r["stage"], r["items"], r["seconds"], r["items"] / r["seconds"] if r["seconds"] else 0,
+                                                                                  r["api_calls"], r["throttled"], r["redis_ops"], sum(r["mongo_ops"].values()),
+                                                                                  " ".join(["{}={}".format(k, v) for k, v in r["mongo_ops"].items() if v])))
+
+
+async def run_benchmark(args):
+    logger = get_logger("benchmark_tracker")
+    cache = redis.Redis(host=redis_host, port=redis_port, password=redis_password, db=args.redis_db)
+    mongo_client = get_mongo_client()
+    counters = OperationCounters(cache, mongo_client)
+
+    try:
+        for scale in args.scales:
+            print_results(scale, args.channels * scale, await run_scale(args, scale, cache, counters, logger))
+    finally:
+        cache.flushdb()
+        mongo_client.drop_database(args.db)
+        mongo_client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test stream_gatherer, track_current and compress_stream_data against a local fake Helix API. "
+                                                 "Needs a dedicated Redis database and mongod: both are flushed.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--channels", type=int, default=10000, help="Channels at 1x")
+    parser.add_argument("--online-fraction", type=float, default=0.5)
+    parser.add_argument("--tracked", type=int, default=500, help="Streams tracked by the download module at 1x")
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--end-probability", type=float, default=0.02, help="Probability that a stream ends between two cycles")
+    parser.add_argument("--change-probability", type=float, default=0.01, help="Probability that a stream changes game between two cycles")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rate-limit", type=int, default=800)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--processes", type=int, default=4, help="compress_stream_data processes")
+    parser.add_argument("--redis-db", type=int, default=15)
+    parser.add_argument("--db", default="streams_benchmark")
+    parser.add_argument("--ingest-time-summaries", type=int, choices=[0, 1], default=int(ingest_time_summaries))
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark(args))
@@ -2,19 +2,84 @@ import json
 import os
 import sys
 import redis
+import timeit
+import multiprocessing
 
 from datetime import datetime
+from itertools import groupby
 from pymongo import MongoClient
 from logger import get_logger
-from config import redis_host, redis_port, redis_password, mongo_host, mongo_port, mongo_user, mongo_password, fine_grained_tmp_storage
+from game_summary import compress_entries
+from interval_index import append_summaries
+from config import redis_host, redis_port, redis_password, mongo_host, mongo_port, mongo_user, mongo_password, fine_grained_tmp_storage, \
+    compaction_processes, compaction_partition_size, interval_index_path
 
 
+def get_mongo_client():
+    return MongoClient('mongodb://{}:{}/'.format(mongo_host, mongo_port), username=mongo_user, password=mongo_password)
+
+
+def write_fine_grained(storage_dir, stream_id, entries):
+    start_day = datetime.fromtimestamp(entries[0]["ts"]).strftime("%Y-%m-%d")
+
+    if not os.path.isdir("{}/{}".format(storage_dir, start_day)):
+        os.makedirs("{}/{}".format(storage_dir, start_day))
+
+    file_name = "{}/{}/stream_data-{}.json".format(storage_dir, start_day, stream_id)
+    with open(file_name, "w+") as f:
+        for entry in entries:
+            f.write("{}\n".format(json.dumps(entry)))
+
+
+def compact_partition(args):
+    # One sorted cursor for the whole partition: entries arrive grouped by stream, ordered by time
+    streams, db_name, storage_dir = args
+
+    mongo_client = get_mongo_client()
+    users = {s["stream_id"]: s["user_id"] for s in streams}
+    summaries = []
+
+    cursor = mongo_client[db_name].data.find({"stream_id": {"$in": list(users.keys())}}, projection={"_id": False}).sort([("stream_id", 1), ("ts", 1)])
+
+    for stream_id, entries in groupby(cursor, key=lambda x: x["stream_id"]):
+        entries = list(entries)
+        summarized_stream = compress_entries(entries)
+
+        write_fine_grained(storage_dir, stream_id, entries)
+        summaries.append({"user_id": users[stream_id], "stream_id": stream_id, "changes": len(summarized_stream)-1, "games": summarized_stream})
+
+    mongo_client.close()
+
+    return summaries
+
+
+def compact_streams(streams, db_name="streams", storage_dir=fine_grained_tmp_storage, processes=compaction_processes, partition_size=compaction_partition_size,
+                    index_path=interval_index_path):
+    mongo_client = get_mongo_client()
+    mongo_client[db_name].data.create_index([("stream_id", 1), ("ts", 1)])
+
+    partitions = [(streams[i:i + partition_size], db_name, storage_dir) for i in range(0, len(streams), partition_size)]
+    summaries = []
+
+    with multiprocessing.Pool(processes) as pool:
+        for partition_summaries in pool.imap_unordered(compact_partition, partitions):
+            summaries.extend(partition_summaries)
+
+    if summaries:
+        mongo_client[db_name].summaries.insert_many(summaries, ordered=False)
+        append_summaries(index_path, summaries)
+
+    # Streams without data are dropped as well, as before
+    mongo_client[db_name].data.delete_many({"stream_id": {"$in": [s["stream_id"] for s in streams]}})
+    mongo_client.close()
+
+    return summaries
+
 
 if __name__ == "__main__":
     logger = get_logger("compress_stream_data")
     
     cache = redis.Redis(host=redis_host, port=redis_port, password=redis_password)
-    mongo_client = MongoClient('mongodb://{}:{}/'.format(mongo_host, mongo_port), username=mongo_user, password=mongo_password)
     
     logger.info("Fetching finished streams.")
     streams_to_compress = [json.loads(x.decode("utf8")) for x in cache.spop("finished_streams", count=cache.scard("finished_streams"))]
@@ -25,42 +90,9 @@ if __name__ == "__main__":
         sys.exit(0)
     
     logger.info("Processing streams to store...")
-    for stream in streams_to_compress:
-        start = [x for x in mongo_client.streams.data.find({"stream_id": stream["stream_id"]}, projection={"_id": False}).sort("ts").limit(1)]
-
-        if not start:
-            continue
-
-        start = start[0]
-        start_day = datetime.fromtimestamp(start["ts"]).strftime("%Y-%m-%d")
-
-        if not os.path.isdir("{}/{}".format(fine_grained_tmp_storage, start_day)):
-            os.makedirs("{}/{}".format(fine_grained_tmp_storage, start_day))
-
-        summarized_stream = []
-        current_game = ""       
-        last_ts = datetime(year=2021, month=5, day=1).timestamp()
-
-        file_name = "{}/{}/stream_data-{}.json".format(fine_grained_tmp_storage, start_day, stream["stream_id"])
-        with open(file_name, "w+") as f:
-            for entry in mongo_client.streams.data.find({"stream_id": stream["stream_id"]}, projection={"_id": False}).sort("ts"):
-                if not current_game:
-                    current_game = entry["game"]
-                    start = entry["ts"]
-                    continue
-                            
-                if entry["game"] != current_game:
-                    summarized_stream.append({"game": current_game, "start": start, "end": last_ts})
-                    current_game = entry["game"]
-                    start = entry["ts"]
-
-                last_ts = entry["ts"]
-                f.write("{}\n".format(json.dumps(entry)))
-
-        if last_ts != start:
-            summarized_stream.append({"game": current_game, "start": start, "end": last_ts})
-
-        mongo_client.streams.summaries.insert_one({"user_id": stream["user_id"], "stream_id": stream["stream_id"], "changes": len(summarized_stream)-1, "games": summarized_stream})
-        mongo_client.streams.data.delete_many({"stream_id": stream["stream_id"]})    
-        
-        
+    start_time = timeit.default_timer()
+
+    summaries = compact_streams(streams_to_compress)
+
+    elapsed = timeit.default_timer() - start_time
+    logger.info("Compacted {} streams in {:.2f} sec ({:.1f} streams/sec)".format(len(summaries), elapsed, len(streams_to_compress) / elapsed))
@@ -1,5 +1,3 @@
-safety_factor = 0.7
-
 twitch_api_id = ""
 twitch_client_secret = ""
 
@@ -22,4 +20,68 @@ rw_access_key = ""
 rw_secret_key = ""
 bucket_name = ""
 
-fine_grained_tmp_storage = ""
\ No newline at end of file
+fine_grained_tmp_storage = ""
+
+twitch_api_url = "https://api.twitch.tv/helix"
+
+# Helix points left untouched in the rate limit bucket, e.g. for other processes sharing the same credentials
+rate_limit_reserve = 10
+# Keep the rate limit bucket of each client id in Redis, shared with the download module's twitch_api_process (same Redis)
+shared_rate_limit = False
+max_retries = 5
+connection_pool_size = 10
+request_timeout = 10
+
+# Partitioned crawl: one cursor per game, run concurrently over several client credentials
+partitioned_crawl = False
+twitch_credentials = []
+partition_games = []
+top_games_pages = 0
+remainder_max_pages = 100
+workers_per_credential = 4
+
+# Store stream_gatherer snapshots as columnar, delta-encoded files instead of JSON lines
+columnar_snapshots = False
+snapshot_keyframe_interval = 48
+snapshot_compression_level = 3
+# Rows per chunk: written as soon as gathered, only one chunk is kept in memory
+snapshot_chunk_rows = 20000
+
+# Stream/game ids remembered by track_current to skip redundant metadata writes
+known_ids_cache_size = 200000
+tracking_interval = 60
+chunk_latency_buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Record only game/title/viewers-bucket transitions in streams.data and finalize summaries as soon as streams end
+ingest_time_summaries = False
+viewers_bucket_base = 2
+stream_end_timeout = 900
+state_checkpoint_cycles = 10
+
+# track_current publishes the streams whose game changed on game_changes_channel (and keeps the game of every tracked
+# stream in stream_games), read by the download module's downloaders with game_changes
+publish_game_changes = False
+game_changes_channel = "game_changes"
+
+# compress_stream_data: parallel processes / finished streams per sorted cursor
+compaction_processes = 4
+compaction_partition_size = 500
+
+# process_all_streams: processes parsing snapshot files in parallel
+parsing_processes = 4
+
+# stream_gatherer: users are queued in new_users at most once every seen_users_window seconds (0: every snapshot),
+# remembered in Redis sets of seen_users_bucket seconds
+seen_users_window = 0
+seen_users_bucket = 3600
+
+# Directory of the interval index of stream summaries (empty: not maintained)
+interval_index_path = ""
+
+# online_profiles: hour-of-week profiles of the users to probe from the last profile_weeks weeks of summaries, live in one of
+# profile_games (the download module's games_to_probe, empty: any game), smoothed with profile_smoothing weeks of the
+# population rate. Only scores of at least profile_min_probability are written
+profile_weeks = 8
+profile_smoothing = 2
+profile_min_probability = 0.02
+profile_games = []
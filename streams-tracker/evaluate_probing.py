@@ -0,0 +1,219 @@
+import argparse
+import math
+import random
+import timeit
+import numpy as np
+
+from pymongo import MongoClient
+from config import mongo_host, mongo_port, mongo_user, mongo_password, profile_weeks, profile_smoothing, profile_min_probability, profile_games
+from online_profiles import OnlineProfiles, HOURS_PER_WEEK, hour_of_week
+
+
+WEEK = 7 * 86400
+# Monday 2021-05-03 00:00 UTC
+SYNTHETIC_START = 1620000000 - 1620000000 % WEEK + 4 * 86400
+
+
+def synthetic_summaries(number_users, weeks, seed=0):
+    """
+    Users with weekly habits (a few weekly slots, each one kept most weeks), occasional streamers at random times, and
+    users who never stream; each user mostly streams one game, one of the tracked games ("tracked") or not ("other").
+    """
+    rng = random.Random(seed)
+    summaries = []
+
+    for user in range(number_users):
+        kind = rng.choices(["regular", "occasional", "dormant"], weights=[0.3, 0.4, 0.3])[0]
+        game = "tracked" if rng.random() < 0.6 else "other"
+        streams = []
+
+        if kind == "regular":
+            slots = [(rng.randrange(7), rng.randrange(24), rng.uniform(2, 5), rng.uniform(0.6, 0.95)) for _ in range(rng.randint(1, 4))]
+
+            for week in range(weeks):
+                for day, hour, length, probability in slots:
+                    if rng.random() < probability:
+                        start = SYNTHETIC_START + week * WEEK + day * 86400 + hour * 3600 + rng.uniform(-3600, 3600)
+                        streams.append((start, start + length * 3600 * rng.uniform(0.7, 1.3)))
+        elif kind == "occasional":
+            for _ in range(np.random.RandomState(user + seed).poisson(0.5 * weeks)):
+                start = SYNTHETIC_START + rng.uniform(0, weeks * WEEK)
+                streams.append((start, start + rng.uniform(1, 4) * 3600))
+
+        for idx, (start, end) in enumerate(sorted(streams)):
+            summaries.append({"user_id": "user{}".format(user), "stream_id": "stream{}-{}".format(user, idx), "changes": 0,
+                              "games": [{"game": game if rng.random() < 0.9 else "other", "start": start, "end": end}]})
+
+    return ["user{}".format(user) for user in range(number_users)], summaries
+
+
+def load_summaries(db_name, weeks):
+    mongo_client = MongoClient('mongodb://{}:{}/'.format(mongo_host, mongo_port), username=mongo_user, password=mongo_password)
+    last = mongo_client[db_name].summaries.find_one(sort=[("games.end", -1)])
+
+    if last is None:
+        return [], []
+
+    since = last["games"][-1]["end"] - weeks * WEEK
+    summaries = list(mongo_client[db_name].summaries.find({"games.start": {"$gte": since}}, projection={"_id": False}))
+    mongo_client.close()
+
+    return sorted(set([s["user_id"] for s in summaries])), summaries
+
+
+class Replay:
+    """
+    Replays the coordinator over the evaluation period: every cycle it selects up to users_per_cycle users not queried
+    (not blocked), queries them, and blocks users found offline for offline_expire seconds and users found live until
+    the end of their stream plus finished_expire. Selection is either the SSCAN walk over to_probe (a fixed arbitrary
+    order, round robin) or, with profiles, the users of the current hour of the week by decreasing probability first.
+    """
+    def __init__(self, users, intervals, args):
+        self.args = args
+        self.codes = {u: idx for idx, u in enumerate(users)}
+
+        # Live intervals (tracked games) sorted by user and start, searched with one key per (user, time)
+        intervals = sorted([(self.codes[u], s, e) for u, s, e in intervals])
+        self.users = np.array([i[0] for i in intervals], dtype=np.int64)
+        self.starts = np.array([i[1] for i in intervals], dtype=np.float64)
+        self.ends = np.array([i[2] for i in intervals], dtype=np.float64)
+        self.keys = self.users * args.span + (self.starts - args.base)
+
+        self.order = np.random.RandomState(args.seed).permutation(len(users))
+
+    def live(self, selected, t):
+        positions = np.searchsorted(self.keys, selected * self.args.span + (t - self.args.base), side="right") - 1
+        valid = positions >= 0
+        positions = np.maximum(positions, 0)
+
+        return valid & (self.users[positions] == selected) & (self.ends[positions] >= t), positions
+
+    @staticmethod
+    def take(candidates, blocked_until, start, count, t):
+        # First count candidates not blocked, from position start: returns them and the position after the last one
+        if count <= 0:
+            return candidates[:0], start
+
+        eligible = np.nonzero(blocked_until[candidates[start:]] <= t)[0][:count]
+
+        if len(eligible) == 0:
+            return eligible, len(candidates)
+
+        return candidates[start + eligible], start + eligible[-1] + 1
+
+    def run(self, ranked=None):
+        args = self.args
+        blocked_until = np.zeros(len(self.order))
+        detected = np.zeros(len(self.keys), dtype=bool)
+        delays = []
+        calls = hits = 0
+
+        cursor = 0
+        scores_hour, scores_rank = None, 0
+
+        for t in np.arange(args.eval_start, args.eval_end, args.cycle):
+            selected = []
+            budget = args.users_per_cycle
+
+            if ranked is not None:
+                hour = hour_of_week(t)
+                if hour != scores_hour:
+                    scores_hour, scores_rank = hour, 0
+
+                if scores_rank is not None:
+                    scored, scores_rank = self.take(ranked[hour], blocked_until, scores_rank, int(budget * (1 - args.exploration)), t)
+                    scores_rank = None if scores_rank >= len(ranked[hour]) else scores_rank
+
+                    # Not taken again by the walk below
+                    blocked_until[scored] = np.inf
+                    selected.append(scored)
+                    budget -= len(scored)
+
+            # Round robin over to_probe, wrapping around once
+            rotated = np.concatenate([self.order[cursor:], self.order[:cursor]])
+            walked, position = self.take(rotated, blocked_until, 0, budget, t)
+            cursor = (cursor + position) % len(self.order)
+            selected.append(walked)
+
+            selected = np.concatenate(selected).astype(np.int64)
+            calls += math.ceil(len(selected) / 100)
+
+            is_live, positions = self.live(selected, t)
+            hits += int(is_live.sum())
+
+            new = positions[is_live][~detected[positions[is_live]]]
+            detected[new] = True
+            delays.extend((t - self.starts[new]).tolist())
+
+            blocked_until[selected] = t + args.offline_expire
+            blocked_until[selected[is_live]] = self.ends[positions[is_live]] + args.finished_expire
+
+        return {"calls": calls, "hits": hits, "hits_per_1000": 1000 * hits / max(calls, 1), "coverage": detected.mean() if len(detected) else 0,
+                "median_delay": float(np.median(delays)) if delays else 0}
+
+
+def ranked_users(users, summaries, args):
+    # Same estimate and threshold as online_profiles, the training weeks only
+    profiles = OnlineProfiles(weeks=args.train_weeks, smoothing=args.smoothing, games=args.games or None)
+    profiles.add_summaries([s for s in summaries if s["games"][-1]["end"] < args.eval_start])
+    probabilities = profiles.probabilities()
+
+    codes = {u: idx for idx, u in enumerate(users)}
+    rows = np.array([codes[u] for u in profiles.users()], dtype=np.int64)
+
+    ranked = []
+    for h in range(HOURS_PER_WEEK):
+        column = probabilities[:, h]
+        order = np.argsort(-column, kind="stable")
+        ranked.append(rows[order[column[order] >= args.min_probability]])
+
+    return ranked
+
+
+def print_results(name, results):
+    print("{:<22} API calls {:>7}  hits {:>7}  hits/1000 calls {:>8.1f}  streams detected {:>6.1%}  median delay {:>6.0f}s".format(
+        name, results["calls"], results["hits"], results["hits_per_1000"], results["coverage"], results["median_delay"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay user probing over past summaries: online hits per 1000 API calls of the current order vs online profiles")
+    parser.add_argument("--db", default=None, help="Read summaries from this Mongo database instead of generating synthetic ones")
+    parser.add_argument("--synthetic-users", type=int, default=20000)
+    parser.add_argument("--train-weeks", type=int, default=profile_weeks)
+    parser.add_argument("--eval-days", type=int, default=7)
+    parser.add_argument("--cycle", type=int, default=300, help="Seconds between two selections of the coordinator")
+    parser.add_argument("--users-per-cycle", type=int, default=200)
+    parser.add_argument("--exploration", type=float, default=0.2, help="Share of each selection taken from the round robin walk")
+    parser.add_argument("--offline-expire", type=int, default=30 * 60)
+    parser.add_argument("--finished-expire", type=int, default=6 * 3600)
+    parser.add_argument("--smoothing", type=float, default=profile_smoothing)
+    parser.add_argument("--min-probability", type=float, default=profile_min_probability)
+    parser.add_argument("--games", nargs="*", default=profile_games, help="Tracked games (synthetic: 'tracked')")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start_time = timeit.default_timer()
+
+    if args.db:
+        users, summaries = load_summaries(args.db, args.train_weeks + args.eval_days / 7)
+        args.eval_start = max([s["games"][-1]["end"] for s in summaries]) - args.eval_days * 86400 if summaries else 0
+    else:
+        args.games = args.games or ["tracked"]
+        users, summaries = synthetic_summaries(args.synthetic_users, args.train_weeks + math.ceil(args.eval_days / 7), args.seed)
+        args.eval_start = SYNTHETIC_START + args.train_weeks * WEEK
+
+    args.eval_end = args.eval_start + args.eval_days * 86400
+    # Interval keys: user * span + seconds since base (streams started before the evaluation included)
+    args.base = args.eval_start - WEEK
+    args.span = args.eval_end - args.base + WEEK
+
+    games = set(args.games) if args.games else None
+    intervals = [(s["user_id"], g["start"], g["end"]) for s in summaries for g in s["games"]
+                 if (games is None or g["game"] in games) and g["end"] >= args.eval_start and g["start"] < args.eval_end]
+
+    print("{} users, {} summaries, {} live intervals to find in {} days ({:.1f} sec)".format(len(users), len(summaries), len(intervals), args.eval_days,
+                                                                                          timeit.default_timer() - start_time))
+
+    replay = Replay(users, intervals, args)
+    print_results("current order", replay.run())
+    print_results("online profiles", replay.run(ranked_users(users, summaries, args)))
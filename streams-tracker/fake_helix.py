@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+
+from collections import Counter
+from datetime import datetime, timezone
+from aiohttp import web
+
+
+GAMES = {
+    "21779": "League of Legends",
+    "33214": "Fortnite",
+    "516575": "VALORANT",
+    "32982": "Grand Theft Auto V",
+    "27471": "Minecraft",
+    "509658": "Just Chatting",
+    "512710": "Call of Duty: Warzone",
+    "29595": "Dota 2"
+}
+
+LANGUAGES = ["en", "es", "de", "fr", "pt", "ru", "ko", "ja"]
+
+
+class FakeHelix:
+    """
+    Minimal stand-in for the Helix streams/users/games endpoints, driven by a synthetic population of channels of
+    which a fraction is live (streams sorted by viewers). Opaque pagination cursors, a Helix-like rate limit bucket
+    per Client-ID reported through the Ratelimit-* headers (429 once it is empty) and, optionally, random server errors.
+
+    advance() moves the population one step forward in time: streams end, offline channels go live, viewers drift
+    and some streams change game or title.
+    """
+    def __init__(self, number_channels=10000, rate_limit=800, refill_period=60, latency=0.05, seed=0, online_fraction=1.0, error_rate=0.0):
+        self.rate_limit = rate_limit
+        self.refill_rate = rate_limit / refill_period
+        self.buckets = {}
+        self.latency = latency
+        self.error_rate = error_rate
+
+        self.requests = 0
+        self.throttled = 0
+        self.calls = Counter()
+
+        self.rng = random.Random(seed)
+        self.next_stream_id = 40000000000
+
+        self.channels = [self.make_channel(idx) for idx in range(number_channels)]
+        self.users_by_login = {c["login"]: c for c in self.channels}
+        self.users_by_id = {c["id"]: c for c in self.channels}
+
+        self.live = {}
+        for channel in self.channels:
+            if self.rng.random() < online_fraction:
+                self.go_online(channel)
+
+        self.index()
+
+    def make_channel(self, idx):
+        return {
+            "id": str(100000 + idx),
+            "login": "user{}".format(idx),
+            "display_name": "User{}".format(idx),
+            "type": "",
+            "broadcaster_type": "",
+            "description": "",
+            "profile_image_url": "https://static-cdn.jtvnw.net/jtv_user_pictures/user{}-profile_image-300x300.png".format(idx),
+            "offline_image_url": "",
+            "view_count": 0,
+            "created_at": "2016-01-01T00:00:00Z"
+        }
+
+    def go_online(self, channel):
+        game_id = self.rng.choice(list(GAMES.keys()))
+        self.next_stream_id += 1
+
+        self.live[channel["id"]] = {
+            "id": str(self.next_stream_id),
+            "user_id": channel["id"],
+            "user_login": channel["login"],
+            "user_name": channel["display_name"],
+            "game_id": game_id,
+            "game_name": GAMES[game_id],
+            "type": "live",
+            "title": "Stream {}".format(self.next_stream_id),
+            "viewer_count": int(self.rng.paretovariate(1.2)) - 1,
+            "started_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "language": self.rng.choice(LANGUAGES),
+            "thumbnail_url": "https://static-cdn.jtvnw.net/previews-ttv/live_user_{}-{{width}}x{{height}}.jpg".format(channel["login"]),
+            "tag_ids": [],
+            "tags": [],
+            "is_mature": False
+        }
+
+    def index(self):
+        self.streams = sorted(self.live.values(), key=lambda x: -x["viewer_count"])
+
+        self.streams_by_user = {s["user_id"]: s for s in self.streams}
+        self.streams_by_game = {}
+        for stream in self.streams:
+            self.streams_by_game.setdefault(stream["game_id"], []).append(stream)
+
+        self.top_games = sorted(self.streams_by_game.keys(), key=lambda x: -sum([s["viewer_count"] for s in self.streams_by_game[x]]))
+
+    def advance(self, end_probability=0.02, change_probability=0.01):
+        # Offline channels go live at the rate that keeps the number of live streams stable
+        offline = len(self.channels) - len(self.live)
+        start_probability = end_probability * len(self.live) / offline if offline else 0
+
+        for channel in self.channels:
+            stream = self.live.get(channel["id"])
+
+            if stream is None:
+                if self.rng.random() < start_probability:
+                    self.go_online(channel)
+                continue
+
+            if self.rng.random() < end_probability:
+                del self.live[channel["id"]]
+                continue
+
+            stream["viewer_count"] = max(0, int(stream["viewer_count"] * self.rng.uniform(0.8, 1.25)))
+
+            if self.rng.random() < change_probability:
+                stream["game_id"] = self.rng.choice(list(GAMES.keys()))
+                stream["game_name"] = GAMES[stream["game_id"]]
+                stream["title"] = "{} ({})".format(stream["title"].split(" (")[0], stream["game_name"])
+
+        self.index()
+
+    def take_token(self, client_id):
+        now = time.time()
+        tokens, last_refill = self.buckets.get(client_id, (self.rate_limit, now))
+        tokens = min(self.rate_limit, tokens + (now - last_refill) * self.refill_rate)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+
+        self.buckets[client_id] = (tokens, now)
+
+        return allowed
+
+    def rate_limit_headers(self, client_id):
+        tokens, last_refill = self.buckets[client_id]
+
+        return {
+            "Ratelimit-Limit": str(self.rate_limit),
+            "Ratelimit-Remaining": str(int(tokens)),
+            "Ratelimit-Reset": str(int(last_refill + (self.rate_limit - tokens) / self.refill_rate))
+        }
+
+    def encode_cursor(self, offset):
+        return base64.b64encode(json.dumps({"b": None, "a": {"Offset": offset}}).encode("utf8")).decode("utf8")
+
+    def decode_cursor(self, cursor):
+        return int(json.loads(base64.b64decode(cursor.encode("utf8")).decode("utf8"))["a"]["Offset"]) if cursor else 0
+
+    def paginate(self, request, items):
+        first = int(request.query.get("first", 20))
+        if not 1 <= first <= 100:
+            raise web.HTTPBadRequest(text="Invalid value for first")
+
+        try:
+            offset = self.decode_cursor(request.query.get("after", ""))
+        except (ValueError, KeyError, TypeError):
+            raise web.HTTPBadRequest(text="Invalid cursor")
+
+        page = items[offset:offset + first]
+        pagination = {"cursor": self.encode_cursor(offset + first)} if offset + first < len(items) else {}
+
+        return {"data": page, "pagination": pagination}
+
+    def lookup(self, request, keys):
+        # users/games: up to 100 ids or names in total, no pagination
+        values = [(key, value) for key in keys for value in request.query.getall(key, [])]
+
+        if len(values) > 100:
+            raise web.HTTPBadRequest(text="Too many ids or names, the maximum is 100")
+
+        return values
+
+    async def answer(self, request, get_content):
+        client_id = request.headers.get("Client-ID", "")
+        self.requests += 1
+        self.calls[request.path] += 1
+
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return web.json_response({"error": "Unauthorized", "status": 401, "message": "OAuth token is missing"}, status=401)
+
+        if not self.take_token(client_id):
+            self.throttled += 1
+            return web.json_response({"error": "Too Many Requests", "status": 429}, status=429, headers=self.rate_limit_headers(client_id))
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return web.json_response({"error": "Internal Server Error", "status": 500}, status=500, headers=self.rate_limit_headers(client_id))
+
+        try:
+            content = get_content(request)
+        except web.HTTPBadRequest as e:
+            return web.json_response({"error": "Bad Request", "status": 400, "message": e.text}, status=400, headers=self.rate_limit_headers(client_id))
+
+        return web.json_response(content, headers=self.rate_limit_headers(client_id))
+
+    def streams_content(self, request):
+        user_ids = set(request.query.getall("user_id", []))
+        user_logins = set(request.query.getall("user_login", []))
+        game_ids = set(request.query.getall("game_id", []))
+        languages = set(request.query.getall("language", []))
+
+        if len(user_ids) + len(user_logins) > 100:
+            raise web.HTTPBadRequest(text="Too many user ids or logins, the maximum is 100")
+
+        if user_ids or user_logins:
+            streams = [self.streams_by_user[u] for u in user_ids if u in self.streams_by_user]
+            streams += [self.streams_by_user[self.users_by_login[u]["id"]] for u in user_logins
+                        if u in self.users_by_login and self.users_by_login[u]["id"] in self.streams_by_user]
+            streams = sorted({s["id"]: s for s in streams}.values(), key=lambda x: -x["viewer_count"])
+        elif game_ids:
+            streams = sorted([s for g in game_ids for s in self.streams_by_game.get(g, [])], key=lambda x: -x["viewer_count"])
+        else:
+            streams = self.streams
+
+        if languages:
+            streams = [s for s in streams if s["language"] in languages]
+
+        return self.paginate(request, streams)
+
+    def users_content(self, request):
+        values = self.lookup(request, ["id", "login"])
+        users = [self.users_by_id.get(v) if k == "id" else self.users_by_login.get(v) for k, v in values]
+
+        return {"data": [u for u in users if u]}
+
+    def games_content(self, request):
+        values = self.lookup(request, ["id", "name"])
+        names = {name: game_id for game_id, name in GAMES.items()}
+        game_ids = [v if k == "id" else names.get(v) for k, v in values]
+
+        return {"data": [{"id": g, "name": GAMES[g], "box_art_url": ""} for g in dict.fromkeys(game_ids) if g in GAMES]}
+
+    def top_games_content(self, request):
+        return self.paginate(request, [{"id": g, "name": GAMES[g], "box_art_url": ""} for g in self.top_games])
+
+    async def get_streams(self, request):
+        return await self.answer(request, self.streams_content)
+
+    async def get_users(self, request):
+        return await self.answer(request, self.users_content)
+
+    async def get_games(self, request):
+        return await self.answer(request, self.games_content)
+
+    async def get_top_games(self, request):
+        return await self.answer(request, self.top_games_content)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/helix/streams", self.get_streams)
+        app.router.add_get("/helix/users", self.get_users)
+        app.router.add_get("/helix/games", self.get_games)
+        app.router.add_get("/helix/games/top", self.get_top_games)
+
+        return app
+
+
+async def start_fake_helix(helix, port):
+    runner = web.AppRunner(helix.app())
+    await runner.setup()
+
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+
+    return runner
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake Helix API")
+    parser.add_argument("--channels", type=int, default=10000)
+    parser.add_argument("--online-fraction", type=float, default=1.0)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rate-limit", type=int, default=800)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    helix = FakeHelix(args.channels, args.rate_limit, latency=args.latency, online_fraction=args.online_fraction, error_rate=args.error_rate)
+    web.run_app(helix.app(), host="127.0.0.1", port=args.port)
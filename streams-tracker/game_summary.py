@@ -0,0 +1,42 @@
+from datetime import datetime
+
+
+# Summary of the games of a stream: one {game, start, end} segment per game played, built from its samples in
+# chronological order (process_all_streams, compress_stream_data and the ingest-time summaries of track_current)
+
+
+def new_state(user_id=None):
+    default_ts = datetime(year=2021, month=5, day=1).timestamp()
+
+    return {"user_id": user_id, "game": "", "start": default_ts, "last_ts": default_ts, "games": []}
+
+
+def extend_state(state, entries):
+    # Incremental version of the summary: entries must arrive in chronological order
+    for entry in entries:
+        if not state["game"]:
+            state["game"] = entry["game"]
+            state["start"] = entry["ts"]
+            continue
+
+        if entry["game"] != state["game"]:
+            state["games"].append({"game": state["game"], "start": state["start"], "end": state["last_ts"]})
+            state["game"] = entry["game"]
+            state["start"] = entry["ts"]
+
+        state["last_ts"] = entry["ts"]
+
+    return state
+
+
+def finalize_state(state):
+    summarized_stream = list(state["games"])
+
+    if state["last_ts"] != state["start"]:
+        summarized_stream.append({"game": state["game"], "start": state["start"], "end": state["last_ts"]})
+
+    return summarized_stream
+
+
+def compress_entries(entries):
+    return finalize_state(extend_state(new_state(), entries))
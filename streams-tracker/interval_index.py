@@ -0,0 +1,225 @@
+import argparse
+import fcntl
+import json
+import os
+import timeit
+import numpy as np
+
+from contextlib import contextmanager
+from pymongo import MongoClient
+from config import mongo_host, mongo_port, mongo_user, mongo_password, interval_index_path
+
+
+INDEX_FILE = "intervals.npz"
+JOURNAL_FILE = "journal.jsonl"
+LOCK_FILE = "lock"
+
+
+@contextmanager
+def locked(path):
+    with open(os.path.join(path, LOCK_FILE), "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def summary_intervals(summary):
+    return [(summary["user_id"], g["start"], g["end"], summary["stream_id"], g["game"]) for g in summary["games"]]
+
+
+def append_summaries(path, summaries):
+    # Writers (compress_stream_data, track_current) only append to the journal: no need to load the index
+    if not path or not summaries:
+        return
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    with locked(path), open(os.path.join(path, JOURNAL_FILE), "a") as f:
+        for summary in summaries:
+            for interval in summary_intervals(summary):
+                f.write("{}\n".format(json.dumps(interval)))
+
+
+class IntervalIndex:
+    """
+    Game segments of every stream summary (streams.summaries), grouped by user: for each user, a slice of start/end
+    arrays sorted by start time, with the stream and game of each segment dictionary-encoded. Point queries are
+    answered for a whole batch of timestamps of one user with one binary search.
+
+    Persisted as an npz file plus a journal of segments appended since it was written: loading replays the journal,
+    compact() folds it into the npz file.
+    """
+    def __init__(self):
+        self.user_names = []
+        self.stream_names = []
+        self.game_names = []
+
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.starts = np.zeros(0, dtype=np.float64)
+        self.ends = np.zeros(0, dtype=np.float64)
+        self.streams = np.zeros(0, dtype=np.int32)
+        self.games = np.zeros(0, dtype=np.int32)
+
+        self.pending = []
+        self.index_codes()
+
+    def index_codes(self):
+        self.user_codes = {u: idx for idx, u in enumerate(self.user_names)}
+        self.stream_codes = {s: idx for idx, s in enumerate(self.stream_names)}
+        self.game_codes = {g: idx for idx, g in enumerate(self.game_names)}
+
+        # Object arrays so that lookups return the original ids, with None for "not streaming"
+        self.stream_values = np.array(self.stream_names + [None], dtype=object)
+        self.game_values = np.array(self.game_names + [None], dtype=object)
+
+    def code(self, codes, names, value):
+        if value not in codes:
+            codes[value] = len(names)
+            names.append(value)
+
+        return codes[value]
+
+    def add(self, intervals):
+        self.pending.extend(intervals)
+
+    def add_summaries(self, summaries):
+        for summary in summaries:
+            self.add(summary_intervals(summary))
+
+    def merge(self):
+        if not self.pending:
+            return
+
+        users = np.array([self.code(self.user_codes, self.user_names, i[0]) for i in self.pending], dtype=np.int64)
+        streams = np.array([self.code(self.stream_codes, self.stream_names, i[3]) for i in self.pending], dtype=np.int32)
+        games = np.array([self.code(self.game_codes, self.game_names, i[4]) for i in self.pending], dtype=np.int32)
+
+        old_users = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+
+        users = np.concatenate([old_users, users])
+        starts = np.concatenate([self.starts, np.array([i[1] for i in self.pending], dtype=np.float64)])
+        ends = np.concatenate([self.ends, np.array([i[2] for i in self.pending], dtype=np.float64)])
+        streams = np.concatenate([self.streams, streams])
+        games = np.concatenate([self.games, games])
+
+        order = np.lexsort((starts, users))
+
+        self.starts, self.ends, self.streams, self.games = starts[order], ends[order], streams[order], games[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(users, minlength=len(self.user_names)))]).astype(np.int64)
+
+        self.pending = []
+        self.index_codes()
+
+    def lookup(self, user, timestamps):
+        """
+        Stream and game of user at each timestamp: two object arrays aligned with timestamps, None where the user was
+        not streaming.
+        """
+        self.merge()
+
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        user_code = self.user_codes.get(user)
+
+        if user_code is None:
+            return np.full(len(timestamps), None, dtype=object), np.full(len(timestamps), None, dtype=object)
+
+        lo, hi = self.offsets[user_code], self.offsets[user_code + 1]
+
+        # Last segment starting at or before each timestamp, a hit if it has not ended yet
+        positions = np.searchsorted(self.starts[lo:hi], timestamps, side="right") - 1 + lo
+        hits = (positions >= lo) & (timestamps <= self.ends[np.maximum(positions, lo)])
+
+        streams = np.where(hits, self.streams[np.maximum(positions, lo)], len(self.stream_names))
+        games = np.where(hits, self.games[np.maximum(positions, lo)], len(self.game_names))
+
+        return self.stream_values[streams], self.game_values[games]
+
+    def __len__(self):
+        return len(self.starts) + len(self.pending)
+
+    @classmethod
+    def read(cls, path):
+        index = cls()
+
+        if os.path.isfile(os.path.join(path, INDEX_FILE)):
+            with np.load(os.path.join(path, INDEX_FILE)) as data:
+                index.user_names = data["user_names"].tolist()
+                index.stream_names = data["stream_names"].tolist()
+                index.game_names = data["game_names"].tolist()
+
+                index.offsets = data["offsets"]
+                index.starts = data["starts"]
+                index.ends = data["ends"]
+                index.streams = data["streams"]
+                index.games = data["games"]
+
+            index.index_codes()
+
+        if os.path.isfile(os.path.join(path, JOURNAL_FILE)):
+            with open(os.path.join(path, JOURNAL_FILE), "r") as f:
+                index.add([json.loads(l) for l in f if l.strip()])
+
+        index.merge()
+
+        return index
+
+    @classmethod
+    def load(cls, path):
+        with locked(path):
+            return cls.read(path)
+
+    def write(self, path):
+        self.merge()
+
+        tmp_file = os.path.join(path, "tmp-{}".format(INDEX_FILE))
+        np.savez(tmp_file, user_names=np.array(self.user_names, dtype=str), stream_names=np.array(self.stream_names, dtype=str),
+                 game_names=np.array(self.game_names, dtype=str), offsets=self.offsets, starts=self.starts, ends=self.ends, streams=self.streams,
+                 games=self.games)
+        os.replace(tmp_file, os.path.join(path, INDEX_FILE))
+
+    @classmethod
+    def compact(cls, path):
+        # Folds the journal into the npz file, holding the lock so that no segment appended meanwhile is lost
+        with locked(path):
+            index = cls.read(path)
+
+            index.write(path)
+            open(os.path.join(path, JOURNAL_FILE), "w").close()
+
+        return index
+
+
+def rebuild(path, db_name="streams"):
+    mongo_client = MongoClient('mongodb://{}:{}/'.format(mongo_host, mongo_port), username=mongo_user, password=mongo_password)
+    index = IntervalIndex()
+
+    for summary in mongo_client[db_name].summaries.find({}, projection={"_id": False, "user_id": True, "stream_id": True, "games": True}):
+        index.add(summary_intervals(summary))
+
+    mongo_client.close()
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    with locked(path):
+        index.write(path)
+        open(os.path.join(path, JOURNAL_FILE), "w").close()
+
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the interval index of stream summaries")
+    parser.add_argument("--path", default=interval_index_path)
+    parser.add_argument("--rebuild", action="store_true", help="Build the index from scratch from streams.summaries")
+    parser.add_argument("--db", default="streams")
+    args = parser.parse_args()
+
+    start_time = timeit.default_timer()
+    index = rebuild(args.path, args.db) if args.rebuild else IntervalIndex.compact(args.path)
+
+    print("{} segments of {} users in {:.2f} sec".format(len(index), len(index.user_names), timeit.default_timer() - start_time))
@@ -0,0 +1,33 @@
+import bisect
+
+
+class Histogram:
+    # Fixed-bucket histogram: constant memory whatever the number of observations
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0 for _ in range(len(self.buckets) + 1)]
+        self.total = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-quantile
+        if not self.total:
+            return None
+
+        accumulated = 0
+        for idx, count in enumerate(self.counts):
+            accumulated += count
+
+            if accumulated >= q * self.total:
+                return self.buckets[idx] if idx < len(self.buckets) else float("inf")
+
+    def summary(self):
+        if not self.total:
+            return {"count": 0}
+
+        return {"count": self.total, "mean": round(self.sum / self.total, 4), "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99)}
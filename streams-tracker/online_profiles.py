@@ -0,0 +1,161 @@
+import argparse
+import hashlib
+import hmac
+import json
+import time
+import timeit
+import redis
+import numpy as np
+
+from pymongo import MongoClient
+from config import redis_host, redis_port, redis_password, mongo_host, mongo_port, mongo_user, mongo_password, secret_key, profile_weeks, \
+    profile_smoothing, profile_min_probability, profile_games
+
+
+HOURS_PER_WEEK = 168
+
+
+def hour_of_week(ts):
+    # UTC, Monday 00:00 is hour 0 (the epoch is a Thursday)
+    return int((ts // 3600 + 72) % HOURS_PER_WEEK)
+
+
+def live_hours(summary, games=None):
+    # Absolute hours (since the epoch) during which the stream was live in one of games (None: any game)
+    hours = set()
+
+    for g in summary["games"]:
+        if games is None or g["game"] in games:
+            hours.update(range(int(g["start"] // 3600), int(g["end"] // 3600) + 1))
+
+    return hours
+
+
+def activity_from_log(entries):
+    """
+    Relative number of tracked streams at each hour of the week (mean 1) from the users_tracked_log entries of the
+    download module's coordinator, None if the log does not cover the whole week.
+    """
+    totals = np.zeros(HOURS_PER_WEEK)
+    counts = np.zeros(HOURS_PER_WEEK)
+
+    for entry in entries:
+        h = hour_of_week(entry["timestamp"])
+        totals[h] += entry["users"]
+        counts[h] += 1
+
+    if not counts.all() or not totals.any():
+        return None
+
+    activity = totals / counts
+    return activity / activity.mean()
+
+
+class OnlineProfiles:
+    """
+    Hour-of-week streaming profile of every user: the probability of finding the user live in one of the probed games
+    at each hour of the week, from the weeks it was (or was not) live at that hour over the last weeks of summaries.
+    Estimates are smoothed towards the population rate, shaped by the weekly activity of tracked streams, so that users
+    with little history are not ranked on one or two streams.
+    """
+    def __init__(self, weeks=profile_weeks, smoothing=profile_smoothing, games=None, users=None):
+        self.weeks = weeks
+        self.smoothing = smoothing
+        self.games = set(games) if games else None
+        self.only_users = users
+
+        self.user_codes = {}
+        self.rows = []
+        self.columns = []
+
+    def add_summaries(self, summaries):
+        for summary in summaries:
+            if self.only_users is not None and summary["user_id"] not in self.only_users:
+                continue
+
+            hours = live_hours(summary, self.games)
+
+            if hours:
+                code = self.user_codes.setdefault(summary["user_id"], len(self.user_codes))
+                self.rows.extend([code] * len(hours))
+                # hour_of_week of each absolute hour
+                self.columns.extend([(h + 72) % HOURS_PER_WEEK for h in hours])
+
+    def probabilities(self, activity=None):
+        # Users x hours of the week
+        counts = np.zeros((len(self.user_codes), HOURS_PER_WEEK), dtype=np.float32)
+        np.add.at(counts, (np.array(self.rows, dtype=np.int64), np.array(self.columns, dtype=np.int64)), 1)
+        np.minimum(counts, self.weeks, out=counts)
+
+        if activity is None:
+            activity = counts.sum(axis=0) / max(counts.sum(), 1) * HOURS_PER_WEEK
+
+        prior = counts.mean() / self.weeks * activity if len(counts) else np.zeros(HOURS_PER_WEEK)
+
+        return (counts + self.smoothing * prior) / (self.weeks + self.smoothing)
+
+    def users(self):
+        return list(self.user_codes.keys())
+
+
+def hash_id(value):
+    return hmac.new(secret_key.encode("utf-8"), value.encode("utf-8"), hashlib.sha1).hexdigest()
+
+
+def write_scores(cache, twitch_ids, users, probabilities, min_probability=profile_min_probability):
+    """
+    One sorted set per hour of the week (online_scores:{hour}) of the users of to_probe, scored by probability of being
+    live, read by the coordinator to order twitch_api_to_query. Summaries only know hashed user ids: twitch_ids maps
+    them back.
+    """
+    rows = np.array([idx for idx, user in enumerate(users) if user in twitch_ids], dtype=np.int64)
+    ids = [twitch_ids[users[idx]] for idx in rows]
+    written = 0
+
+    for h in range(HOURS_PER_WEEK):
+        column = probabilities[rows, h]
+        scores = {ids[idx]: float(column[idx]) for idx in np.nonzero(column >= min_probability)[0]}
+
+        pipeline = cache.pipeline(transaction=True)
+        pipeline.delete("online_scores:{}".format(h))
+
+        items = list(scores.items())
+        for idx in range(0, len(items), 10000):
+            pipeline.zadd("online_scores:{}".format(h), dict(items[idx:idx + 10000]))
+
+        pipeline.execute()
+        written += len(scores)
+
+    return written
+
+
+def build_profiles(db_name="streams", now=None):
+    now = now or time.time()
+    since = now - profile_weeks * 7 * 86400
+
+    cache = redis.Redis(host=redis_host, port=redis_port, password=redis_password)
+    mongo_client = MongoClient('mongodb://{}:{}/'.format(mongo_host, mongo_port), username=mongo_user, password=mongo_password)
+
+    # Only users still to probe get a profile
+    twitch_ids = {hash_id(x.decode("utf-8")): x.decode("utf-8") for x in cache.sscan_iter("to_probe", count=10000)}
+
+    profiles = OnlineProfiles(games=profile_games, users=twitch_ids)
+    summaries = mongo_client[db_name].summaries.find({"games.start": {"$gte": since}}, projection={"_id": False, "user_id": True, "games": True})
+    profiles.add_summaries(summaries)
+    mongo_client.close()
+
+    activity = activity_from_log([json.loads(x) for x in cache.smembers("users_tracked_log")])
+    probabilities = profiles.probabilities(activity)
+
+    return len(profiles.user_codes), write_scores(cache, twitch_ids, profiles.users(), probabilities)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the hour-of-week online profiles of the users to probe")
+    parser.add_argument("--db", default="streams")
+    args = parser.parse_args()
+
+    start_time = timeit.default_timer()
+    users, written = build_profiles(args.db)
+
+    print("{} user profiles, {} hourly scores written in {:.2f} sec".format(users, written, timeit.default_timer() - start_time))
@@ -3,39 +3,50 @@ import json
 import sys
 import hashlib
 import hmac
+import multiprocessing
 
 from pymongo import MongoClient
-from datetime import datetime
-from config import redis_host, redis_port, redis_password, mongo_host, mongo_port, mongo_user, mongo_password, secret_key, path_to_storage
+from game_summary import new_state, extend_state, finalize_state
+from config import redis_host, redis_port, redis_password, mongo_host, mongo_port, mongo_user, mongo_password, secret_key, path_to_storage, \
+    parsing_processes
 from logger import get_logger
+from storage.snapshot_format import SnapshotReader
 
 
 chunk_size = 5
 
-def compress_entries(entries):
-    summarized_stream = []
-    
-    current_game = ""
-    start = datetime(year=2021, month=5, day=1).timestamp()
-    last_ts = datetime(year=2021, month=5, day=1).timestamp()
 
-    for entry in entries:
-        if not current_game:
-            current_game = entry["game"]
-            start = entry["ts"]
-            continue
-                            
-        if entry["game"] != current_game:
-            summarized_stream.append({"game": current_game, "start": start, "end": last_ts})
-            current_game = entry["game"]
-            start = entry["ts"]
+def init_worker(users):
+    global users_with_location
+    users_with_location = users
+
+
+def parse_file(file_name):
+    # Runs in the process pool: only compact (stream, user, ts, game) tuples travel back
+    reader = SnapshotReader(path_to_storage)
+
+    return [(stream["id"], stream["user_id"], stream["timestamp"], stream["game_id"]) for stream in reader.core_rows(file_name)
+            if stream["user_id"] in users_with_location]
+
 
-        last_ts = entry["ts"]
+def load_states(cache, stream_ids):
+    if not stream_ids:
+        return {}
 
-    if last_ts != start:
-        summarized_stream.append({"game": current_game, "start": start, "end": last_ts})
+    states = {stream_id: json.loads(state.decode("utf8")) for stream_id, state in zip(stream_ids, cache.hmget("old_streams_state", stream_ids)) if state}
 
-    return summarized_stream
+    # Streams in progress stored by previous versions of this script as whole JSON blobs
+    missing = [stream_id for stream_id in stream_ids if stream_id not in states]
+    legacy = {stream_id: json.loads(data.decode("utf8"))["data"] for stream_id, data in zip(missing, cache.hmget("old_streams_data", missing)) if data} if missing else {}
+
+    for stream_id, data in legacy.items():
+        if data:
+            states[stream_id] = extend_state(new_state(data[0]["user_id"]), sorted(data, key=lambda x: x["ts"]))
+
+    if legacy:
+        cache.hdel("old_streams_data", *legacy.keys())
+
+    return states
 
 
 if __name__ == "__main__":
@@ -52,58 +63,55 @@ if __name__ == "__main__":
     if len(files_to_process) < 5:
         sys.exit(0)
 
-    file_chunks = [files_to_process[i:i + chunk_size] for i in range(0, len(files_to_process), chunk_size)]
+    pool = multiprocessing.Pool(parsing_processes, initializer=init_worker, initargs=(users_with_location,))
+    parsed_files = pool.imap(parse_file, files_to_process)
 
-    for chunk in file_chunks:
+    for chunk_start in range(0, len(files_to_process), chunk_size):
         data_to_keep = {}
-        finished_streams = set()
-        currently_active = set()
         
-        for file_name in chunk:
-            with open("{}/{}".format(path_to_storage, file_name), "r") as f:
-                for l in f:
-                    data = json.loads(l.strip())
-
-                    for stream in data["data"]:
-                        if stream["user_id"] in users_with_location:
-                            if stream["id"] not in data_to_keep:
-                                data_to_keep[stream["id"]] = []
-                            
-                            data_to_keep[stream["id"]].append({"user_id": stream["user_id"], "ts": data["timestamp"], "game": stream["game_id"]})
-                            currently_active.add(stream["id"])
+        for _ in files_to_process[chunk_start:chunk_start + chunk_size]:
+            for stream_id, user_id, ts, game in next(parsed_files):
+                if stream_id not in data_to_keep:
+                    data_to_keep[stream_id] = (user_id, [])
 
+                data_to_keep[stream_id][1].append({"ts": ts, "game": game})
+
+        currently_active = set(data_to_keep.keys())
         old_active = set([x.decode("utf8") for x in cache.smembers("old_streams")])
-        finished_streams.update(old_active - currently_active)
+        finished_streams = list(old_active - currently_active)
 
-        cache.spop("old_streams", count=cache.scard("old_streams"))
-        cache.sadd("old_streams", *list(currently_active))
+        cache.delete("old_streams")
+        if currently_active:
+            cache.sadd("old_streams", *list(currently_active))
 
-        for stream_id, data in data_to_keep.items():
-            old_data = []
+        # Only the streams in this chunk are read and written back
+        states = load_states(cache, list(data_to_keep.keys()))
 
-            if cache.hexists("old_streams_data", stream_id):
-                old_data = json.loads(cache.hget("old_streams_data", stream_id).decode("utf8"))["data"]
+        for stream_id, (user_id, data) in data_to_keep.items():
+            states[stream_id] = extend_state(states.get(stream_id, new_state(user_id)), data)
 
-            old_data.extend(data)
-            cache.hset("old_streams_data", stream_id, json.dumps({"data": data}))
+        if states:
+            cache.hset("old_streams_state", mapping={stream_id: json.dumps(state) for stream_id, state in states.items()})
 
         # Now, for the streams that have finished:        
-        for stream_id in finished_streams:
-            # Fetch the stream's old data (stored from previous runs of the script)
-            if cache.hexists("old_streams_data", stream_id):
-                data = json.loads(cache.hget("old_streams_data", stream_id))["data"]
-                if not data:
-                    continue
+        coarse_data = []
+        for stream_id, state in load_states(cache, finished_streams).items():
+            compressed = finalize_state(state)
+
+            encoded_stream_id = hmac.new(secret_key.encode("utf-8"), stream_id.encode("utf-8"), hashlib.sha1).hexdigest()
+            encoded_user_id = hmac.new(secret_key.encode("utf-8"), state["user_id"].encode("utf-8"), hashlib.sha1).hexdigest()
 
-                sorted_by_date = sorted(data, key=lambda x: x["ts"])               
+            coarse_data.append({"user_id": encoded_user_id, "stream_id": encoded_stream_id, "changes": len(compressed)-1, "games": compressed})
 
-                compressed = compress_entries(sorted_by_date)
+        if coarse_data:
+            mongo_client.streams.coarse_data.insert_many(coarse_data, ordered=False)
+            cache.sadd("streams_new_coarse_grained", *[x["stream_id"] for x in coarse_data])
 
-                encoded_stream_id = hmac.new(secret_key.encode("utf-8"), stream_id.encode("utf-8"), hashlib.sha1).hexdigest()
-                encoded_user_id = hmac.new(secret_key.encode("utf-8"), data[0]["user_id"].encode("utf-8"), hashlib.sha1).hexdigest()
+        # Once the data is in mongo, delete it from the cache
+        if finished_streams:
+            cache.hdel("old_streams_state", *finished_streams)
 
-                mongo_client.streams.coarse_data.insert_one({"user_id": encoded_user_id, "stream_id": encoded_stream_id, "changes": len(compressed)-1, "games": compressed})
-                cache.sadd("streams_new_coarse_grained", encoded_stream_id)
+        logger.info("Processed {}/{} files. Active streams: {}, finished: {}".format(min(chunk_start + chunk_size, len(files_to_process)), len(files_to_process),
+                                                                                 len(currently_active), len(coarse_data)))
 
-                # Once the data is in mongo, delete it from the cache
-                cache.hdel("old_streams_data", stream_id)
+    pool.close()
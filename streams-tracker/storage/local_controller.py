@@ -1,22 +1,74 @@
 import redis
 import json
+import math
 
 from datetime import datetime
+from storage.snapshot_format import SnapshotWriter
+from config import columnar_snapshots, snapshot_keyframe_interval, snapshot_compression_level, snapshot_chunk_rows, seen_users_window, seen_users_bucket
 
 
 class LocalController:
     def __init__(self, storage_dir, redis_conf):
         self.storage_dir = storage_dir
-        self.users_storage = redis.Redis(host=redis_conf["host"], port=redis_conf["port"], password=redis_conf["password"])
+        self.users_storage = redis.Redis(host=redis_conf["host"], port=redis_conf["port"], password=redis_conf["password"],
+                                         db=redis_conf.get("db", 0))
         self.now = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-        self.buffer = open("{}/{}.json".format(self.storage_dir, self.now), "a+")
+
+        if columnar_snapshots:
+            self.file_name = "{}.tsnap".format(self.now)
+            last_snapshot = self.users_storage.get("last_stream_snapshot")
+
+            self.snapshot = SnapshotWriter(self.storage_dir, self.file_name, last_snapshot.decode("utf8") if last_snapshot else None,
+                                           keyframe_interval=snapshot_keyframe_interval, compression_level=snapshot_compression_level,
+                                           chunk_rows=snapshot_chunk_rows)
+        else:
+            self.file_name = "{}.json".format(self.now)
+            self.buffer = open("{}/{}".format(self.storage_dir, self.file_name), "a+")
     
     def save_streams(self, data):
-        self.buffer.write(json.dumps(data) + "\n")
+        if columnar_snapshots:
+            self.snapshot.add_page(data)
+        else:
+            self.buffer.write(json.dumps(data) + "\n")
                
+    def unseen_users(self, data, now):
+        # Users queued during the last seen_users_window seconds are in one of the seen_users:{bucket} sets
+        current_bucket = int(now // seen_users_bucket)
+        buckets = range(current_bucket - math.ceil(seen_users_window / seen_users_bucket) + 1, current_bucket + 1)
+        user_ids = [user["id"] for user in data]
+
+        # One SISMEMBER per user and bucket (SMISMEMBER needs Redis 6.2), in a single round trip
+        pipeline = self.users_storage.pipeline(transaction=False)
+        for bucket in buckets:
+            for user_id in user_ids:
+                pipeline.sismember("seen_users:{}".format(bucket), user_id)
+
+        flags = pipeline.execute()
+        seen = [any(flags[idx::len(user_ids)]) for idx in range(len(user_ids))]
+        unseen = [user for user, was_seen in zip(data, seen) if not was_seen]
+
+        if unseen:
+            pipeline.sadd("seen_users:{}".format(current_bucket), *[user["id"] for user in unseen])
+            pipeline.expire("seen_users:{}".format(current_bucket), seen_users_window + seen_users_bucket)
+            pipeline.execute()
+
+        return unseen
+
     def save_users(self, data):
-        self.users_storage.sadd("new_users", json.dumps({"users": data, "timestamp": datetime.now().timestamp()}))
+        now = datetime.now().timestamp()
+
+        if seen_users_window and data:
+            data = self.unseen_users(data, now)
+
+        if data:
+            self.users_storage.sadd("new_users", json.dumps({"users": data, "timestamp": now}))
 
     def finish(self):
-        self.users_storage.sadd("stream_files", "{}.json".format(self.now))
-        self.users_storage.sadd("new_stream_files", "{}.json".format(self.now))
\ No newline at end of file
+        if columnar_snapshots:
+            self.snapshot.close()
+            self.users_storage.set("last_stream_snapshot", self.file_name)
+        else:
+            self.buffer.close()
+
+        self.users_storage.sadd("stream_files", self.file_name)
+        self.users_storage.sadd("new_stream_files", self.file_name)
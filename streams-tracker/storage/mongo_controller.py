@@ -1,26 +1,105 @@
-from pymongo import MongoClient
-from config import mongo_host, mongo_port, mongo_user, mongo_password
+import timeit
+
+from collections import OrderedDict
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import OperationFailure
+from config import mongo_host, mongo_port, mongo_user, mongo_password, known_ids_cache_size
+
+
+class KnownIds:
+    # LRU of ids already stored in Mongo
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.ids = OrderedDict()
+
+    def __contains__(self, key):
+        if key in self.ids:
+            self.ids.move_to_end(key)
+            return True
+
+        return False
+
+    def add(self, key):
+        self.ids[key] = True
+        self.ids.move_to_end(key)
+
+        if len(self.ids) > self.max_size:
+            self.ids.popitem(last=False)
 
 
 class MongoController:
-    def __init__(self):
+    def __init__(self, db_name="streams"):
         super().__init__()
         self.mongo_client = MongoClient('mongodb://{}:{}/'.format(mongo_host, mongo_port), username=mongo_user, password=mongo_password)
+        self.db = self.mongo_client[db_name]
+
+        self.known_streams = KnownIds(known_ids_cache_size)
+        self.known_games = KnownIds(known_ids_cache_size)
+
+        self.write_time = 0
+        self.write_operations = 0
+        self.written = 0
+
+        # Upserts rely on the unique indexes to never store an entry twice
+        try:
+            self.db.metadata.create_index("stream_id", unique=True)
+            self.db.game_names.create_index("game_id", unique=True)
+        except OperationFailure:
+            # Pre-existing duplicates: upserts still work, but concurrent writers could duplicate entries
+            pass
+
+    def timed_write(self, write, *args, **kwargs):
+        start_time = timeit.default_timer()
+        write(*args, **kwargs)
+
+        self.write_time += timeit.default_timer() - start_time
+        self.write_operations += 1
+
+    def upsert_new(self, collection, key, documents, known):
+        # Only ids not seen recently reach Mongo, in a single unordered bulk of upserts
+        requests = [UpdateOne({key: doc_id}, {"$setOnInsert": doc}, upsert=True) for doc_id, doc in documents.items() if doc_id not in known]
+
+        if requests:
+            self.timed_write(collection.bulk_write, requests, ordered=False)
+            self.written += len(requests)
+
+        for doc_id in documents:
+            known.add(doc_id)
         
     # Stream + user + stream_start
     def save_stream_metadata(self, streams_metadata):
-        # If the data is already there, do not store
-        for stream_id, metadata in streams_metadata.items():
-            if self.mongo_client.streams.metadata.count_documents({"stream_id": stream_id}, limit=1) == 0: 
-                self.mongo_client.streams.metadata.insert_one(metadata)            
+        self.upsert_new(self.db.metadata, "stream_id", streams_metadata, self.known_streams)
 
 
     def save_stream_data(self, data_to_store): 
         if data_to_store:
-            self.mongo_client.streams.data.insert_many(data_to_store)
+            self.timed_write(self.db.data.insert_many, data_to_store, ordered=False)
+            self.written += len(data_to_store)
 
 
     def save_game_name_mapping(self, game_names):
-        for game_id, game_name in game_names.items():
-            if self.mongo_client.streams.game_names.count_documents({"game_id": game_id}, limit=1) == 0: 
-                self.mongo_client.streams.game_names.insert_one({"game_id": game_id, "game_name": game_name})       
\ No newline at end of file
+        self.upsert_new(self.db.game_names, "game_id", {game_id: {"game_id": game_id, "game_name": game_name} for game_id, game_name in game_names.items()},
+                        self.known_games)
+
+
+    def save_summaries(self, summaries):
+        if summaries:
+            self.timed_write(self.db.summaries.insert_many, summaries, ordered=False)
+            self.written += len(summaries)
+
+
+    def delete_stream_data(self, stream_ids):
+        # Transitions of finished streams, all streams at once
+        if stream_ids:
+            self.timed_write(self.db.data.delete_many, {"stream_id": {"$in": stream_ids}})
+
+
+    def report(self):
+        # Write statistics since the last report (i.e. per tracking cycle)
+        stats = {"operations": self.write_operations, "documents": self.written, "latency": round(self.write_time, 4)}
+
+        self.write_time = 0
+        self.write_operations = 0
+        self.written = 0
+
+        return stats
@@ -0,0 +1,302 @@
+import io
+import json
+import orjson
+import os
+import struct
+import zstandard
+
+from array import array
+
+
+MAGIC = b"TSNP"
+VERSION = 2
+
+# Version 1 files hold a single chunk
+SUPPORTED_VERSIONS = [1, 2]
+
+# Columns stored for every row of a snapshot
+CORE_COLUMNS = ["id", "user_id", "game_id"]
+
+# Columns stored only for rows that are new or have changed with respect to the base snapshot
+DETAIL_COLUMNS = ["user_login", "user_name", "game_name", "type", "title", "tags", "tag_ids", "language", "started_at", "thumbnail_url", "is_mature"]
+
+
+def is_snapshot(file_name):
+    return file_name.endswith(".tsnap")
+
+
+def dictionary_encode(values):
+    dictionary = []
+    positions = {}
+    indices = array("I")
+
+    for value in values:
+        key = tuple(value) if isinstance(value, list) else value
+
+        if key not in positions:
+            positions[key] = len(dictionary)
+            dictionary.append(value)
+
+        indices.append(positions[key])
+
+    return dictionary, indices
+
+
+def row_key(row):
+    return tuple([row.get(c) if not isinstance(row.get(c), list) else tuple(row.get(c)) for c in CORE_COLUMNS + DETAIL_COLUMNS])
+
+
+class Snapshot:
+    """
+    Decoded snapshot file, a sequence of chunks of rows. Core columns (plus viewers and page timestamps) are available
+    for every row, detail columns only for the rows flagged as changed; the remaining rows are found in the base snapshot.
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.header = chunks[0][0]
+        self.base = self.header["base"]
+        self.depth = self.header["depth"]
+
+    def __len__(self):
+        return sum([header["rows"] for header, _ in self.chunks])
+
+    def column(self, name):
+        return [header["dictionaries"][name][i] for header, arrays in self.chunks for i in arrays[name]]
+
+    def core_rows(self):
+        for header, arrays in self.chunks:
+            columns = [[header["dictionaries"][c][i] for i in arrays[c]] for c in CORE_COLUMNS]
+
+            for idx in range(header["rows"]):
+                row = {c: columns[c_idx][idx] for c_idx, c in enumerate(CORE_COLUMNS)}
+                row["viewer_count"] = arrays["viewer_count"][idx]
+                row["timestamp"] = arrays["timestamp"][idx]
+                row["changed"] = bool(arrays["changed"][idx])
+
+                yield row
+
+    def changed_rows(self):
+        details = [self.column(c) for c in DETAIL_COLUMNS]
+        detail_idx = 0
+
+        for row in self.core_rows():
+            if not row.pop("changed"):
+                continue
+
+            for c_idx, c in enumerate(DETAIL_COLUMNS):
+                row[c] = details[c_idx][detail_idx]
+
+            detail_idx += 1
+
+            yield row
+
+    def rows(self, base_rows):
+        details = [self.column(c) for c in DETAIL_COLUMNS]
+        detail_idx = 0
+
+        for row in self.core_rows():
+            if row.pop("changed"):
+                for c_idx, c in enumerate(DETAIL_COLUMNS):
+                    row[c] = details[c_idx][detail_idx]
+
+                detail_idx += 1
+            else:
+                base_row = base_rows[row["id"]]
+
+                for c in DETAIL_COLUMNS:
+                    row[c] = base_row[c]
+
+            yield row
+
+
+class SnapshotReader:
+    """
+    Reads both columnar snapshots and the legacy JSON lines files. Reconstructed snapshots are cached, so reading
+    files in chronological order only decodes each delta once.
+    """
+    def __init__(self, storage_dir):
+        self.storage_dir = storage_dir
+        self.decompressor = zstandard.ZstdDecompressor()
+        self.last_name = None
+        self.last_rows = {}
+
+    def read(self, file_name):
+        with open(os.path.join(self.storage_dir, file_name), "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("{} is not a snapshot file".format(file_name))
+
+            # One zstd frame per chunk
+            payload = self.decompressor.stream_reader(io.BytesIO(f.read()), read_across_frames=True).read()
+
+        chunks = []
+        chunk_start = 0
+
+        while chunk_start < len(payload):
+            header_length = struct.unpack_from("<I", payload, chunk_start)[0]
+            header = json.loads(payload[chunk_start + 4:chunk_start + 4 + header_length].decode("utf8"))
+
+            if header["version"] not in SUPPORTED_VERSIONS:
+                raise ValueError("Unsupported snapshot version: {}".format(header["version"]))
+
+            arrays = {}
+            blob_start = chunk_start + 4 + header_length
+
+            for name, (typecode, offset, length) in header["arrays"].items():
+                arrays[name] = array(typecode)
+                arrays[name].frombytes(payload[blob_start + offset:blob_start + offset + length])
+
+            chunks.append((header, arrays))
+            chunk_start = blob_start + sum([length for _, _, length in header["arrays"].values()])
+
+        if not chunks:
+            raise ValueError("{} is empty".format(file_name))
+
+        return Snapshot(chunks)
+
+    def read_json(self, file_name):
+        with open(os.path.join(self.storage_dir, file_name), "rb") as f:
+            for l in f:
+                data = orjson.loads(l)
+
+                for stream in data["data"]:
+                    stream["timestamp"] = data["timestamp"]
+                    yield stream
+
+    def rows_by_id(self, file_name):
+        if file_name == self.last_name:
+            return self.last_rows
+
+        snapshot = self.read(file_name)
+        base_rows = self.rows_by_id(snapshot.base) if snapshot.base else {}
+
+        self.last_rows = {row["id"]: row for row in snapshot.rows(base_rows)}
+        self.last_name = file_name
+
+        return self.last_rows
+
+    def rows(self, file_name):
+        # Full Helix objects (plus the page timestamp) for every stream in the snapshot
+        if not is_snapshot(file_name):
+            return self.read_json(file_name)
+
+        # Copies: the cached rows are the base of the next snapshot
+        return (dict(row) for row in self.rows_by_id(file_name).values())
+
+    def core_rows(self, file_name):
+        # id, user_id, game_id, viewer_count and timestamp for every stream, without touching the base snapshots
+        if not is_snapshot(file_name):
+            return self.read_json(file_name)
+
+        return self.read(file_name).core_rows()
+
+    def changed_rows(self, file_name):
+        # Only the streams that are new or changed with respect to the previous snapshot
+        if not is_snapshot(file_name):
+            return self.read_json(file_name)
+
+        return self.read(file_name).changed_rows()
+
+
+class SnapshotWriter:
+    """
+    Accumulates the pages of one snapshot and writes them as dictionary-encoded, zstd-compressed columns, delta encoded
+    against a base snapshot. Every keyframe_interval snapshots a full snapshot (no base) is written to bound the
+    length of the chain a reader needs to reconstruct. Rows are written in chunks of chunk_rows as soon as they are
+    gathered, so only one chunk is held in memory.
+    """
+    def __init__(self, storage_dir, file_name, base_name=None, keyframe_interval=48, compression_level=3, chunk_rows=20000):
+        self.storage_dir = storage_dir
+        self.file_name = file_name
+        self.base_name = base_name
+        self.keyframe_interval = keyframe_interval
+        self.compressor = zstandard.ZstdCompressor(level=compression_level)
+        self.chunk_rows = chunk_rows
+        self.rows = []
+        self.file = None
+        self.base = None
+        self.base_keys = {}
+        self.written = 0
+        self.changed = 0
+
+    def add_page(self, data):
+        for stream in data["data"]:
+            self.rows.append((stream, data["timestamp"]))
+
+        if len(self.rows) >= self.chunk_rows:
+            self.flush()
+
+    def load_base(self):
+        if not self.base_name or not os.path.isfile(os.path.join(self.storage_dir, self.base_name)):
+            return None, {}
+
+        reader = SnapshotReader(self.storage_dir)
+        base = reader.read(self.base_name)
+
+        if base.depth + 1 >= self.keyframe_interval:
+            return None, {}
+
+        return base, {row_id: row_key(row) for row_id, row in reader.rows_by_id(self.base_name).items()}
+
+    def encode_chunk(self):
+        changed = array("B", [int(self.base_keys.get(row["id"]) != row_key(row)) for row, _ in self.rows])
+        changed_rows = [row for (row, _), c in zip(self.rows, changed) if c]
+
+        dictionaries = {}
+        arrays = {
+            "viewer_count": array("q", [row.get("viewer_count", 0) for row, _ in self.rows]),
+            "timestamp": array("d", [ts for _, ts in self.rows]),
+            "changed": changed
+        }
+
+        for c in CORE_COLUMNS:
+            dictionaries[c], arrays[c] = dictionary_encode([row.get(c) for row, _ in self.rows])
+
+        for c in DETAIL_COLUMNS:
+            dictionaries[c], arrays[c] = dictionary_encode([row.get(c) for row in changed_rows])
+
+        blobs = []
+        offsets = {}
+        offset = 0
+
+        for name, values in arrays.items():
+            blob = values.tobytes()
+            offsets[name] = [values.typecode, offset, len(blob)]
+            blobs.append(blob)
+            offset += len(blob)
+
+        header = json.dumps({
+            "version": VERSION,
+            "base": self.base_name if self.base else None,
+            "depth": self.base.depth + 1 if self.base else 0,
+            "rows": len(self.rows),
+            "changed": len(changed_rows),
+            "dictionaries": dictionaries,
+            "arrays": offsets
+        }).encode("utf8")
+
+        return struct.pack("<I", len(header)) + header + b"".join(blobs), len(changed_rows)
+
+    def flush(self):
+        # Writes the rows gathered so far as one chunk
+        if self.file is None:
+            self.base, self.base_keys = self.load_base()
+            self.file = open(os.path.join(self.storage_dir, self.file_name), "wb")
+            self.file.write(MAGIC)
+
+        payload, changed = self.encode_chunk()
+
+        self.file.write(self.compressor.compress(payload))
+        self.file.flush()
+
+        self.written += len(self.rows)
+        self.changed += changed
+        self.rows = []
+
+    def close(self):
+        # An empty snapshot still gets one (empty) chunk
+        if self.rows or self.file is None:
+            self.flush()
+
+        self.file.close()
+
+        return self.written, self.changed
@@ -1,91 +1,233 @@
-import json
+import asyncio
 import datetime
+import aiohttp
 
 from storage.local_controller import LocalController
-from time import sleep
 
-from config import safety_factor, path_to_storage, redis_host, redis_port, redis_password
+from config import path_to_storage, redis_host, redis_port, redis_password, twitch_api_url, rate_limit_reserve, \
+    max_retries, connection_pool_size, request_timeout, twitch_api_id, twitch_client_secret, twitch_credentials, partitioned_crawl, \
+    partition_games, top_games_pages, remainder_max_pages, workers_per_credential, shared_rate_limit
 from logger import get_logger
-from twitch_api_calls import get_api_token, get_header, get_request
+from rate_limiter import get_bucket
+from twitch_api_calls import get_api_token, get_header
 
 
-def check_rate_limits(logger, streams_response):
-    available_tokens = int(streams_response.headers.get('ratelimit-remaining'))
-    total_tokens = int(streams_response.headers.get('ratelimit-limit'))
+async def fetch_page(session, bucket, url, params, logger, auth=None):
+    # With auth (AppToken) the token is sent with each request and replaced when Helix rejects it
+    for attempt in range(max_retries):
+        await bucket.acquire()
+        token = auth.token if auth else None
 
-    logger.info('Tokens: Available {}, Total {}'.format(available_tokens, total_tokens))
+        try:
+            async with session.get(url, params=params, headers=auth.header() if auth else None) as response:
+                if response.status == 401 and auth:
+                    logger.info("Token rejected, getting a new one")
+                    await auth.refresh(token)
+                    continue
 
-    if safety_factor * total_tokens > available_tokens:
-        # You are under the safety level, it's better to backoff
-        sleep(5)
+                if response.status == 429:
+                    logger.info("Rate limit exceeded, waiting for the bucket to refill")
+                    bucket.exhausted(response.headers)
+                    continue
 
+                bucket.update(response.headers)
 
-def get_all_streams(token, storage):
+                if response.status >= 500:
+                    logger.info("Server error: code {}. Attempt {}/{}".format(response.status, attempt + 1, max_retries))
+                    continue
+
+                if response.status != 200:
+                    logger.debug("Anomalous exit: code {}".format(response.status))
+                    return None
+
+                return await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.info("Request failed: {}. Attempt {}/{}".format(e, attempt + 1, max_retries))
+
+    return None
+
+
+async def crawl(session, bucket, api_url, params, pages, logger, max_pages=0):
+    # Pagination is cursor-sequential: walk the cursor and hand each page to the writer as soon as it arrives
+    url = "{}/streams".format(api_url)
+    params = {**params, "first": "100"}
+    crawled = 0
+
+    while True:
+        streams = await fetch_page(session, bucket, url, params, logger)
+
+        if streams is None:
+            return False
+
+        await pages.put({'data': streams.get('data', []), 'timestamp': datetime.datetime.utcnow().timestamp()})
+        crawled += 1
+
+        next_pointer = streams.get('pagination', {}).get('cursor', '')
+        if not next_pointer:
+            return True
+
+        if crawled == max_pages:
+            logger.info("Page limit reached ({} pages), the rest of the listing is left to the game partitions".format(max_pages))
+            return True
+
+        params["after"] = next_pointer
+
+
+async def get_top_games(session, bucket, api_url, logger):
+    # Ids of the top games, and whether all the pages requested could be fetched
+    url = "{}/games/top".format(api_url)
+    params = {"first": "100"}
+    games = []
+    crawled = 0
+
+    while True:
+        top_games = await fetch_page(session, bucket, url, params, logger)
+
+        if top_games is None:
+            return games, False
+
+        games.extend([x["id"] for x in top_games.get('data', [])])
+        crawled += 1
+
+        next_pointer = top_games.get('pagination', {}).get('cursor', '')
+        if not next_pointer or crawled == top_games_pages:
+            return games, True
+
+        params["after"] = next_pointer
+
+
+async def crawl_partitions(session, bucket, api_url, partitions, pages, logger):
+    completed = True
+
+    while not partitions.empty():
+        params, max_pages = partitions.get_nowait()
+        completed = await crawl(session, bucket, api_url, params, pages, logger, max_pages) and completed
+
+    return completed
+
+
+async def store_pages(pages, storage):
+    loop = asyncio.get_running_loop()
+    seen = set()
+
+    while True:
+        data_to_save = await pages.get()
+
+        if data_to_save is None:
+            break
+
+        # Partitions overlap (and cursors shift while streams change viewers): keep the first copy of each stream
+        data_to_save['data'] = [x for x in data_to_save['data'] if x["id"] not in seen]
+        seen.update([x["id"] for x in data_to_save['data']])
+
+        users = [{"id": x["user_id"], "name": x["user_login"]} for x in data_to_save['data']]
+
+        await loop.run_in_executor(None, storage.save_streams, data_to_save)
+        await loop.run_in_executor(None, storage.save_users, users)
+
+
+async def gather_streams(token, storage, api_url=twitch_api_url):
     logger = get_logger("streams_gatherer")
 
     logger.info('Starting gathering')
 
-    streams_url = "https://api.twitch.tv/helix/streams?first=100"
-    streams_response = get_request(streams_url, headers=get_header(token))
+    bucket = get_bucket(twitch_api_id, rate_limit_reserve, storage.users_storage if shared_rate_limit else None)
+    pages = asyncio.Queue(maxsize=connection_pool_size * 10)
+
+    connector = aiohttp.TCPConnector(limit=connection_pool_size)
+    timeout = aiohttp.ClientTimeout(total=request_timeout)
+
+    async with aiohttp.ClientSession(headers=get_header(token), connector=connector, timeout=timeout) as session:
+        writer = asyncio.create_task(store_pages(pages, storage))
+        completed = await crawl(session, bucket, api_url, {}, pages, logger)
+
+        await pages.put(None)
+        await writer
 
-    if streams_response:
-        if streams_response.status_code == 429:
-            # Worst case scenario: you managed to exceed the rate limit, backoff for a long time
-            sleep(60)
+    if completed:
+        # Signal that the gathering has finished
+        logger.info('Finished gathering')
+        storage.finish()
 
-        if streams_response.status_code != 200:
-            logger.debug("Anomalous exit: code {}".format(streams_response.status_code))
+    return completed
 
-            return
 
-        check_rate_limits(logger, streams_response)
-        streams = json.loads(streams_response.content.decode('utf-8'))
+async def gather_streams_partitioned(credentials, storage, api_url=twitch_api_url):
+    # One independent cursor per game (plus a remainder cursor over the whole listing) shared among workers of
+    # every credential, each credential with its own rate limit budget
+    logger = get_logger("streams_gatherer")
 
-        top_streams = streams.get('data')
-        next_pointer = streams['pagination'].get('cursor', '')
-        data_to_save = {'data': top_streams, 'timestamp': datetime.datetime.utcnow().timestamp()}
-        users = [{"id": x["user_id"], "name": x["user_login"]} for x in top_streams]        
+    logger.info('Starting partitioned gathering. Credentials: {}'.format(len(credentials)))
 
-        storage.save_streams(data_to_save)
-        storage.save_users(users)
+    pages = asyncio.Queue(maxsize=connection_pool_size * 10)
 
-        while next_pointer:
-            streams_url_continuation = "https://api.twitch.tv/helix/streams?" \
-                                       "first=100&after={}".format(next_pointer)
-            streams_response = get_request(streams_url_continuation, headers=get_header(token))
+    connector = aiohttp.TCPConnector(limit=connection_pool_size * len(credentials))
+    timeout = aiohttp.ClientTimeout(total=request_timeout)
 
-            if streams_response:
-                if streams_response.status_code == 429:
-                    # Worst case scenario: you managed to exceed the rate limit, backoff for a long time
-                    sleep(60)
+    sessions = [aiohttp.ClientSession(headers=get_header(token, client_id), connector=connector, connector_owner=False, timeout=timeout)
+                for client_id, token in credentials]
+    buckets = [get_bucket(client_id, rate_limit_reserve, storage.users_storage if shared_rate_limit else None) for client_id, _ in credentials]
 
-                if streams_response.status_code != 200:
-                    logger.debug("Anomalous exit: code {}".format(streams_response.status_code))
-                    return
+    try:
+        games, games_complete = await get_top_games(sessions[0], buckets[0], api_url, logger)
 
-                check_rate_limits(logger, streams_response)
-                streams = json.loads(streams_response.content.decode('utf-8'))
-                next_pointer = streams['pagination'].get('cursor', '')
+        # Streams of the games left out are only found by the remainder: without the full list of top games, walk all of it
+        max_pages = remainder_max_pages if games_complete else 0
 
-                data_to_save = {'data': streams.get('data'), 'timestamp': datetime.datetime.utcnow().timestamp()}
-                users = [{"id": x["user_id"], "name": x["user_login"]} for x in streams.get('data')]
+        if not games_complete:
+            logger.info("Top games could not be fetched ({} found), crawling the remainder without page limit".format(len(games)))
 
-                storage.save_streams(data_to_save)
-                storage.save_users(users)
-                
+        partitions = asyncio.Queue()
+        # The remainder is the longest walk, start it first
+        partitions.put_nowait(({}, max_pages))
 
-        # Signal that the gathering has finished
+        for game_id in dict.fromkeys(partition_games + games):
+            partitions.put_nowait(({"game_id": game_id}, 0))
+
+        logger.info('Partitions: {}'.format(partitions.qsize()))
+
+        writer = asyncio.create_task(store_pages(pages, storage))
+        workers = [crawl_partitions(session, bucket, api_url, partitions, pages, logger)
+                   for session, bucket in zip(sessions, buckets) for _ in range(workers_per_credential)]
+
+        completed = all(await asyncio.gather(*workers))
+
+        await pages.put(None)
+        await writer
+    finally:
+        for session in sessions:
+            await session.close()
+
+        await connector.close()
+
+    if completed:
         logger.info('Finished gathering')
         storage.finish()
 
+    return completed
+
+
+def get_all_streams(token, storage, api_url=twitch_api_url):
+    return asyncio.run(gather_streams(token, storage, api_url))
+
+
+def get_all_streams_partitioned(credentials, storage, api_url=twitch_api_url):
+    return asyncio.run(gather_streams_partitioned(credentials, storage, api_url))
+
 
 def main():
-    token = get_api_token()
     storage = LocalController(path_to_storage, {"host": redis_host, "port": redis_port, "password": redis_password})
-    
-    get_all_streams(token, storage)
+
+    if partitioned_crawl:
+        credentials = [{"id": twitch_api_id, "secret": twitch_client_secret}] + twitch_credentials
+        tokens = [(c["id"], get_api_token(c["id"], c["secret"])) for c in credentials]
+
+        get_all_streams_partitioned([x for x in tokens if x[1]], storage)
+    else:
+        token = get_api_token()
+
+        get_all_streams(token, storage)
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,112 @@
+import json
+import math
+import os
+
+from datetime import datetime
+from game_summary import new_state, extend_state, finalize_state
+
+
+def viewers_bucket(viewers, base):
+    return int(math.log(viewers + 1, base))
+
+
+class StreamStateTracker:
+    """
+    Per-stream state machine fed by the samples of track_current. Consecutive samples with the same game, title and
+    viewers bucket are run-length encoded: only transitions are returned to be stored, and the game summary of a
+    stream is finalized as soon as the stream ends, without re-reading its samples.
+
+    The state is kept in memory and checkpointed to Redis (stream_states hash) so that a restart does not lose the
+    streams in progress.
+    """
+    def __init__(self, cache, storage_dir, viewers_bucket_base=2, end_timeout=900):
+        self.cache = cache
+        self.storage_dir = storage_dir
+        self.viewers_bucket_base = viewers_bucket_base
+        self.end_timeout = end_timeout
+
+        self.states = {k.decode("utf8"): json.loads(v.decode("utf8")) for k, v in cache.hgetall("stream_states").items()}
+        self.dirty = set()
+
+    def observe(self, sample, user_id):
+        stream_id = sample["stream_id"]
+        state = self.states.get(stream_id)
+        bucket = viewers_bucket(sample["viewers"], self.viewers_bucket_base)
+
+        # Copy: the sample dict is handed to Mongo afterwards, which adds an _id to it
+        sample = dict(sample)
+
+        if state is None:
+            # summary: game changes as compress_stream_data finds them in all the samples (process_all_streams' state)
+            self.states[stream_id] = {"user_id": user_id, "game": sample["game"], "title": sample["title"], "bucket": bucket,
+                                      "samples": [sample], "last": sample, "summary": extend_state(new_state(user_id), [sample])}
+            self.dirty.add(stream_id)
+
+            return True
+
+        transition = (sample["game"], sample["title"], bucket) != (state["game"], state["title"], state["bucket"])
+
+        extend_state(state["summary"], [sample])
+
+        state["game"] = sample["game"]
+        state["title"] = sample["title"]
+        state["bucket"] = bucket
+        state["last"] = sample
+
+        if transition:
+            state["samples"].append(sample)
+            self.dirty.add(stream_id)
+
+        return transition
+
+    def update(self, samples, stream_metadata):
+        return [s for s in samples if self.observe(s, stream_metadata[s["stream_id"]]["user_id"])]
+
+    def expired(self):
+        # Streams the API has not returned for a while
+        now = datetime.now().timestamp()
+
+        return [stream_id for stream_id, state in self.states.items() if now - state["last"]["ts"] > self.end_timeout]
+
+    def write_samples(self, stream_id, state):
+        start_day = datetime.fromtimestamp(state["samples"][0]["ts"]).strftime("%Y-%m-%d")
+
+        if not os.path.isdir("{}/{}".format(self.storage_dir, start_day)):
+            os.makedirs("{}/{}".format(self.storage_dir, start_day))
+
+        samples = state["samples"] if state["samples"][-1] == state["last"] else state["samples"] + [state["last"]]
+
+        with open("{}/{}/stream_data-{}.json".format(self.storage_dir, start_day, stream_id), "w+") as f:
+            for sample in samples:
+                f.write("{}\n".format(json.dumps(sample)))
+
+    def finish(self, stream_ids):
+        summaries = []
+        finished = []
+
+        for stream_id in stream_ids:
+            state = self.states.pop(stream_id, None)
+            self.dirty.discard(stream_id)
+
+            if state is None:
+                continue
+
+            summarized_stream = finalize_state(state["summary"])
+
+            self.write_samples(stream_id, state)
+            summaries.append({"user_id": state["user_id"], "stream_id": stream_id, "changes": len(summarized_stream)-1, "games": summarized_stream})
+            finished.append(stream_id)
+
+        if finished:
+            self.cache.hdel("stream_states", *finished)
+
+        return summaries
+
+    def checkpoint(self, full=False):
+        # Transitions are saved every cycle, the last seen time of unchanged streams only on full checkpoints
+        to_save = list(self.states.keys()) if full else list(self.dirty)
+
+        if to_save:
+            self.cache.hset("stream_states", mapping={stream_id: json.dumps(self.states[stream_id]) for stream_id in to_save})
+
+        self.dirty = set()
@@ -0,0 +1,60 @@
+import os
+
+from storage.snapshot_format import SnapshotReader, SnapshotWriter
+
+
+def page(ids, ts, title="title"):
+    return {"timestamp": ts, "data": [{"id": str(i), "user_id": str(i * 10), "game_id": "1", "user_login": "u{}".format(i), "user_name": "U{}".format(i),
+                                       "game_name": "game", "type": "live", "title": title if i % 2 else "other", "tags": ["English"], "tag_ids": [],
+                                       "language": "en", "started_at": "2021-05-01T00:00:00Z", "thumbnail_url": "", "is_mature": False,
+                                       "viewer_count": i} for i in ids]}
+
+
+def write(storage_dir, file_name, pages, base_name=None, chunk_rows=20000):
+    writer = SnapshotWriter(storage_dir, file_name, base_name, chunk_rows=chunk_rows)
+
+    for p in pages:
+        writer.add_page(p)
+
+    return writer.close()
+
+
+def test_location_module_copy_is_identical():
+    # location-module reads the snapshots with its own copy of the module
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    with open(os.path.join(here, "storage", "snapshot_format.py"), "rb") as f:
+        original = f.read()
+
+    with open(os.path.join(here, "..", "location-module", "snapshot_format.py"), "rb") as f:
+        assert f.read() == original
+
+
+def test_chunks_are_written_as_gathered(tmp_path):
+    writer = SnapshotWriter(str(tmp_path), "a.tsnap", chunk_rows=150)
+    writer.add_page(page(range(100), 1.0))
+    assert not os.path.exists(str(tmp_path / "a.tsnap"))
+
+    writer.add_page(page(range(100, 200), 2.0))
+    assert os.path.getsize(str(tmp_path / "a.tsnap")) > 0
+    assert writer.rows == []
+
+    writer.add_page(page(range(200, 250), 3.0))
+    assert writer.close() == (250, 250)
+
+
+def test_chunked_delta_snapshots_round_trip(tmp_path):
+    first = [page(range(0, 100), 1.0), page(range(100, 200), 1.0)]
+    second = [page(range(50, 150), 2.0, title="changed"), page(range(150, 260), 2.0)]
+
+    write(str(tmp_path), "a.tsnap", first, chunk_rows=70)
+    assert write(str(tmp_path), "b.tsnap", second, base_name="a.tsnap", chunk_rows=70) == (210, 110)
+
+    reader = SnapshotReader(str(tmp_path))
+    snapshot = reader.read("b.tsnap")
+    assert len(snapshot) == 210 and len(snapshot.chunks) == 2
+
+    expected = [dict(row, timestamp=2.0) for p in second for row in p["data"]]
+    assert sorted(reader.rows("b.tsnap"), key=lambda row: row["id"]) == sorted(expected, key=lambda row: row["id"])
+    assert [row["id"] for row in reader.core_rows("b.tsnap")] == [row["id"] for row in expected]
+    assert len(list(reader.changed_rows("b.tsnap"))) == 110
@@ -0,0 +1,61 @@
+from game_summary import compress_entries
+from stream_state import StreamStateTracker
+
+
+class DictCache:
+    # The few hash commands of Redis used by StreamStateTracker
+    def __init__(self):
+        self.hashes = {}
+
+    def hgetall(self, name):
+        return {k.encode("utf8"): v.encode("utf8") for k, v in self.hashes.get(name, {}).items()}
+
+    def hset(self, name, mapping):
+        self.hashes.setdefault(name, {}).update(mapping)
+
+    def hdel(self, name, *keys):
+        for key in keys:
+            self.hashes.get(name, {}).pop(key, None)
+
+
+def sample(ts, game, title="title", viewers=100):
+    return {"stream_id": "1", "ts": ts, "game": game, "title": title, "viewers": viewers}
+
+
+def summarize(samples, tmp_path, restart_after=None):
+    cache = DictCache()
+    tracker = StreamStateTracker(cache, str(tmp_path))
+
+    for idx, s in enumerate(samples):
+        tracker.update([s], {"1": {"user_id": "10"}})
+
+        if idx == restart_after:
+            tracker.checkpoint(full=True)
+            tracker = StreamStateTracker(cache, str(tmp_path))
+
+    return tracker.finish(["1"])[0]
+
+
+CASES = [
+    [sample(100, "a")],
+    [sample(100, "a"), sample(160, "a")],
+    [sample(100, "a"), sample(160, "b")],
+    [sample(100, "a"), sample(160, "b"), sample(220, "b")],
+    [sample(100, "a"), sample(160, "a", title="other"), sample(220, "b"), sample(280, "a", viewers=5000), sample(340, "a")],
+    [sample(100, "a"), sample(160, "a"), sample(220, "a"), sample(280, "b")],
+]
+
+
+def test_finish_matches_compress_entries(tmp_path):
+    for samples in CASES:
+        summary = summarize(samples, tmp_path)
+        games = compress_entries(samples)
+
+        assert summary["games"] == games
+        assert summary["changes"] == len(games) - 1
+
+
+def test_finish_matches_compress_entries_after_restart(tmp_path):
+    for samples in CASES:
+        for restart_after in range(len(samples)):
+            assert summarize(samples, tmp_path, restart_after)["games"] == compress_entries(samples)
@@ -1,15 +1,25 @@
+import asyncio
 import json
 import redis
 import hashlib
 import hmac
+import timeit
+import aiohttp
 
 from storage.mongo_controller import MongoController
 
 from datetime import datetime
-from config import redis_host, redis_port, redis_password, secret_key
+from config import redis_host, redis_port, redis_password, secret_key, tracking_interval, twitch_api_url, rate_limit_reserve, \
+    connection_pool_size, request_timeout, chunk_latency_buckets, ingest_time_summaries, viewers_bucket_base, stream_end_timeout, \
+    state_checkpoint_cycles, fine_grained_tmp_storage, interval_index_path, twitch_api_id, shared_rate_limit, publish_game_changes, \
+    game_changes_channel
+from interval_index import append_summaries
 from logger import get_logger
-from twitch_api_calls import get_api_token, get_header, get_request
-from stream_gatherer import check_rate_limits
+from metrics import Histogram
+from rate_limiter import get_bucket
+from stream_state import StreamStateTracker
+from twitch_api_calls import AppToken
+from stream_gatherer import fetch_page
 
 
 def format_stream_data(data):
@@ -31,11 +41,50 @@ def format_stream_data(data):
     return stream_starts, game_names, list_to_store
 
 
-def get_current_streams(token, storage):
-    logger = get_logger("track_current")
+async def poll_chunk(session, bucket, api_url, chunk, latencies, logger, auth=None):
+    # Without first=100 Helix only returns the first 20 live streams of the chunk
+    start_time = timeit.default_timer()
+    response = await fetch_page(session, bucket, "{}/streams".format(api_url), [("first", "100")] + [("user_id", user) for user in chunk], logger, auth)
+
+    latencies.observe(timeit.default_timer() - start_time)
+
+    if response is None:
+        logger.info("Query failed! Chunk of {} users".format(len(chunk)))
+
+    return response
+
+
+def announce_game_changes(cache, last_games, samples, tracked):
+    """
+    Streams seen with another game than in the previous cycle (or for the first time): stream_games is updated and the
+    change published on game_changes_channel, so that downloaders pause streams that switched to a game not probed without
+    waiting for the next API round of the coordinator. last_games (stream id -> Twitch game id) is updated in place.
+    """
+    changed = {sample["stream_id"]: sample["game"] for sample in samples if last_games.get(sample["stream_id"]) != sample["game"]}
+    gone = [stream_id for stream_id in last_games if stream_id not in tracked]
+
+    pipeline = cache.pipeline(transaction=False)
+
+    if changed:
+        pipeline.hset("stream_games", mapping=changed)
+    for stream_id, game in changed.items():
+        pipeline.publish(game_changes_channel, json.dumps({"id": stream_id, "game_id": game}))
+    if gone:
+        pipeline.hdel("stream_games", *gone)
+
+    pipeline.execute()
+
+    last_games.update(changed)
+    for stream_id in gone:
+        last_games.pop(stream_id)
+
+    return len(changed)
+
+
+async def get_current_streams(session, bucket, cache, storage, logger, api_url=twitch_api_url, tracker=None, last_games=None, auth=None,
+                              index_path=interval_index_path):
     logger.info('Starting gathering')
 
-    cache = redis.Redis(host=redis_host, port=redis_port, password=redis_password)
     users = []
 
     streams_last_time = {}
@@ -57,10 +106,14 @@ def get_current_streams(token, storage):
 
         active_users[decoded_v["twitch_id"]] = decoded_v["id"]
     
-    for twitch_id, stream in streams_last_time.items():
-        user_id = hmac.new(secret_key.encode("utf-8"), twitch_id.encode("utf-8"), hashlib.sha1).hexdigest()
-        
-        cache.sadd("finished_streams", json.dumps({"user_id": user_id, "stream_id": stream}))
+    if tracker:
+        # Summaries are finalized right away, nothing is left for compress_stream_data
+        finish_streams(tracker, storage, list(streams_last_time.values()) + tracker.expired(), logger, index_path)
+    else:
+        for twitch_id, stream in streams_last_time.items():
+            user_id = hmac.new(secret_key.encode("utf-8"), twitch_id.encode("utf-8"), hashlib.sha1).hexdigest()
+            
+            cache.sadd("finished_streams", json.dumps({"user_id": user_id, "stream_id": stream}))
 
     for current_user, stream in active_users.items():
         cache.sadd("active_streams", json.dumps({"twitch_id": current_user, "stream_id": stream}))
@@ -70,58 +123,81 @@ def get_current_streams(token, storage):
 
     logger.info('Current users: {}'.format(len(users)))
 
-    streams_url = "https://api.twitch.tv/helix/streams?user_id={}".format(users[0])
-    counter = 0
-    total = 0
-
-    for user in users[1:]:    
-        if counter >= 99:
-            response = get_request(streams_url, headers=get_header(token))
-            if response and response.status_code == 200:
-                response_json =  json.loads(response.text)
-                
-                stream_metadata, game_names, list_to_store = format_stream_data(response_json)
-                storage.save_stream_metadata(stream_metadata)
-                storage.save_game_name_mapping(game_names)
-                storage.save_stream_data(list_to_store)
-                
-                logger.info('Processing: {}/{}'.format(100*total, len(users)))
-            
-            check_rate_limits(logger, response)
+    # All chunks are sent at once: the shared rate limiter and the connection pool decide how many are in flight
+    chunk_size = 100
+    chunks = [users[i:i + chunk_size] for i in range(0, len(users), chunk_size)]
+    latencies = Histogram(chunk_latency_buckets)
+
+    responses = await asyncio.gather(*[poll_chunk(session, bucket, api_url, chunk, latencies, logger, auth) for chunk in chunks])
+
+    stream_metadata, game_names, list_to_store = {}, {}, []
+
+    for response_json in responses:
+        if response_json:
+            chunk_metadata, chunk_game_names, chunk_to_store = format_stream_data(response_json)
+
+            stream_metadata.update(chunk_metadata)
+            game_names.update(chunk_game_names)
+            list_to_store.extend(chunk_to_store)
+
+    if last_games is not None:
+        logger.info('Game changes: {}'.format(announce_game_changes(cache, last_games, list_to_store, set(active_users.values()))))
+
+    if tracker:
+        list_to_store = tracker.update(list_to_store, stream_metadata)
+
+    storage.save_stream_metadata(stream_metadata)
+    storage.save_game_name_mapping(game_names)
+    storage.save_stream_data(list_to_store)
+
+    logger.info('Processed: {}/{} chunks. Chunk latency: {}'.format(len([x for x in responses if x]), len(chunks), latencies.summary()))
+    logger.info('Finished gathering. Mongo writes: {}'.format(storage.report()))
 
-            counter = 0
-            total += 1
-            streams_url = "https://api.twitch.tv/helix/streams?user_id={}".format(user)
-        
-            continue
-            
-        streams_url = "{}&user_id={}".format(streams_url, user)
-        counter += 1
-        
-    response = get_request(streams_url, headers=get_header(token))
-    if response and response.status_code == 200:
-        response_json =  json.loads(response.text)
-        
-        if response and response.status_code == 200:
-            response_json =  json.loads(response.text)    
-            stream_metadata, game_names, list_to_store = format_stream_data(response_json)
-            
-            storage.save_stream_metadata(stream_metadata)
-            storage.save_game_name_mapping(game_names)
-            storage.save_stream_data(list_to_store)
 
-            logger.info('Processing: {}/{}'.format(100*total + counter, len(users)))
+def finish_streams(tracker, storage, stream_ids, logger, index_path=interval_index_path):
+    summaries = tracker.finish(stream_ids)
 
-    logger.info('Finished gathering')
+    if summaries:
+        logger.info("Finished streams: {}".format(len(summaries)))
+
+        storage.save_summaries(summaries)
+        append_summaries(index_path, summaries)
+        storage.delete_stream_data([x["stream_id"] for x in summaries])
+
+
+async def track_streams(auth, storage, logger, api_url=twitch_api_url):
+    # Long running: keep-alive connections, the rate limit bucket, the app token and the storage caches survive between cycles
+    cache = redis.Redis(host=redis_host, port=redis_port, password=redis_password)
+    bucket = get_bucket(twitch_api_id, rate_limit_reserve, cache if shared_rate_limit else None)
+    tracker = StreamStateTracker(cache, fine_grained_tmp_storage, viewers_bucket_base, stream_end_timeout) if ingest_time_summaries else None
+    last_games = {k.decode("utf8"): v.decode("utf8") for k, v in cache.hgetall("stream_games").items()} if publish_game_changes else None
+    cycles = 0
+
+    connector = aiohttp.TCPConnector(limit=connection_pool_size)
+    timeout = aiohttp.ClientTimeout(total=request_timeout)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        while True:
+            # A failed cycle (Redis, Mongo) is logged and the next one runs as usual
+            try:
+                await get_current_streams(session, bucket, cache, storage, logger, api_url, tracker, last_games, auth)
+
+                if tracker:
+                    cycles += 1
+                    tracker.checkpoint(full=cycles % state_checkpoint_cycles == 0)
+            except Exception as e:
+                logger.exception("Tracking cycle failed: {}".format(e))
+
+            await asyncio.sleep(tracking_interval)
 
 
 def main():
-    token = get_api_token()
+    logger = get_logger("track_current")
+    auth = AppToken()
     storage = MongoController()
     
-    get_current_streams(token, storage)
+    asyncio.run(track_streams(auth, storage, logger))
 
 
 if __name__ == '__main__':
     main()
-
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import requests
 
@@ -18,10 +19,10 @@ def post_request(url):
         return False
 
 
-def get_api_token():
+def get_api_token(client_id=twitch_api_id, client_secret=twitch_client_secret):
     params = {
-        "client_id": twitch_api_id,
-        "client_secret": twitch_client_secret,
+        "client_id": client_id,
+        "client_secret": client_secret,
         "grant_type": "client_credentials"
     }
 
@@ -35,8 +36,35 @@ def get_api_token():
         return json.loads(auth).get("access_token", "")
 
 
-def get_header(token):
+def get_header(token, client_id=twitch_api_id):
     return {
-        "Client-ID": twitch_api_id,
+        "Client-ID": client_id,
         "Authorization": "Bearer {}".format(token)
     }
+
+
+class AppToken:
+    """
+    App access token of a long running process. When Helix rejects it (401) it is replaced once, however many requests
+    failed together with it.
+    """
+    def __init__(self, client_id=twitch_api_id, client_secret=twitch_client_secret):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token = get_api_token(client_id, client_secret)
+        self.lock = None
+
+    def header(self):
+        return get_header(self.token, self.client_id)
+
+    async def refresh(self, rejected_token):
+        # Created here so that it belongs to the running event loop
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        async with self.lock:
+            if self.token == rejected_token:
+                token = await asyncio.get_running_loop().run_in_executor(None, get_api_token, self.client_id, self.client_secret)
+
+                if token:
+                    self.token = token